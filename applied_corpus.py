@@ -0,0 +1,75 @@
+import cg_apply
+import checkpoint
+
+import hashlib
+import os
+
+# The source corpus with an output grammar already applied, kept next to
+# the grammar as <grammar>.applied/<source hash>/ in the checkpoint layout
+# (a .bin plus state.json recording the grammar text and its hash). When
+# the grammar has only grown since, just the new rules are run over the
+# stored corpus, the same way the learners apply each iteration's rules
+# to the previous iteration's output.
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as fin:
+        while chunk := fin.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def snapshot_dir(grammar_path, source_path):
+    return os.path.join(grammar_path + '.applied', file_hash(source_path))
+
+def has_rules(text):
+    return any(line.strip() and not line.lstrip().startswith('#')
+               for line in text.splitlines())
+
+def store(directory, grammar_text, corpus_path):
+    os.makedirs(directory, exist_ok=True)
+    name = text_hash(grammar_text) + '.bin'
+    path = os.path.join(directory, name)
+    if os.path.exists(path):
+        os.unlink(path)
+    checkpoint.link_or_copy(corpus_path, path)
+    checkpoint.write_state(directory, {
+        'grammar': grammar_text,
+        'grammar_hash': text_hash(grammar_text),
+        'source': name,
+    })
+    return path
+
+def save(grammar_path, source_path, corpus_path):
+    # record corpus_path as source_path with grammar_path applied
+    with open(grammar_path) as fin:
+        grammar_text = fin.read().strip()
+    return store(snapshot_dir(grammar_path, source_path), grammar_text,
+                 corpus_path)
+
+def apply(grammar_path, source_path, header):
+    # path of a .bin which is source_path with grammar_path applied
+    with open(grammar_path) as fin:
+        grammar_text = fin.read().strip()
+    directory = snapshot_dir(grammar_path, source_path)
+    state = checkpoint.load(directory)
+    if state is not None and state['grammar_hash'] == text_hash(grammar_text):
+        print(f'using pre-applied corpus {state["source"]}')
+        return state['source']
+    os.makedirs(directory, exist_ok=True)
+    out = os.path.join(directory, f'partial.{os.getpid()}.tmp')
+    if state is not None and grammar_text.startswith(state['grammar']):
+        added = grammar_text[len(state['grammar']):]
+        print(f'applying {len(added)} new characters of grammar to pre-applied corpus {state["source"]}')
+        if has_rules(added):
+            with cg_apply.Grammar(text=header + added) as g:
+                g.run_file(state['source'], out)
+        else:
+            checkpoint.link_or_copy(state['source'], out)
+    else:
+        cg_apply.apply_file(grammar_path, source_path, out)
+    path = store(directory, grammar_text, out)
+    os.unlink(out)
+    return path
@@ -0,0 +1,51 @@
+import cg3_score
+
+import struct
+
+CG_BIN_HEADER = b'CGBF\x01\x00\x00\x00'
+CG_BIN_FOOTER = b'\x02\x01\x02\x02' # FLUSH, EXIT
+
+# Several candidate rules can share one vislcg3 run as long as none of
+# them targets a window belonging to another rule in the same group,
+# so each group is a set of rules with pairwise disjoint windows.
+# (A rule could in principle create a target for a later rule in a window
+# it doesn't own, so this is a close approximation of per-rule scoring,
+# not an exact one.)
+
+def group_rules(rule_windows, max_size=0):
+    groups = []
+    for i, windows in enumerate(rule_windows):
+        for used, members in groups:
+            if max_size and len(members) >= max_size:
+                continue
+            if used.isdisjoint(windows):
+                used.update(windows)
+                members.append(i)
+                break
+        else:
+            groups.append((set(windows), [i]))
+    return [members for used, members in groups]
+
+def rule_delimiter(rule_idx):
+    text = f'<rule {rule_idx}>\n'.encode('utf-8')
+    return b'\x03' + struct.pack('<I', len(text)) + text
+
+def group_stream(blocks, rule_windows, members):
+    parts = [CG_BIN_HEADER]
+    for i in members:
+        parts.append(rule_delimiter(i))
+        parts += [blocks[w] for w in rule_windows[i]]
+    parts.append(CG_BIN_FOOTER)
+    return b''.join(parts)
+
+def group_grammar(header, rules, members):
+    return header + '\n'.join(rules[i] for i in members)
+
+def split_output(buf, rule_windows, members):
+    # text blocks (the delimiters) are skipped by iter_blocks,
+    # so split by window count instead
+    blocks = cg3_score.iter_blocks(buf)
+    ret = {}
+    for i in members:
+        ret[i] = [next(blocks) for w in rule_windows[i]]
+    return ret
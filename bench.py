@@ -0,0 +1,273 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import zlib
+
+# Benchmark the learners on a synthetic corpus. The source and target are
+# written in the apertium stream format conllu2apertium.py produces (the
+# source with <SOURCE> readings added, as the hbo-* scripts do after
+# lt-proc) and converted with cg-conv, then each learner is run for a
+# fixed number of iterations with TBL_PHASES and TBL_TRACE set so that
+# phases.py dumps its per-phase timings and spans (for summarize_logs.py
+# --trace). Everything ends up in one JSON report, which can
+# be compared against the report from another commit with --compare.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LANG = 'grc'
+PHASES = ['generation', 'intersection', 'scoring', 'apply', 'rescore']
+UPOS = ['NOUN', 'VERB', 'ADJ', 'ADV', 'PRON', 'ADP']
+RELS = ['nsubj', 'obj', 'obl', 'amod', 'advmod', 'case', 'nmod']
+CASES = {'nsubj': 'Nom', 'obj': 'Acc', 'nmod': 'Gen', 'obl': 'Dat'}
+FEATS = [('Case', ['Nom', 'Acc', 'Gen', 'Dat']),
+         ('Number', ['Sing', 'Plur']),
+         ('Gender', ['Masc', 'Fem', 'Neut']),
+         ('Person', ['1', '2', '3']),
+         ('Tense', ['Pres', 'Past', 'Fut']),
+         ('Voice', ['Act', 'Mid', 'Pass']),
+         ('Mood', ['Ind', 'Sub', 'Imp']),
+         ('Aspect', ['Perf', 'Imp'])]
+LEARNERS = ['round12', 'round13', 'round14', 'fix_tree2',
+            'lex_sel', 'lex_replace', 'lex_add', 'lex_feat', 'lex_del']
+
+parser = argparse.ArgumentParser()
+parser.add_argument('report', help='where to write the JSON report')
+parser.add_argument('--workdir', action='store', default='bench-output',
+                    help='directory for the corpora, grammars and logs')
+parser.add_argument('--sents', type=int, default=200,
+                    help='number of sentences to generate')
+parser.add_argument('--cohorts', type=int, default=8,
+                    help='average number of words per sentence')
+parser.add_argument('--lemmas', type=int, default=100,
+                    help='size of the source vocabulary')
+parser.add_argument('--ambiguity', type=int, default=3,
+                    help='number of target readings per source word')
+parser.add_argument('--feats', type=int, default=2,
+                    help='number of features on each target reading')
+parser.add_argument('--insert_rate', type=float, default=0.1,
+                    help='chance of a target-only article before a noun')
+parser.add_argument('--reattach_rate', type=float, default=0.1,
+                    help='chance of a word attaching to its grandparent in '
+                    'the fix_tree2 target')
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--learners', action='store', default=','.join(LEARNERS),
+                    help='comma-separated learners to run')
+parser.add_argument('--iterations', type=int, default=3)
+parser.add_argument('--count', type=int, default=10,
+                    help='candidates per rule type (--rule_count for lex_*)')
+parser.add_argument('--threads', type=int, default=1)
+parser.add_argument('--score_proc', action='store',
+                    help='scorer for the lex_* scripts')
+parser.add_argument('--compare', action='store',
+                    help='earlier report to print timings against')
+args = parser.parse_args()
+
+def gen_dictionary(r):
+    # source lemma => (upos, [target lemma]), target lemma => default feats
+    feats = FEATS[:args.feats]
+    lex = {}
+    defaults = {}
+    for i in range(args.lemmas):
+        upos = r.choice(UPOS)
+        tgts = [f'"t{i}_{j}"' for j in range(args.ambiguity)]
+        lex[f'"s{i}"'] = (upos, tgts)
+        for t in tgts:
+            defaults[t] = [f'{k}={r.choice(vs)}' for k, vs in feats]
+    return lex, defaults
+
+def gen_sentence(r, lex, defaults):
+    # (source line, target line, tree target line); the right translation
+    # of a word and its case depend on its head and relation, so there is
+    # something to learn. fix_tree2 needs the same words on both sides, so
+    # it gets a target without articles where some words are reattached
+    lemmas = sorted(lex)
+    n = max(2, round(r.gauss(args.cohorts, args.cohorts / 3)))
+    words = []
+    for i in range(1, n + 1):
+        # one root, like UD trees (WindowLinearizer relies on it)
+        head = r.randrange(1, i) if i > 1 else 0
+        words.append([r.choice(lemmas), head, 'root' if head == 0
+                      else r.choice(RELS)])
+    src = []
+    tgt = []
+    tree = []
+    for i, (lemma, head, rel) in enumerate(words, 1):
+        upos, tgts = lex[lemma]
+        hlemma = words[head-1][0] if head else ''
+        key = f'{lemma} {hlemma} {rel}'.encode('utf-8')
+        gold = tgts[zlib.crc32(key) % len(tgts)]
+        feats = list(defaults[gold])
+        if feats and rel in CASES:
+            feats[0] = 'Case=' + CASES[rel]
+        readings = [f'{lemma}<SOURCE><{upos}><@{rel}>']
+        for t in tgts:
+            readings.append(f'{t}<{upos}>' + ''.join(
+                f'<{f}>' for f in defaults[t]) + f'<@{rel}>')
+        src.append((i, head, readings))
+        if head and words[head-1][1] and r.random() < args.reattach_rate:
+            tree.append((i, words[head-1][1], [f'{gold}<{upos}><@{rel}>']))
+        else:
+            tree.append((i, head, [f'{gold}<{upos}><@{rel}>']))
+        if upos == 'NOUN' and r.random() < args.insert_rate:
+            tgt.append(('art', i, ['"ho"<DET><@det>']))
+        tgt.append((i, head, [f'{gold}<{upos}>' + ''.join(
+            f'<{f}>' for f in feats) + f'<@{rel}>']))
+    # number the target words, articles included
+    ids = {}
+    for n, (i, head, readings) in enumerate(tgt, 1):
+        if i != 'art':
+            ids[i] = n
+    def line(words, ids):
+        ret = []
+        for n, (i, head, readings) in enumerate(words, 1):
+            h = ids.get(head, 0)
+            ret.append('^x/' + '/'.join(readings).replace(
+                '<@', f'<#{n}→{h}><@', 1) + '$')
+        return ' '.join(ret)
+    same = {i: i for i in range(1, len(src) + 1)}
+    return line(src, same), line(tgt, ids), line(tree, same)
+
+def to_binary(text, path):
+    conv = subprocess.run(['cg-conv', '-a'], input=text.encode('utf-8'),
+                          capture_output=True, check=True)
+    with open(path, 'wb') as fout:
+        subprocess.run(['cg-conv', '-Z', '--dep-delimit'], input=conv.stdout,
+                       stdout=fout, check=True)
+
+def gen_corpus():
+    r = random.Random(args.seed)
+    lex, defaults = gen_dictionary(r)
+    lines = {'source': [], 'target': [], 'tree_target': []}
+    for _ in range(args.sents):
+        for k, l in zip(lines, gen_sentence(r, lex, defaults)):
+            lines[k].append(l)
+    paths = {}
+    for k, ls in lines.items():
+        paths[k] = os.path.join(args.workdir, f'{k}.bin')
+        to_binary('\n'.join(ls) + '\n', paths[k])
+    paths['feats'] = os.path.join(args.workdir, 'target.feats.json')
+    with open(paths['feats'], 'w') as fout:
+        fout.write(json.dumps(sorted(k for k, v in FEATS[:args.feats])))
+    return paths
+
+def command(name, paths, out):
+    iterations = str(args.iterations)
+    count = str(args.count)
+    threads = str(args.threads)
+    if name in ['round12', 'round13']:
+        return [name + '.py', paths['source'], paths['target'], iterations,
+                out, '--count', count, '--threads', threads,
+                '--target_feats', paths['feats']]
+    if name == 'round14':
+        return [name + '.py', paths['source'], paths['target'], iterations,
+                out, LANG, '--count', count, '--threads', threads]
+    if name == 'fix_tree2':
+        return [name + '.py', paths['source'], paths['tree_target'],
+                iterations, out, '--count', count, '--threads', threads]
+    cmd = [name + '.py', paths['source'], paths['target'], LANG, iterations,
+           out, '--rule_count', count, '--threads', threads]
+    if args.score_proc:
+        cmd += ['--score_proc', args.score_proc]
+    return cmd
+
+def run_learner(name, paths):
+    out = os.path.join(args.workdir, f'{name}.cg3')
+    log = os.path.join(args.workdir, f'{name}.log')
+    phase_path = os.path.join(args.workdir, f'{name}.phases.json')
+    trace = os.path.join(args.workdir, f'{name}.trace.jsonl')
+    for path in [phase_path, trace]:
+        if os.path.exists(path):
+            os.unlink(path)
+    env = dict(os.environ, TBL_PHASES=phase_path, TBL_TRACE=trace)
+    cmd = command(name, paths, out)
+    start = time.time()
+    with open(log, 'w') as fout:
+        proc = subprocess.run([sys.executable] + cmd, cwd=HERE, env=env,
+                              stdout=fout, stderr=subprocess.STDOUT)
+    ret = {
+        'command': cmd,
+        'returncode': proc.returncode,
+        'wall_sec': time.time() - start,
+        'log': log,
+        'trace': trace,
+    }
+    if os.path.exists(phase_path):
+        with open(phase_path) as fin:
+            phases = json.load(fin)
+        ret['phases'] = {p: phases['wall'].get(p, 0.0) for p in PHASES}
+        ret['candidates'] = phases['counts'].get('candidates', 0)
+        scoring = ret['phases']['scoring']
+        ret['candidates_per_sec'] = (ret['candidates'] / scoring
+                                     if scoring else None)
+        ret['max_mem_kb'] = phases['max_mem_kb']
+        ret['children_max_mem_kb'] = phases['children_max_mem_kb']
+    return ret
+
+def git_commit():
+    proc = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=HERE,
+                          capture_output=True, text=True)
+    return proc.stdout.strip() or None
+
+def print_summary(report, old=None):
+    old_runs = (old or {}).get('runs', {})
+    print('learner', 'total', *PHASES, 'cand/s', 'max_mem_kb', sep='\t')
+    for name, run in report['runs'].items():
+        if run['returncode'] != 0 or 'phases' not in run:
+            print(name, f'failed ({run["returncode"]}), see {run["log"]}',
+                  sep='\t')
+            continue
+        prev = old_runs.get(name, {})
+        def fmt(new, old):
+            if new is None:
+                return '-'
+            if not old:
+                return f'{new:.2f}'
+            return f'{new:.2f} ({100.0 * (new - old) / old:+.0f}%)'
+        row = [fmt(run['wall_sec'], prev.get('wall_sec'))]
+        row += [fmt(run['phases'][p], prev.get('phases', {}).get(p))
+                for p in PHASES]
+        row.append(fmt(run['candidates_per_sec'],
+                       prev.get('candidates_per_sec')))
+        row.append(str(run['max_mem_kb']))
+        print(name, *row, sep='\t')
+
+# read first, in case it is the report being replaced
+old = None
+if args.compare:
+    with open(args.compare) as fin:
+        old = json.load(fin)
+# the learners are run from this directory
+args.workdir = os.path.abspath(args.workdir)
+os.makedirs(args.workdir, exist_ok=True)
+t0 = time.time()
+paths = gen_corpus()
+report = {
+    'commit': git_commit(),
+    'corpus': {
+        'sents': args.sents,
+        'cohorts': args.cohorts,
+        'lemmas': args.lemmas,
+        'ambiguity': args.ambiguity,
+        'feats': args.feats,
+        'insert_rate': args.insert_rate,
+        'reattach_rate': args.reattach_rate,
+        'seed': args.seed,
+        'generate_sec': time.time() - t0,
+    },
+    'settings': {
+        'iterations': args.iterations,
+        'count': args.count,
+        'threads': args.threads,
+    },
+    'runs': {},
+}
+for name in args.learners.split(','):
+    print('running', name)
+    report['runs'][name] = run_learner(name, paths)
+    with open(args.report, 'w') as fout:
+        json.dump(report, fout, indent=2)
+
+print_summary(report, old)
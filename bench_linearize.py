@@ -0,0 +1,93 @@
+import argparse
+from cg3 import parse_binary_stream
+import random
+import time
+
+import linearize
+import utils
+
+# Time WindowLinearizer's rule matching with the tag index against the
+# linear scan over every rule it replaced, on the windows of a binary
+# corpus (bench.py leaves one in bench-output/source.bin). Unless --rules
+# is given, a rule file is generated from the corpus in the shapes
+# BaseSentence.expand_rule produces, and written to --write_rules if set.
+
+parser = argparse.ArgumentParser()
+parser.add_argument('corpus', help='bin')
+parser.add_argument('--rules', action='store',
+                    help='.lin rule file to use instead of generated rules')
+parser.add_argument('--num_rules', type=int, default=500)
+parser.add_argument('--write_rules', action='store',
+                    help='where to save the generated rules')
+parser.add_argument('--repeat', type=int, default=3,
+                    help='time the best of this many passes')
+parser.add_argument('--seed', type=int, default=0)
+args = parser.parse_args()
+
+class LinearScanLinearizer(linearize.WindowLinearizer):
+    def match_rules(self, pat):
+        left = []
+        right = []
+        for i, r in enumerate(linearize.ALL_RULES + self.extra_rules):
+            if r.ltags <= pat:
+                left.append(i)
+            if r.rtags <= pat:
+                right.append(i)
+        return left, right
+
+def gen_rules(windows, n):
+    r = random.Random(args.seed)
+    descs = []
+    for window in windows:
+        for cohort in window.cohorts:
+            reading = utils.primary_reading(cohort)
+            upos = reading.tags[0]
+            rel = [t for t in reading.tags if t[0] == '@'][0]
+            lem = reading.lemma
+            descs.append([{rel}, {upos}, {lem, upos}, {lem, rel}])
+    rules = []
+    seen = set()
+    while len(rules) < n and len(seen) < n * 10:
+        mode = r.choice(['L', 'R', 'S', 'F', 'B', 'MR'])
+        rule = linearize.Rule(ltags=set(r.choice(r.choice(descs))),
+                              mode=mode)
+        if mode != 'MR':
+            rule.rtags = set(r.choice(r.choice(descs)))
+            rule.weight = r.choice([-1, 1, 2])
+        rs = rule.to_string()
+        if rs not in seen:
+            seen.add(rs)
+            rules.append(rule)
+    return rules
+
+def run(cls, windows):
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        seqs = [cls(window).sequence for window in windows]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, seqs
+
+with open(args.corpus, 'rb') as fin:
+    windows = list(parse_binary_stream(fin, windows_only=True))
+if args.rules:
+    linearize.parse_rule_file(args.rules)
+else:
+    linearize.ALL_RULES += gen_rules(windows, args.num_rules)
+    if args.write_rules:
+        with open(args.write_rules, 'w') as fout:
+            for rule in linearize.ALL_RULES:
+                fout.write(rule.to_string() + '\n')
+
+cohorts = sum(len(w.cohorts) for w in windows)
+print(f'{len(windows)} windows, {cohorts} cohorts, '
+      f'{len(linearize.ALL_RULES)} rules')
+scan_sec, scan_seqs = run(LinearScanLinearizer, windows)
+index_sec, index_seqs = run(linearize.WindowLinearizer, windows)
+if scan_seqs != index_seqs:
+    raise SystemExit('indexed and linear scan linearizations differ')
+print('method', 'sec', 'cohorts/sec', sep='\t')
+for name, sec in [('scan', scan_sec), ('index', index_sec)]:
+    print(name, f'{sec:.3f}', f'{cohorts / sec:.0f}', sep='\t')
+print(f'speedup {scan_sec / index_sec:.1f}x')
@@ -0,0 +1,126 @@
+import cg3
+import cg3_score
+
+from collections import OrderedDict
+import mmap
+import numpy as np
+import os
+import struct
+
+# Sidecar index written next to a .bin file as <path>.idx: a header
+# recording the size and mtime of the .bin it describes, then the offset
+# and length of each window.
+IDX_MAGIC = b'CGIX'
+IDX_VERSION = 2
+IDX_HEADER = struct.Struct('<4sIQQI') # magic, version, size, mtime_ns, count
+IDX_RECORD = np.dtype([('offset', '<u8'), ('length', '<u4')])
+
+def index_path(path):
+    return path + '.idx'
+
+def build_index(buf):
+    offsets = list(cg3_score.iter_block_offsets(buf))
+    index = np.zeros(len(offsets), dtype=IDX_RECORD)
+    if not offsets:
+        return index
+    index['offset'] = [s for s, e in offsets]
+    index['length'] = [e - s for s, e in offsets]
+    return index
+
+def read_index(path):
+    st = os.stat(path)
+    try:
+        with open(index_path(path), 'rb') as fin:
+            head = fin.read(IDX_HEADER.size)
+            if len(head) < IDX_HEADER.size:
+                return None
+            magic, version, size, mtime, count = IDX_HEADER.unpack(head)
+            if (magic, version, size, mtime) != (IDX_MAGIC, IDX_VERSION,
+                                                 st.st_size, st.st_mtime_ns):
+                return None
+            index = np.fromfile(fin, dtype=IDX_RECORD, count=count)
+            if len(index) != count:
+                return None
+            return index
+    except FileNotFoundError:
+        return None
+
+def write_index(path, index):
+    st = os.stat(path)
+    tmp = index_path(path) + f'.{os.getpid()}.tmp'
+    try:
+        with open(tmp, 'wb') as fout:
+            fout.write(IDX_HEADER.pack(IDX_MAGIC, IDX_VERSION, st.st_size,
+                                       st.st_mtime_ns, len(index)))
+            index.tofile(fout)
+        os.replace(tmp, index_path(path))
+    except OSError:
+        # read-only corpus directory: just rebuild next time
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+# A CG binary file opened with mmap. Indexing gives zero-copy memoryview
+# blocks (header included, like cg3_score.iter_blocks()), and window(i)
+# parses on demand, keeping the most recent cache_size windows around.
+# With use_index=True the .idx sidecar is read (or built and saved) rather
+# than scanning the file for window boundaries.
+class BinCorpus:
+    def __init__(self, path, max_sents=0, cache_size=1024, use_index=False):
+        self.path = path
+        self.mm = None
+        with open(path, 'rb') as fin:
+            if os.fstat(fin.fileno()).st_size > 0:
+                self.mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buf = memoryview(self.mm if self.mm is not None else b'')
+        self.index = None
+        if use_index:
+            self.index = read_index(path)
+            if self.index is None:
+                self.index = build_index(self.buf)
+                write_index(path, self.index)
+            if max_sents > 0:
+                self.index = self.index[:max_sents]
+            starts = self.index['offset'].tolist()
+            ends = (self.index['offset'] + self.index['length']).tolist()
+            self.offsets = list(zip(starts, ends))
+        else:
+            self.offsets = list(cg3_score.iter_block_offsets(self.buf))
+            if max_sents > 0:
+                self.offsets = self.offsets[:max_sents]
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # blocks handed out earlier keep the map open until they're dropped
+        self.cache.clear()
+        self.buf.release()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        start, end = self.offsets[i]
+        return self.buf[start:end]
+
+    def __iter__(self):
+        for start, end in self.offsets:
+            yield self.buf[start:end]
+
+    def window(self, i):
+        if i in self.cache:
+            self.cache.move_to_end(i)
+            return self.cache[i]
+        start, end = self.offsets[i]
+        ret = cg3.parse_binary_window(bytes(self.buf[start+5:end]))
+        self.cache[i] = ret
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return ret
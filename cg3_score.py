@@ -1,104 +1,235 @@
 from collections import defaultdict, Counter
+import numpy as np
 import struct
 
 u16_reader = struct.Struct('<H')
 u32_reader = struct.Struct('<I')
 
-def parse_window(buf, target_feats):
-    words = Counter()
-    #feats = defaultdict(lambda: defaultdict(Counter))
-    feats = Counter()
-    counts = Counter()
-    pos = 5 # skip length header
-    def read_pat(pat):
-        nonlocal pos, buf
-        ret = struct.unpack_from('<'+pat, buf, pos)
-        pos += struct.calcsize('<'+pat)
-        return ret
-    def read_u16():
-        nonlocal pos
-        ret = u16_reader.unpack_from(buf, pos)[0]
-        pos += 2
-        return ret
-    def read_u32():
-        nonlocal pos
-        ret = u32_reader.unpack_from(buf, pos)[0]
-        pos += 4
-        return ret
-    def read_str():
-        l = read_u16()
-        if l == 0:
-            return ''
-        return read_pat(f'{l}s')[0].decode('utf-8')
-    pos += 2 # flags
-    tag_count = read_u16()
+def decode_blocks(blocks, target_feats, keep_source=False):
+    return decode_buffer(b''.join(blocks), target_feats, 0, keep_source)
+
+def decode_stream(buf, target_feats, keep_source=False):
+    return decode_buffer(buf, target_feats, 8, keep_source)
+
+def decode_buffer(buf, target_feats, start, keep_source=False):
+    # Walk a sequence of window blocks once, only recording where things
+    # are, and leave all the counting to numpy.
+    unpack_u16 = u16_reader.unpack_from
+    unpack_u32 = u32_reader.unpack_from
     tags = []
-    feat_pairs = {}
-    known_feats = set()
-    ins = None
-    src = None
-    for i in range(tag_count):
-        tags.append(read_str())
-        if '=' in tags[-1]:
-            k, v = tags[-1].split('=', 1)
-            if not target_feats or k in target_feats:
-                #feat_pairs[i] = (k, v)
-                known_feats.add(i)
-        elif tags[-1] == '"<ins>"':
-            ins = i
-        elif tags[-1] == 'SOURCE':
-            src = i
-    skip = read_u16()
-    pos += skip * 5 # vars
-    skip = read_u16()
-    pos += skip # text
-    skip += read_u16()
-    pos += skip # text_post
-    cohort_count = read_u16()
-    counts['cohort'] = cohort_count
-    for i in range(cohort_count):
-        pos += 2 # skip flags
-        surf = read_u16()
-        if surf == ins:
-            counts['ins'] += 1
-        skip = read_u16()
-        pos += 2 * skip # skip static tags
-        pos += 8 # skip dep
-        skip = read_u16()
-        pos += 6 * skip # skip rel
-        skip = read_u16()
-        pos += skip # skip text
-        skip = read_u16()
-        pos += skip # skip wblank
-        reading_count = read_u16()
-        for i in range(reading_count):
-            subreading = (read_u16() & 1)
-            lem = read_u16()
-            tags_count = read_u16()
-            tag_ids = struct.unpack_from(f'<{tags_count}H', buf, pos)
-            pos += 2 * tags_count
-            if subreading:
-                continue
-            if not tag_ids:
-                continue
-            if tag_ids[0] == src:
-                continue
-            counts['reading'] += 1
-            if tags[lem].startswith('"@'):
-                counts['unk'] += 1
-            key = tags[lem] + ' ' + tags[tag_ids[0]]
-            words[key] += 1
-            for t in tag_ids:
-                if t in known_feats:
-                    feats[(key, tags[t])] += 1
-    return words, feats, counts
+    tag_index = {}
+    local_tags = [] # global id of every window-local tag, concatenated
+    tag_base = [] # offset of each window's tags in local_tags
+    cohort_pos = []
+    cohort_win = []
+    reading_pos = []
+    reading_win = []
+    reading_cohort = []
+    window_pos = []
+    pos = start
+    end = len(buf)
+    while pos < end:
+        kind = buf[pos]
+        if kind == 2:
+            pos += 2
+            continue
+        ln = unpack_u32(buf, pos+1)[0]
+        if kind != 1:
+            pos += ln + 5
+            continue
+        win = len(window_pos)
+        window_pos.append(pos)
+        next_pos = pos + ln + 5
+        pos += 7 # length header, flags
+        tag_base.append(len(local_tags))
+        tag_count = unpack_u16(buf, pos)[0]
+        pos += 2
+        for i in range(tag_count):
+            l = unpack_u16(buf, pos)[0]
+            t = str(buf[pos+2:pos+2+l], 'utf-8')
+            pos += 2 + l
+            if t not in tag_index:
+                tag_index[t] = len(tags)
+                tags.append(t)
+            local_tags.append(tag_index[t])
+        pos += 2 + unpack_u16(buf, pos)[0] * 5 # vars
+        pos += 2 + unpack_u16(buf, pos)[0] # text
+        pos += 2 + unpack_u16(buf, pos)[0] # text_post
+        cohort_count = unpack_u16(buf, pos)[0]
+        pos += 2
+        for i in range(cohort_count):
+            cohort_pos.append(pos)
+            cohort_win.append(win)
+            pos += 4 # flags, surface
+            pos += 2 + unpack_u16(buf, pos)[0] * 2 # static tags
+            pos += 8 # dep
+            pos += 2 + unpack_u16(buf, pos)[0] * 6 # relations
+            pos += 2 + unpack_u16(buf, pos)[0] # text
+            pos += 2 + unpack_u16(buf, pos)[0] # wblank
+            reading_count = unpack_u16(buf, pos)[0]
+            pos += 2
+            for j in range(reading_count):
+                reading_pos.append(pos)
+                reading_win.append(win)
+                reading_cohort.append(len(cohort_pos) - 1)
+                pos += 6 + 2 * unpack_u16(buf, pos+4)[0]
+        pos = next_pos
+    return CorpusStats(buf, tags, tag_index, local_tags, tag_base, window_pos,
+                       cohort_pos, cohort_win, reading_pos, reading_win,
+                       reading_cohort, target_feats, keep_source)
+
+def read_u16_array(data, offsets):
+    return data[offsets].astype(np.int64) | (data[offsets+1].astype(np.int64) << 8)
+
+def count_rows(cols):
+    # unique rows of the given columns (first column most significant)
+    # along with how often each occurs
+    if len(cols[0]) == 0:
+        return [c[:0] for c in cols], np.zeros(0, dtype=np.int64)
+    order = np.lexsort(cols[::-1])
+    cols = [c[order] for c in cols]
+    change = np.zeros(len(order), dtype=bool)
+    change[0] = True
+    for c in cols:
+        change[1:] |= c[1:] != c[:-1]
+    starts = np.flatnonzero(change)
+    counts = np.diff(np.append(starts, len(order)))
+    return [c[starts] for c in cols], counts
+
+class CorpusStats:
+    def __init__(self, buf, tags, tag_index, local_tags, tag_base, window_pos,
+                 cohort_pos, cohort_win, reading_pos, reading_win,
+                 reading_cohort, target_feats, keep_source=False):
+        data = np.frombuffer(buf, dtype=np.uint8)
+        self.tags = tags
+        self.window_pos = np.array(window_pos, dtype=np.int64)
+        self.cohort_pos = np.array(cohort_pos, dtype=np.int64)
+        n = len(window_pos)
+        local_tags = np.array(local_tags, dtype=np.int64)
+        tag_base = np.array(tag_base, dtype=np.int64)
+        self.tag_index = tag_index
+        # tag table of window i is local_tags[tag_base[i]:tag_base[i+1]]
+        self.local_tags = local_tags
+        self.tag_base = np.append(tag_base, len(local_tags))
+        is_feat = np.zeros(len(tags), dtype=bool)
+        is_unk = np.zeros(len(tags), dtype=bool)
+        for i, t in enumerate(tags):
+            if '=' in t:
+                k, v = t.split('=', 1)
+                if not target_feats or k in target_feats:
+                    is_feat[i] = True
+            if t.startswith('"@'):
+                is_unk[i] = True
+
+        cohort_win = np.array(cohort_win, dtype=np.int64)
+        self.cohort_count = np.bincount(cohort_win, minlength=n)
+        surf = local_tags[tag_base[cohort_win] +
+                          read_u16_array(data, self.cohort_pos + 2)]
+        ins = tag_index.get('"<ins>"', -1)
+        self.ins_count = np.bincount(cohort_win[surf == ins], minlength=n)
+
+        reading_pos = np.array(reading_pos, dtype=np.int64)
+        reading_win = np.array(reading_win, dtype=np.int64)
+        reading_cohort = np.array(reading_cohort, dtype=np.int64)
+        flags = read_u16_array(data, reading_pos)
+        tag_count = read_u16_array(data, reading_pos + 4)
+        keep = ((flags & 1) == 0) & (tag_count > 0)
+        reading_pos = reading_pos[keep]
+        reading_win = reading_win[keep]
+        reading_cohort = reading_cohort[keep]
+        tag_count = tag_count[keep]
+        base = tag_base[reading_win]
+        lemma = local_tags[base + read_u16_array(data, reading_pos + 2)]
+        # every tag of every reading, flattened
+        tag_reading = np.repeat(np.arange(len(reading_pos)), tag_count)
+        first = np.cumsum(tag_count) - tag_count
+        tag_pos = (reading_pos[tag_reading] + 6 +
+                   2 * (np.arange(len(tag_reading)) - first[tag_reading]))
+        reading_tags = local_tags[base[tag_reading] +
+                                  read_u16_array(data, tag_pos)]
+        pos_tag = reading_tags[first]
+        src = tag_index.get('SOURCE', -1)
+        keep = pos_tag != src
+        if keep_source:
+            # ch4_score counts every reading of the target
+            keep[:] = True
+        self.reading_win = reading_win[keep]
+        self.reading_lemma = lemma[keep]
+        self.reading_pos_tag = pos_tag[keep]
+        self.reading_count = np.bincount(self.reading_win, minlength=n)
+        # ambiguity as ch4_score counts it: only cohorts which still have
+        # more than one reading, so a cohort left with none isn't -1
+        per_cohort = np.bincount(reading_cohort[keep],
+                                 minlength=len(cohort_win))
+        self.ambig_count = np.bincount(
+            cohort_win, np.maximum(per_cohort - 1, 0),
+            minlength=n).astype(np.int64)
+        self.unk_count = np.bincount(self.reading_win[is_unk[self.reading_lemma]],
+                                     minlength=n)
+
+        (self.word_win, self.word_lemma, self.word_pos), self.word_count = \
+            count_rows([self.reading_win, self.reading_lemma,
+                        self.reading_pos_tag])
+        self.word_offsets = np.searchsorted(self.word_win, np.arange(n+1))
+
+        feat_mask = keep[tag_reading] & is_feat[reading_tags]
+        fr = tag_reading[feat_mask]
+        (self.feat_win, self.feat_lemma, self.feat_pos, self.feat_tag), \
+            self.feat_count = count_rows([reading_win[fr], lemma[fr],
+                                          pos_tag[fr], reading_tags[feat_mask]])
+        self.feat_offsets = np.searchsorted(self.feat_win, np.arange(n+1))
+
+    def __len__(self):
+        return len(self.window_pos)
+
+    def words(self, i):
+        tags = self.tags
+        a, b = self.word_offsets[i], self.word_offsets[i+1]
+        return Counter({tags[l] + ' ' + tags[p]: c for l, p, c in zip(
+            self.word_lemma[a:b].tolist(), self.word_pos[a:b].tolist(),
+            self.word_count[a:b].tolist())})
+
+    def feats(self, i):
+        tags = self.tags
+        a, b = self.feat_offsets[i], self.feat_offsets[i+1]
+        return Counter({(tags[l] + ' ' + tags[p], tags[f]): c
+                        for l, p, f, c in zip(
+                                self.feat_lemma[a:b].tolist(),
+                                self.feat_pos[a:b].tolist(),
+                                self.feat_tag[a:b].tolist(),
+                                self.feat_count[a:b].tolist())})
+
+    def counts(self, i):
+        counts = Counter()
+        counts['cohort'] = int(self.cohort_count[i])
+        for key, arr in [('ins', self.ins_count),
+                         ('reading', self.reading_count),
+                         ('ambig', self.ambig_count),
+                         ('unk', self.unk_count)]:
+            if arr[i]:
+                counts[key] = int(arr[i])
+        return counts
+
+    def window(self, i):
+        return self.words(i), self.feats(i), self.counts(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.window(i)
+
+def parse_window(buf, target_feats):
+    return decode_buffer(buf, target_feats, 0).window(0)
 
 def iter_blocks(buf):
+    for start, end in iter_block_offsets(buf):
+        yield buf[start:end]
+
+def iter_block_offsets(buf):
     pos = 8
     while pos < len(buf):
         if buf[pos] == 1:
             ln = u32_reader.unpack_from(buf, pos+1)[0]
-            yield buf[pos:pos+ln+5]
+            yield pos, pos+ln+5
             pos += ln + 5
         elif buf[pos] == 2:
             pos += 2
@@ -118,3 +249,42 @@ def symmetric_difference(d1, d2):
         if k not in d1:
             t2 += v2
     return t1, t2
+
+def score_block(slb, tgt, weights, target_feats):
+    # tgt is the output of parse_window() on the matching target block
+    return score_stats(parse_window(slb, target_feats), tgt, weights)
+
+def score_stats(src, tgt, weights):
+    tgt_words, tgt_feats, tgt_counts = tgt
+    src_words, src_feats, src_counts = src
+    score = 0
+    score += weights['cohorts'] * abs(src_counts['cohort'] - tgt_counts['cohort'])
+    extra, missing = symmetric_difference(src_words, tgt_words)
+    score += weights['missing'] * missing
+    score += weights['extra'] * extra
+    score += weights['ambig'] * (src_counts['reading'] - src_counts['cohort'])
+    score += weights['ins'] * src_counts['ins']
+    score += weights['unk'] * src_counts['unk']
+    mf, ef = symmetric_difference(tgt_feats, src_feats)
+    score += weights['missing_feats'] * mf
+    score += weights['extra_feats'] * ef
+    return score
+
+def score_stats_ch4(src, tgt, weights):
+    # what ch4_score scores a window as, which differs from score_stats()
+    # in clamping ambiguity per cohort (target readings are expected to
+    # come from decode_blocks(..., keep_source=True))
+    tgt_words, tgt_feats, tgt_counts = tgt
+    src_words, src_feats, src_counts = src
+    score = 0
+    score += weights['cohorts'] * abs(src_counts['cohort'] - tgt_counts['cohort'])
+    extra, missing = symmetric_difference(src_words, tgt_words)
+    score += weights['missing'] * missing
+    score += weights['extra'] * extra
+    score += weights['ambig'] * src_counts['ambig']
+    score += weights['ins'] * src_counts['ins']
+    score += weights['unk'] * src_counts['unk']
+    mf, ef = symmetric_difference(tgt_feats, src_feats)
+    score += weights['missing_feats'] * mf
+    score += weights['extra_feats'] * ef
+    return score
@@ -0,0 +1,95 @@
+import cg3
+import cg3_score
+import phases
+
+import os
+import subprocess
+import tempfile
+
+CG_BIN_HEADER = b'CGBF\x01\x00\x00\x00'
+CG_BIN_FOOTER = b'\x02\x01\x02\x02' # FLUSH, EXIT
+
+# Every grammar application goes through here, so vislcg3 is invoked and
+# counted in one place. Grammars are always run by a vislcg3 subprocess;
+# the CG-3 Python bindings are only used to parse what it outputs.
+# There is no in-process path: the Python bindings can't apply a grammar,
+# and libcg3's C API (cg3_sentence_runrules etc.) can't list a cohort's
+# relations or carry static tags and blanks, so windows could not be
+# round-tripped through it without losing what the learners score on.
+
+class Grammar:
+    def __init__(self, path=None, text=None):
+        self.tmp = None
+        if text is not None:
+            self.tmp = tempfile.NamedTemporaryFile(
+                'w', suffix='.cg3', delete=False)
+            try:
+                self.tmp.write(text)
+                self.tmp.close()
+            except BaseException:
+                os.unlink(self.tmp.name)
+                raise
+            path = self.tmp.name
+        self.path = path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.tmp is not None:
+            os.unlink(self.tmp.name)
+            self.tmp = None
+
+    def report_error(self):
+        with open(self.path) as fin:
+            print(fin.read())
+
+    def run(self, data, extra_args=None):
+        # binary stream in, binary stream out
+        phases.count('bytes_in', len(data))
+        phases.count('subprocesses')
+        try:
+            proc = subprocess.run(['vislcg3', '--in-binary', '--out-binary',
+                                   '-g', self.path] + (extra_args or []),
+                                  capture_output=True, check=True,
+                                  input=data)
+        except subprocess.CalledProcessError:
+            self.report_error()
+            raise
+        phases.count('bytes_out', len(proc.stdout))
+        return proc.stdout
+
+    def run_blocks(self, blocks):
+        return self.run(CG_BIN_HEADER + b''.join(blocks) + CG_BIN_FOOTER)
+
+    def run_file(self, ipath, opath):
+        with open(ipath, 'rb') as fin:
+            data = self.run(fin.read())
+        with open(opath, 'wb') as fout:
+            fout.write(data)
+        return data
+
+def apply_blocks(grammar_text, blocks):
+    with Grammar(text=grammar_text) as g:
+        return list(cg3_score.iter_blocks(g.run_blocks(blocks)))
+
+def apply_file(grammar_path, ipath, opath):
+    return Grammar(grammar_path).run_file(ipath, opath)
+
+def apply_text_file(grammar_path, ipath, opath, extra_args=None):
+    # text mode goes through vislcg3 since it needs its own formatting flags
+    phases.count('subprocesses')
+    try:
+        subprocess.run(['vislcg3', '-g', grammar_path, '-I', ipath,
+                        '-O', opath] + (extra_args or []),
+                       capture_output=True, check=True)
+    except subprocess.CalledProcessError as e:
+        print(e.stderr.decode('utf-8', 'replace'))
+        raise
+
+def parse_blocks(blocks):
+    for block in blocks:
+        yield cg3.parse_binary_window(block[5:])
@@ -0,0 +1,47 @@
+import json
+import os
+import shutil
+
+# Checkpoints for long learner runs. A checkpoint directory holds the
+# source .bin an iteration started from and state.json describing it.
+# state.json is only replaced (atomically) once the .bin is in place, so
+# it always names a complete file, and older .bins are removed after.
+STATE = 'state.json'
+
+def link_or_copy(src, dst):
+    # the .bin was already written for the iteration, so a hard link is
+    # enough unless the checkpoint is on another filesystem
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+def save(directory, iteration, source_path, state):
+    os.makedirs(directory, exist_ok=True)
+    name = f'source.{iteration}.bin'
+    path = os.path.join(directory, name)
+    if os.path.exists(path):
+        os.unlink(path)
+    link_or_copy(source_path, path)
+    write_state(directory, dict(state, iteration=iteration, source=name))
+
+def write_state(directory, state):
+    # state['source'] is the name of a .bin in directory
+    tmp = os.path.join(directory, f'{STATE}.{os.getpid()}.tmp')
+    with open(tmp, 'w') as fout:
+        json.dump(state, fout)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp, os.path.join(directory, STATE))
+    for fname in os.listdir(directory):
+        if fname.endswith('.bin') and fname != state['source']:
+            os.unlink(os.path.join(directory, fname))
+
+def load(directory):
+    path = os.path.join(directory, STATE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as fin:
+        state = json.load(fin)
+    state['source'] = os.path.join(directory, state['source'])
+    return state
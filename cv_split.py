@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 
 import argparse
+from bin_corpus import BinCorpus
 import json
 import os
-import struct
 
 parser = argparse.ArgumentParser('split CG binary input corpus into sections for cross-validation')
 parser.add_argument('source')
@@ -20,11 +20,8 @@ if args.skip_windows:
 
 os.makedirs(args.out_dir, exist_ok=True)
 
-with open(args.source, 'rb') as fin:
-    source = fin.read()
-
-with open(args.target, 'rb') as fin:
-    target = fin.read()
+source = BinCorpus(args.source, use_index=True)
+target = BinCorpus(args.target, use_index=True)
 
 folds = []
 for i in range(args.folds):
@@ -33,27 +30,14 @@ for i in range(args.folds):
         for side in ['source', 'target']:
             p = os.path.join(args.out_dir, f'{side}.{partition}.{i}.bin')
             f = open(p, 'wb')
-            f.write(source[:8])
+            f.write(source.buf[:8])
             ls.append(f)
     folds.append(ls)
 
-def blocks(buf):
-    i = 8
-    n = 0
-    while i < len(buf):
-        spec = buf[i]
-        i += 1
-        if spec == 1:
-            ln = struct.unpack('<I', buf[i:i+4])[0]
-            if n not in SKIP:
-                yield buf[i-1:i+4+ln]
-            n += 1
-            i += 4 + ln
-        elif spec == 2:
-            i += 1
-        elif spec == 3:
-            ln = struct.unpack('<I', buf[i:i+2])[0]
-            i += 2 + ln
+def blocks(corpus):
+    for n in range(len(corpus)):
+        if n not in SKIP:
+            yield corpus[n]
 
 for i, (sb, tb) in enumerate(zip(blocks(source), blocks(target))):
     for j, ls in enumerate(folds):
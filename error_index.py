@@ -0,0 +1,108 @@
+from collections import Counter, defaultdict
+import os
+import sqlite3
+
+# In-memory replacement for the errors and tests tables the learners used
+# to rebuild in sqlite every iteration. Rows are kept per window, together
+# with the parsed window they were generated from, so after the source is
+# updated only the windows whose parsed object changed (i.e. which missed
+# update_source()'s cache) need to be regenerated.
+#
+# Error rows are grouped into patterns (the pattern columns, in GROUP BY
+# order) with a count and window => occurrence postings. Test rows are
+# indexed by their first column, the cohort id.
+class ErrorIndex:
+    def __init__(self, error_columns, pattern_columns, occurrence_columns,
+                 test_columns):
+        self.error_columns = error_columns
+        self.pattern_columns = pattern_columns
+        self.occurrence_columns = occurrence_columns
+        self.test_columns = test_columns
+        self.pattern_idx = [error_columns.index(c) for c in pattern_columns]
+        self.occurrence_idx = [error_columns.index(c)
+                               for c in occurrence_columns]
+        self.sources = {}   # window => parsed window the rows came from
+        self.errors = {}    # window => error rows
+        self.tests = {}     # window => test rows
+        self.counts = Counter()            # pattern => row count
+        self.postings = defaultdict(dict)  # pattern => window => occurrences
+        self.cohort_tests = {}             # cohort => test rows
+
+    def __len__(self):
+        return len(self.sources)
+
+    def pattern(self, row):
+        return tuple(row[k] for k in self.pattern_idx)
+
+    def stale(self, windows):
+        # windows is (window index, parsed window) pairs
+        return [i for i, slw in windows if self.sources.get(i) is not slw]
+
+    def remove(self, window):
+        self.sources.pop(window, None)
+        for row in self.errors.pop(window, []):
+            p = self.pattern(row)
+            self.counts[p] -= 1
+            if self.counts[p] == 0:
+                del self.counts[p]
+            self.postings[p].pop(window, None)
+            if not self.postings[p]:
+                del self.postings[p]
+        for row in self.tests.pop(window, []):
+            self.cohort_tests.pop(row[0], None)
+
+    def update(self, window, slw, errors, tests):
+        self.remove(window)
+        self.sources[window] = slw
+        self.errors[window] = errors
+        self.tests[window] = tests
+        for row in errors:
+            p = self.pattern(row)
+            self.counts[p] += 1
+            self.postings[p].setdefault(window, []).append(
+                tuple(row[k] for k in self.occurrence_idx))
+        for row in tests:
+            self.cohort_tests.setdefault(row[0], []).append(row)
+
+    def top_patterns(self, rule, limit, exclude=None):
+        # SELECT COUNT(*) AS ct, <pattern> ... WHERE rule = ?
+        #   GROUP BY <pattern> ORDER BY ct DESC LIMIT ?
+        # exclude is checked against the pattern, since the rows of windows
+        # which weren't regenerated were filtered against an older EXCLUDE
+        rows = [(ct,) + p for p, ct in self.counts.items()
+                if p[0] == rule and not (exclude and exclude(p))]
+        rows.sort(key=lambda r: [(v is not None, v) for v in r[1:]])
+        rows.sort(key=lambda r: -r[0])
+        return rows[:limit]
+
+    def occurrences(self, pattern):
+        postings = self.postings.get(tuple(pattern), {})
+        for window in sorted(postings):
+            yield from postings[window]
+
+    def tests_for(self, cohorts, where=None):
+        ret = []
+        for c in sorted(cohorts):
+            ret += [r for r in self.cohort_tests.get(c, [])
+                    if where is None or where(r)]
+        return ret
+
+    def export_sqlite(self, path, context=None, context_columns=None):
+        # dump the current state in the old table layout, for debugging
+        if os.path.exists(path):
+            os.unlink(path)
+        con = sqlite3.connect(path)
+        cur = con.cursor()
+        tables = [('errors', self.error_columns,
+                   [r for w in sorted(self.errors) for r in self.errors[w]]),
+                  ('tests', self.test_columns,
+                   [r for w in sorted(self.tests) for r in self.tests[w]])]
+        if context is not None:
+            tables.append(('context', context_columns, context))
+        for name, columns, rows in tables:
+            cur.execute(f'CREATE TABLE {name}({", ".join(columns)})')
+            qs = ', '.join(['?'] * len(columns))
+            cur.executemany(f'INSERT INTO {name} VALUES({qs})', rows)
+        cur.execute('CREATE INDEX test_index ON tests(cohort)')
+        con.commit()
+        con.close()
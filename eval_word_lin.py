@@ -37,7 +37,7 @@ def eval_corpus(corpus):
     for sent in corpus.corpus:
         cohorts = len(sent.source.cohorts)
         max_loss += (cohorts * (cohorts - 1)) / 2
-        actual_loss += len(list(sent.wrong_pairs()))
+        actual_loss += sent.count_wrong_pairs()
         sw = [lemma(sent, n) for n in sent.wl.sequence]
         tw = [w.lemma for w in sent.target]
         wer = edit_distance(sw, tw)
@@ -1,4 +1,9 @@
 from cg3 import parse_binary_stream as parse_cg3
+import applied_corpus
+import cg_apply
+from error_index import ErrorIndex
+import phases
+from tbl import Learner, desc_c, desc_r, get_rel
 
 import argparse
 from collections import Counter, defaultdict
@@ -7,11 +12,7 @@ from itertools import combinations
 import json
 import os
 import resource
-import sqlite3
-import struct
-import subprocess
 import sys
-from tempfile import TemporaryDirectory, NamedTemporaryFile
 import time
 
 START = time.time()
@@ -24,58 +25,6 @@ LIST Relation = /^@.*$/r ;
 '''.lstrip()
 LEAF_POS = ['CCONJ', 'ADP', 'DET', 'PUNCT', 'INTJ', 'PART', 'AUX']
 
-parser = argparse.ArgumentParser()
-parser.add_argument('source')
-parser.add_argument('target')
-parser.add_argument('iterations', type=int)
-parser.add_argument('out')
-parser.add_argument('--count', type=int, default=25,
-                    help='number of templates to expand')
-parser.add_argument('--ctx', type=int, default=2,
-                    help='max context tests')
-parser.add_argument('--beam', type=int, default=25,
-                    help='max instantiations of a single pattern')
-parser.add_argument('--rule_count', type=int, default=25,
-                    help='number of rules to try')
-parser.add_argument('--context_similarity', type=float, default=0.9,
-                    help='threshold for discarding more complex context as equivalent')
-parser.add_argument('--append', action='store_true',
-                    help='retain any rules already present in output file')
-parser.add_argument('--max_sents', type=int, default=0,
-                    help='use only first N sentences')
-parser.add_argument('--skip_windows', action='store',
-                    help='skip windows with indecies in this JSON list')
-parser.add_argument('--rtypes', action='store',
-                    help='only generate certain rule types')
-args = parser.parse_args()
-
-EXCLUDE = set()
-SKIP_WINDOWS = set()
-if args.skip_windows:
-    with open(args.skip_windows) as fin:
-        SKIP_WINDOWS = set(json.loads(fin.read()))
-if args.rtypes:
-    RTYPES = json.loads(args.rtypes)
-
-def desc_r(reading):
-    ret = reading.lemma
-    for t in reading.tags:
-        if t != 'SOURCE':
-            ret += ' ' + t
-            break
-    return ret
-def desc_c(cohort):
-    for r in cohort.readings:
-        if 'SOURCE' in r.tags:
-            return desc_r(r)
-    return desc_r(cohort.readings[0])
-
-def get_rel(cohort):
-    for r in cohort.readings:
-        for t in r.tags:
-            if t[0] == '@':
-                return t
-
 def get_heads(window):
     heads = {}
     index = {0: -1, None: -1}
@@ -92,18 +41,12 @@ def get_path(wid, heads, index):
     else:
         return [index[wid]] + get_path(heads[wid], heads, index)
 
-with open(args.target, 'rb') as fin:
-    target = list(parse_cg3(fin, windows_only=True))
-    if args.max_sents > 0:
-        target = target[:args.max_sents]
-target_heads = [get_heads(w) for w in target]
-
-def gen_rules(window, slw, tlw):
-    if window in SKIP_WINDOWS:
+def gen_rules(lr, window, slw, tlw):
+    if window in lr.skip_windows:
         return []
     rules = []
     src_heads, src_index, src_rels = get_heads(slw)
-    tgt_heads, tgt_index, tgt_rels = target_heads[window]
+    tgt_heads, tgt_index, tgt_rels = lr.target_heads[window]
     descs = [None] * len(slw.cohorts)
     for i, (sc, tc) in enumerate(zip(slw.cohorts, tlw.cohorts)):
         sid = sc.dep_self
@@ -138,7 +81,7 @@ def gen_rules(window, slw, tlw):
                 rules.append(('grandparent', '', '', None, '')+suf)
     def error_key(row):
         return '-'.join(str(row[k]) for k in [0, 1, 2, 4, 7])
-    return [r for r in rules if error_key(r) not in EXCLUDE]
+    return [r for r in rules if error_key(r) not in lr.exclude]
 
 def format_rule(rtype, target, tags=None, desttags=None, ctarget=None,
                 context=None):
@@ -207,19 +150,14 @@ def collect_neighbors(slw, idx, dct):
         elif cohort.dep_parent == ds:
             dct['c'].add(cohort.dep_self)
 
-def select_contexts(cur, dct, rtype):
+def select_contexts(index, dct, rtype, similarity):
     RANGE = 10
     ret = defaultdict(Counter)
     for rel in dct:
-        cs = list(dct[rel])
-        qs = ', '.join(['?']*len(cs))
-        cur.execute(
-            f'SELECT cohort, pattern FROM tests WHERE cohort IN ({qs})',
-            cs)
         d2 = defaultdict(set)
         c2 = Counter()
         # shorter tests first
-        for c, p in sorted(cur.fetchall(), key=lambda r: len(r[1])):
+        for c, p in sorted(index.tests_for(dct[rel]), key=lambda r: len(r[1])):
             if rel == 't' and 'LINK' in p:
                 continue
             d2[p].add(c)
@@ -236,20 +174,20 @@ def select_contexts(cur, dct, rtype):
                 pj = ls[j][0]
                 comp = len(d2[pattern].intersection(d2[pj])) / count
                 #print(pattern, count, pj, ls[j][1], comp)
-                if comp >= args.context_similarity:
+                if comp >= similarity:
                     break
             else:
                 ret[rel][pattern] = count
     return ret
 
-def rel_ranges():
-    for n in range(1, args.ctx+1):
+def rel_ranges(max_ctx):
+    for n in range(1, max_ctx+1):
         for i_p in range(2):
             for i_s in range(n-i_p+1):
                 yield i_p, i_s, (n-i_p-i_s)
 
-def contextualize_rules(contexts, dct, ekey):
-    ct = args.count >> 2
+def contextualize_rules(contexts, dct, ekey, limit, max_ctx):
+    ct = limit >> 2
     cp = [(f'p {k}',v) for k,v in contexts['p'].most_common(ct)]
     cs = [(f's {k}',v) for k,v in contexts['s'].most_common(ct)]
     cs += [(f'NEGATE s {k}',v) for k,v in contexts['negs'].most_common(ct)]
@@ -257,7 +195,7 @@ def contextualize_rules(contexts, dct, ekey):
     cc += [(f'NEGATE c {k}',v) for k,v in contexts['negc'].most_common(ct)]
     targets = contexts['t'].most_common(ct)
     ctargets = contexts['ct'].most_common(ct) or [(None, 1000000000)]
-    for i_p, i_s, i_c in rel_ranges():
+    for i_p, i_s, i_c in rel_ranges(max_ctx):
         for t_p in combinations(cp, i_p):
             for t_s in combinations(cs, i_s):
                 for t_c in combinations(cc, i_c):
@@ -274,240 +212,192 @@ def contextualize_rules(contexts, dct, ekey):
                                    min(count, tgi, ctgi),
                                    ekey)
 
-def run_grammar(ipath, gpath, opath):
-    try:
-        subprocess.run(['vislcg3', '--in-binary', '--out-binary', '-g',
-                        gpath, '-I', ipath, '-O', opath],
-                       capture_output=True, check=True)
-    except subprocess.CalledProcessError:
-        with open(gpath) as fin:
-            print(fin.read())
-        raise
-    with open(opath, 'rb') as fout:
-        yield from parse_cg3(fout, windows_only=True)
-
-CG_BIN_HEADER = b'CGBF\x01\x00\x00\x00'
-CG_BIN_FOOTER = b'\x02\x01\x02\x02' # FLUSH, EXIT
-def run_windows(gpath, windows):
-    inp = CG_BIN_HEADER + b''.join(source_blocks[i] for i in windows) + CG_BIN_FOOTER
-    proc = subprocess.run(['vislcg3', '--in-binary', '--out-binary',
-                           '-g', gpath],
-                          capture_output=True, check=True, input=inp)
-    yield from parse_cg3(io.BytesIO(proc.stdout), windows_only=True)
-
-def calc_intersection(rules: list, ipath, gpath: str, opath: str):
-    if not rules:
-        return [], {}
-    with open(gpath, 'w') as fout:
-        for i, r in enumerate(rules):
-            fout.write(r[2].replace('{NUM}', str(i)) + '\n')
-    target_windows = defaultdict(set)
-    targets = defaultdict(set)
-    contexts = defaultdict(set)
-    for idx, window in enumerate(run_grammar(ipath, gpath, opath)):
-        if idx in SKIP_WINDOWS or idx >= len(target):
-            continue
-        for cohort in window.cohorts:
-            for tag, heads in cohort.relations.items():
-                if tag[0] == 'r' and tag[1:].isdigit():
-                    contexts[int(tag[1:])].update(heads)
-                elif tag.startswith('tr') and tag[2:].isdigit():
-                    targets[int(tag[2:])].add(cohort.dep_self)
-                    target_windows[int(tag[2:])].add(idx)
-    intersections = [set() for i in range(len(rules))]
-    for i in range(len(rules)):
-        if not contexts[i]:
-            continue
-        for j in range(i):
-            if (targets[i] & targets[j]
-                or targets[i] & contexts[j]
-                or targets[j] & contexts[i]):
-                intersections[i].add(j)
-                intersections[j].add(i)
-    return intersections, {k: sorted(v) for k, v in target_windows.items()}
-
-def score_window(slw, tlw, index):
-    if index in SKIP_WINDOWS:
-        return 0
-    score = 0
-    src_heads, src_index, src_rels = get_heads(slw)
-    tgt_heads, tgt_index, tgt_rels = target_heads[index]
-    for i, (sc, tc) in enumerate(zip(slw.cohorts, tlw.cohorts)):
-        if src_rels[i] != tgt_rels[i]:
-            score += 1
-        if src_index[sc.dep_parent] != tgt_index[tc.dep_parent]:
-            sp = get_path(sc.dep_self, src_heads, src_index)
-            tp = get_path(tc.dep_self, tgt_heads, tgt_index)
-            while sp and tp and sp[-1] == tp[-1]:
-                sp.pop()
-                tp.pop()
-            score += len(sp) + len(tp) - 2
-    return score
-
-source = []
-source_blocks = []
-window_scores = []
-base_score = 0
-def update_source(fname):
-    global source, source_blocks, window_scores, base_score
-    with open(fname, 'rb') as fin:
-        source = list(parse_cg3(fin, windows_only=True))
-        source_blocks = []
-        fin.seek(8)
-        block = fin.read()
-        pos = 0
-        for i in range(len(source)):
-            while block[pos] != 1:
-                if block[pos] == 2:
-                    pos += 2
-                elif block[pos] == 3:
-                    ln = struct.unpack('<I', block[pos+1:pos+5])[0]
-                    pos += ln + 3
-            ln = struct.unpack('<I', block[pos+1:pos+5])[0]
-            source_blocks.append(block[pos:pos+ln+5])
-            pos += ln + 5
-    window_scores = [score_window(s, t, i) for i, (s, t) in enumerate(zip(source, target))]
-    base_score = sum(window_scores)
-update_source(args.source)
-print(f'{len(source)=}, {len(target)=}')
-
-def score_rule(rule, gpath, windows):
-    with open(gpath, 'w') as fout:
-        fout.write(RULE_HEADER + rule[1])
-    score = 0
-    last_window = 0
-    for idx, slw in zip(windows, run_windows(gpath, windows)):
-        score += sum(window_scores[last_window:idx])
-        score += score_window(slw, target[idx], idx)
-        last_window = idx+1
-    score += sum(window_scores[last_window:])
-    return score
-
-initial_rule_output = RULE_HEADER
-initial_source = args.source
-if args.append:
-    with open(args.out) as fin:
-        initial_rule_output = fin.read().strip() + '\n\n'
-        if not initial_rule_output.startswith(RULE_HEADER):
-            initial_rule_output = RULE_HEADER + initial_rule_output
-    new_source = NamedTemporaryFile(delete=False, delete_on_close=False)
-    initial_source = new_source.name
-    subprocess.run(['vislcg3', '--in-binary', '--out-binary', '-g',
-                    args.out, '-I', args.source, '-O', new_source.name],
-                   capture_output=True)
-    update_source(new_source.name)
-
-with (TemporaryDirectory() as tmpdir,
-      open(args.out, 'w') as rule_output):
-    db_path = os.path.join(tmpdir, 'db.sqlite')
-    con = sqlite3.connect(db_path)
-    cur = con.cursor()
-    cur.execute('CREATE TABLE errors(rule, tags1, tags2, ctarget, ctarget_key, window, cohort, cohort_key)')
-    cur.execute('CREATE TABLE context(rtype, rule TEXT, relation TEXT, count INT, error_label TEXT)')
-    cur.execute('CREATE TABLE tests(cohort INTEGER, pattern TEXT)')
-    con.commit()
-    rule_output.write(initial_rule_output)
-
-    def log_scores(iteration, src_path):
-        global target, rule_output, EXCLUDE
-        update_source(src_path)
-        rule_output.write('####################\n')
-        rule_output.write(f'## {iteration}: {base_score}\n')
-        rule_output.write('####################\n')
-        print(f'{iteration=}, {base_score=}, {len(EXCLUDE)=}')
-
-    for iteration in range(args.iterations):
-        src_path = os.path.join(tmpdir, f'output.{iteration}.bin')
-        if iteration == 0:
-            src_path = initial_source
-        log_scores(iteration, src_path)
-        tgt_path = os.path.join(tmpdir, f'output.{iteration+1}.bin')
-
-        for table in ['errors', 'context', 'tests']:
-            cur.execute(f'DELETE FROM {table}')
-        con.commit()
-
-        for window, (slw, tlw) in enumerate(zip(source, target)):
-            if window in SKIP_WINDOWS:
-                continue
-            cur.executemany(
-                'INSERT INTO errors VALUES(?, ?, ?, ?, ?, ?, ?, ?)',
-                gen_rules(window, slw, tlw))
+# Like round12's ContextLearner, but the error is the distance between
+# the source and target trees, and the rules move words around in them.
+class TreeLearner(Learner):
+    def __init__(self, *args, ctx=2, beam=25, rule_count=25,
+                 context_similarity=0.9, export_db=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ctx = ctx
+        self.beam = beam
+        self.rule_count = rule_count
+        self.context_similarity = context_similarity
+        self.export_db = export_db
+        self.target_heads = [get_heads(w) for w in self.target]
+        self.candidates = ErrorIndex(
+            ['rule', 'tags1', 'tags2', 'ctarget', 'ctarget_key', 'window',
+             'cohort', 'cohort_key'],
+            ['rule', 'tags1', 'tags2', 'cohort_key', 'ctarget_key'],
+            ['window', 'cohort', 'ctarget'],
+            ['cohort', 'pattern'])
+
+    def score_window(self, slw, index):
+        if index in self.skip_windows:
+            return 0
+        tlw = self.target[index]
+        score = 0
+        src_heads, src_index, src_rels = get_heads(slw)
+        tgt_heads, tgt_index, tgt_rels = self.target_heads[index]
+        for i, (sc, tc) in enumerate(zip(slw.cohorts, tlw.cohorts)):
+            if src_rels[i] != tgt_rels[i]:
+                score += 1
+            if src_index[sc.dep_parent] != tgt_index[tc.dep_parent]:
+                sp = get_path(sc.dep_self, src_heads, src_index)
+                tp = get_path(tc.dep_self, tgt_heads, tgt_index)
+                while sp and tp and sp[-1] == tp[-1]:
+                    sp.pop()
+                    tp.pop()
+                score += len(sp) + len(tp) - 2
+        return score
+
+    def score_windows(self, gpath, windows):
+        out = cg_apply.Grammar(gpath).run_blocks(
+            self.source_blocks[i] for i in windows)
+        for idx, slw in zip(windows,
+                            parse_cg3(io.BytesIO(out), windows_only=True)):
+            yield idx, self.score_window(slw, idx)
+
+    def gen_shard(self, windows):
+        # (window, error rows, test rows) for each window
+        ret = []
+        for window in windows:
+            slw = self.source[window]
+            tests = []
             for ch in slw.cohorts:
-                cur.executemany(
-                    'INSERT INTO tests(cohort, pattern) VALUES(?, ?)',
-                    [(ch.dep_self, dc) for dc in describe_cohort(ch, slw)])
-            con.commit()
+                tests += [(ch.dep_self, dc)
+                          for dc in describe_cohort(ch, slw)]
+            ret.append((window, self.gen_rules(self, window, slw,
+                                               self.target[window]),
+                        tests))
+        return ret
+
+    def candidate_rules(self, count):
+        # (count, rule text, relation text, error label)
+        index = self.candidates
+
+        def excluded(pattern):
+            # same key as gen_rules() uses
+            rule, tags1, tags2, ckey, ctkey = pattern
+            return '-'.join(str(k) for k in
+                            [rule, tags1, tags2, ctkey, ckey]) in self.exclude
 
         patterns = []
-        for rt in RTYPES:
-            cur.execute('SELECT COUNT(*) AS ct, rule, tags1, tags2, cohort_key, ctarget_key FROM errors WHERE rule = ? GROUP BY rule, tags1, tags2, cohort_key, ctarget_key ORDER BY ct DESC LIMIT ?', (rt, args.count))
-            patterns += cur.fetchall()
+        for rt in self.rtypes:
+            patterns += index.top_patterns(rt, count, excluded)
 
-        for count, rule, tags1, tags2, ckey, ctkey in patterns:
+        context = []
+        for _, rule, tags1, tags2, ckey, ctkey in patterns:
             label = f'{rule}-{tags1}-{tags2}-{ckey}-{ctkey}'
-            cur.execute('SELECT window, cohort, ctarget FROM errors WHERE rule = ? AND tags1 = ? AND tags2 = ? AND cohort_key = ? AND ctarget_key = ?',
-                        (rule, tags1, tags2, ckey, ctkey))
             neighbors = defaultdict(set)
-            for wnum, cnum, ctnum in cur.fetchall():
-                slw = source[wnum]
+            for wnum, cnum, ctnum in index.occurrences(
+                    (rule, tags1, tags2, ckey, ctkey)):
+                slw = self.source[wnum]
                 if ctnum is not None:
                     neighbors['ct'].add(slw.cohorts[ctnum].dep_self)
                 collect_neighbors(slw, cnum, neighbors)
-            dct = select_contexts(cur, neighbors, rule)
+            dct = select_contexts(index, neighbors, rule,
+                                  self.context_similarity)
             rules = list(contextualize_rules(
                 dct,
                 {'rtype': rule, 'tags': tags1, 'desttags': tags2},
-                label))
+                label, count, self.ctx))
             rules.sort(key=lambda x: x[3], reverse=True)
-            cur.executemany('INSERT INTO context VALUES(?, ?, ?, ?, ?)',
-                            rules[:args.beam])
-            con.commit()
+            context += rules[:self.beam]
+
+        if self.export_db:
+            index.export_sqlite(
+                self.export_db, context,
+                ['rtype', 'rule', 'relation', 'count', 'error_label'])
 
-        failed_errors = set()
-        non_failed = set()
         rules = []
-        for rt in RTYPES:
-            cur.execute('SELECT count, rule, relation, error_label FROM context WHERE rtype = ? ORDER BY count LIMIT ?', (rt, args.rule_count))
-            rules += cur.fetchall()
-
-        gpath = os.path.join(tmpdir, f'intersection.{iteration}.cg3')
-        opath = os.path.join(tmpdir, f'intersection.{iteration}.bin')
-        intersections, target_windows = calc_intersection(
-            rules, src_path, gpath, opath)
-
-        scored_rules = []
-        for rule_idx, rule in enumerate(rules):
-            gpath = os.path.join(tmpdir, f'g{rule_idx:05}.cg3')
-            s = score_rule(rule, gpath, target_windows[rule_idx])
-            print(s, rule[1])
-            if s < base_score:
-                scored_rules.append((s, rule, rule_idx))
-                non_failed.add(rule[-1])
-            else:
-                failed_errors.add(rule[-1])
-        scored_rules.sort()
-        added = set()
-        selected_rules = []
-        for score, rule, i in scored_rules:
-            if intersections[i] & added:
-                continue
-            selected_rules.append(rule)
-            added.add(i)
-
-        gpath = os.path.join(tmpdir, f'grammar.{iteration}.cg3')
-        rule_str = '\n'.join(r[1] for r in selected_rules)
-        with open(gpath, 'w') as fout:
-            fout.write(RULE_HEADER + rule_str)
-        rule_output.write(rule_str + '\n\n')
-        EXCLUDE.update(failed_errors - non_failed)
-        subprocess.run(['vislcg3', '--in-binary', '--out-binary', '-g',
-                        gpath, '-I', src_path, '-O', tgt_path],
-                       capture_output=True)
-    # log final values after all iterations
-    log_scores(args.iterations, tgt_path)
-
-print(json.dumps({
-    'max_mem_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
-    'time_sec': time.time() - START,
-}), file=sys.stderr)
+        for rt in self.rtypes:
+            rows = sorted([r for r in context if r[0] == rt],
+                          key=lambda r: r[3])
+            rules += [(ct, rule, rel, label)
+                      for _, rule, rel, ct, label in rows[:self.rule_count]]
+        return rules
+
+    def exclude_key(self, rule):
+        return rule[-1]
+
+    def log_scores(self, iteration, src_path, rule_output):
+        self.update_source(src_path)
+        rule_output.write('####################\n')
+        rule_output.write(f'## {iteration}: {self.base_score}\n')
+        rule_output.write('####################\n')
+        diff = time.time() - self.last_iter_start
+        self.last_iter_start = time.time()
+        print(f'{iteration=}, base_score={self.base_score}, len(EXCLUDE)={len(self.exclude)} round duration {diff:.2f}')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source')
+    parser.add_argument('target')
+    parser.add_argument('iterations', type=int)
+    parser.add_argument('out')
+    parser.add_argument('--count', type=int, default=25,
+                        help='number of templates to expand')
+    parser.add_argument('--ctx', type=int, default=2,
+                        help='max context tests')
+    parser.add_argument('--beam', type=int, default=25,
+                        help='max instantiations of a single pattern')
+    parser.add_argument('--rule_count', type=int, default=25,
+                        help='number of rules to try')
+    parser.add_argument('--context_similarity', type=float, default=0.9,
+                        help='threshold for discarding more complex context as equivalent')
+    parser.add_argument('--append', action='store_true',
+                        help='retain any rules already present in output file')
+    parser.add_argument('--max_sents', type=int, default=0,
+                        help='use only first N sentences')
+    parser.add_argument('--skip_windows', action='store',
+                        help='skip windows with indecies in this JSON list')
+    parser.add_argument('--rtypes', action='store',
+                        help='only generate certain rule types')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='processes to use for generating candidate rules')
+    parser.add_argument('--export_db', action='store',
+                        help='write the error, test, and context tables to this sqlite file each iteration (for debugging)')
+    parser.add_argument('--profile', type=int,
+                        help='write a cProfile of this iteration to OUT.N.prof')
+    args = parser.parse_args()
+    phases.set_profile(args.profile, f'{args.out}.{args.profile}.prof')
+
+    skip_windows = set()
+    if args.skip_windows:
+        with open(args.skip_windows) as fin:
+            skip_windows = set(json.loads(fin.read()))
+    rtypes = RTYPES
+    if args.rtypes:
+        rtypes = json.loads(args.rtypes)
+
+    lr = TreeLearner(args.target, RULE_HEADER, rtypes, gen_rules, None, None,
+                     skip_windows=skip_windows, max_sents=args.max_sents,
+                     threads=args.threads, ctx=args.ctx, beam=args.beam,
+                     rule_count=args.rule_count,
+                     context_similarity=args.context_similarity,
+                     export_db=args.export_db)
+
+    initial_rule_output = RULE_HEADER
+    initial_source = args.source
+    if args.append:
+        with open(args.out) as fin:
+            initial_rule_output = fin.read().strip() + '\n\n'
+            if not initial_rule_output.startswith(RULE_HEADER):
+                initial_rule_output = RULE_HEADER + initial_rule_output
+        initial_source = applied_corpus.apply(args.out, args.source,
+                                              RULE_HEADER)
+
+    with lr.start_generation():
+        lr.update_source(initial_source)
+        print(f'len(source)={len(lr.source)}, len(target)={len(lr.target)}')
+
+        lr.run(initial_source, args.out, args.iterations, args.count,
+               initial_rule_output, original_source=args.source)
+
+    print(json.dumps({
+        'max_mem_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'time_sec': time.time() - START,
+    }), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import cg3
+import cg3_score
+
+import numpy as np
+import re
+
+# Working out which windows a candidate rule touches without running a
+# separate ADDRELATION pass over the whole corpus: windows are first
+# narrowed down to those whose tag table has every literal tag of the
+# rule's target, and the rule's own relation rules then run alongside it
+# in the scoring run.
+
+TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"\S*|\S+')
+LIST_RE = re.compile(r'^\s*(?:LIST|SET)\s+(\S+)\s*=', re.MULTILINE)
+
+def set_names(grammar):
+    return set(LIST_RE.findall(grammar))
+
+def literal_tags(cg_set, names):
+    # tags which any reading matching ({cg_set}) has to carry
+    ret = []
+    for tok in TOKEN_RE.findall(cg_set or ''):
+        if tok[0] == '"':
+            if tok[-1] != '"':
+                continue # "..."r, "..."i etc.
+        elif (tok in names or tok == '*' or tok[0] in '/$_<'
+              or any(c in tok for c in '()')):
+            continue
+        ret.append(tok)
+    return ret
+
+class TagPostings:
+    def __init__(self, blocks, limit=None):
+        stats = cg3_score.decode_blocks(blocks, None)
+        self.tag_index = stats.tag_index
+        n = len(stats) if limit is None else min(limit, len(stats))
+        base = stats.tag_base
+        window = np.repeat(np.arange(len(stats)), np.diff(base))
+        order = np.argsort(stats.local_tags, kind='stable')
+        self.tags = stats.local_tags[order]
+        self.windows = window[order]
+        self.all_windows = set(range(n))
+
+    def windows_with(self, tag):
+        gid = self.tag_index.get(tag)
+        if gid is None:
+            return set()
+        a, b = np.searchsorted(self.tags, [gid, gid+1])
+        return set(self.windows[a:b].tolist()) & self.all_windows
+
+    def candidates(self, tags):
+        ret = set(self.all_windows)
+        for t in tags:
+            ret &= self.windows_with(t)
+            if not ret:
+                break
+        return ret
+
+def relation_grammar(header, rule, relations):
+    # relation rules run once up front, so they see the window as it was
+    # before the rule, like the standalone intersection pass did.
+    # Context cohorts also get a relation back to the target (rc0), since
+    # a rule which deletes its target would take r0 away with it.
+    relations = relations.replace('{NUM}', '0').replace(
+        'ADDRELATION (r0)', 'ADDRELATIONS (r0) (rc0)')
+    return (header + 'BEFORE-SECTIONS\n' + relations
+            + '\n\nSECTION\n' + rule)
+
+def collect(windows, in_blocks, out_blocks):
+    # (target cohort ids, context cohort ids, windows the rule targeted)
+    targets = set()
+    contexts = set()
+    touched = []
+    for idx, ib, ob in zip(windows, in_blocks, out_blocks):
+        if ib == ob:
+            continue
+        window = cg3.parse_binary_window(bytes(ob[5:]))
+        hit = False
+        ids = set()
+        for cohort in window.cohorts:
+            ids.add(cohort.dep_self)
+            for tag, heads in cohort.relations.items():
+                if tag == 'tr0':
+                    targets.add(cohort.dep_self)
+                    hit = True
+                elif tag == 'r0':
+                    contexts.update(heads)
+                elif tag == 'rc0':
+                    contexts.add(cohort.dep_self)
+        # a cohort the rule deleted takes its relations with it
+        before = cg3.parse_binary_window(bytes(ib[5:]))
+        removed = set(c.dep_self for c in before.cohorts) - ids
+        if removed:
+            targets.update(removed)
+            hit = True
+        if hit:
+            touched.append(idx)
+    return targets, contexts, touched
@@ -0,0 +1,47 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+# Run fn(start, end) over contiguous slices of range(count) and return the
+# results in order. The workers are forked, so they see the caller's module
+# state (current source windows, EXCLUDE, ...) as it was at the time of the
+# call and fn only needs to be told which windows to look at.
+def map_shards(fn, count, threads, per_thread=4):
+    if threads <= 1 or count < 2:
+        return [fn(0, count)]
+    n = min(count, threads * per_thread)
+    bounds = [count * i // n for i in range(n + 1)]
+    with ProcessPoolExecutor(
+            threads, mp_context=multiprocessing.get_context('fork')) as pool:
+        return list(pool.map(fn, bounds[:-1], bounds[1:]))
+
+# The same, but with one pool of forked workers kept for a whole run, for
+# callers which would otherwise fork a new pool every iteration while other
+# worker pools (round14's ScorePool) are running. Every worker is forked
+# as soon as the pool is created, so they only see module state as it was
+# then; anything which changes later has to be passed along with each
+# shard.
+class GenPool:
+    def __init__(self, threads, per_thread=4):
+        self.threads = threads
+        self.per_thread = per_thread
+        self.executor = ProcessPoolExecutor(
+            threads, mp_context=multiprocessing.get_context('fork'))
+        # with fork, the first job starts all the workers
+        self.executor.submit(int).result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    def map(self, fn, items, *args):
+        # fn(items[a:b], *args) over contiguous slices of items, in order
+        n = min(len(items), self.threads * self.per_thread)
+        bounds = [len(items) * i // n for i in range(n + 1)]
+        jobs = [self.executor.submit(fn, items[a:b], *args)
+                for a, b in zip(bounds, bounds[1:])]
+        return [job.result() for job in jobs]
@@ -1,14 +1,17 @@
 import argparse
+import applied_corpus
 import cg3
 import cg3_score
+import cg_apply
 from collections import Counter, defaultdict
 import io
 import itertools
 import json
 import os
+import phases
 import sqlite3
-import subprocess
 import time
+import work_queue
 from tempfile import TemporaryDirectory
 
 RULE_HEADER = 'DELIMITERS = "<$$$>" ;\nOPTIONS += addcohort-attach ;\n\n'
@@ -35,7 +38,15 @@ parser.add_argument('--batch_size', type=int, default=100)
 parser.add_argument('--out_dir', action='store')
 parser.add_argument('--score_proc', action='store')
 parser.add_argument('--threads', type=int, default=10)
+parser.add_argument('--queue', action='store',
+                    help='score candidates through a work_queue.py queue in '
+                    'this directory, which workers on other nodes can share')
+parser.add_argument('--queue_workers', type=int, default=0,
+                    help='local workers to start on the --queue')
+parser.add_argument('--profile', type=int,
+                    help='write a cProfile of this iteration to OUT.N.prof')
 args = parser.parse_args()
+phases.set_profile(args.profile, f'{args.out}.{args.profile}.prof')
 
 SKIP_WINDOWS = set()
 if args.skip_windows:
@@ -137,10 +148,9 @@ def reload_source(data, initial=False):
     source_maps = [None] * len(source)
 
 if args.append:
-    proc = subprocess.run(['vislcg3', '--in-binary', '--out-binary',
-                           '-g', args.out, '-I', args.source],
-                          capture_output=True, check=True)
-    reload_source(proc.stdout, initial=True)
+    with open(applied_corpus.apply(args.out, args.source, RULE_HEADER),
+              'rb') as fin:
+        reload_source(fin.read(), initial=True)
 else:
     with open(args.source, 'rb') as fin:
         reload_source(fin.read(), initial=True)
@@ -237,14 +247,12 @@ def score_rule(rpath, key, rule):
         fout.write(RULE_HEADER + rule)
     #windows = lemma_index[key]
     windows = list(range(len(source_blocks)))
-    inp = CG_BIN_HEADER + b''.join(source_blocks[i] for i in windows) + CG_BIN_FOOTER
-    proc = subprocess.run(['vislcg3', '--in-binary', '--out-binary',
-                           '-g', rpath],
-                          capture_output=True, input=inp)
+    out = cg_apply.Grammar(rpath).run_blocks(
+        source_blocks[i] for i in windows)
     diff = 0
     actual_windows = set()
     for i, window in zip(windows,
-                         cg3.parse_binary_stream(io.BytesIO(proc.stdout),
+                         cg3.parse_binary_stream(io.BytesIO(out),
                                                  windows_only=True)):
         s, d = score_window(i, window)
         diff += s - base_scores[i]
@@ -258,17 +266,24 @@ CUR_TARGET = None
 def start_rule(gpath, rule):
     with open(gpath, 'w') as fout:
         fout.write(RULE_HEADER + rule)
-    return subprocess.Popen(
+    phases.count('subprocesses')
+    job = pool.submit(
         [(args.score_proc or 'ch4_pipe_score/ch4_pipe_score'),
-         gpath, CUR_SOURCE, CUR_TARGET, args.lang],
-        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+         gpath, CUR_SOURCE, CUR_TARGET, args.lang])
+    job.span = phases.start('candidate', rule=rule)
+    return job
 
-def finish_rule(proc):
-    out, err = proc.communicate()
-    return int(out.decode('utf-8').split()[1])
+def finish_rule(job):
+    out = job.result()
+    job.span.end()
+    return int(out.split()[1])
 
 open_mode = 'a' if args.append else 'w'
-with (TemporaryDirectory() as tmpdir_,
+# files the scorers read go in the queue directory when there is one,
+# so that workers on other nodes can see them
+with (work_queue.open_pool(args.threads, args.queue,
+                           args.queue_workers) as pool,
+      TemporaryDirectory(dir=args.queue) as tmpdir_,
       open(args.out, open_mode) as rule_output):
     if args.append:
         rule_output.write('\n')
@@ -288,6 +303,7 @@ with (TemporaryDirectory() as tmpdir_,
     cur.execute('CREATE TABLE context(window, upos, target, ctx)')
     #cur.execute('CREATE INDEX blah ON context(target, ctx)')
     con.commit()
+    ctx_span = phases.start('generation', step='context table')
     t0 = time.time()
     for w in range(len(source)):
         cur.executemany('INSERT INTO context VALUES(?, ?, ?, ?)',
@@ -308,6 +324,7 @@ with (TemporaryDirectory() as tmpdir_,
     cur.execute('CREATE INDEX blah3 ON freq(ct)')
     t4 = time.time()
     print('flipped in %.5f seconds' % (t4 - t3))
+    ctx_span.end()
     con.commit()
     print('\ncontexts entered')
 
@@ -322,9 +339,11 @@ with (TemporaryDirectory() as tmpdir_,
     shift = Counter()
 
     for iteration in range(args.iterations):
+        phases.begin_iteration(iteration)
         CUR_SOURCE = os.path.join(tmpdir, f'input.{iteration}.bin')
         with open(CUR_SOURCE, 'wb') as fout:
             fout.write(CG_BIN_HEADER + b''.join(source_blocks) + CG_BIN_FOOTER)
+        gen_span = phases.start('generation')
         for key, count in shift.items():
             if count >= 3 and key in priority:
                 del priority[key]
@@ -339,18 +358,22 @@ with (TemporaryDirectory() as tmpdir_,
             for t, c, ct in cur.fetchall():
                 rules.append((ct, key, f'ADDCOHORT ("<ins>" {key} @dep) BEFORE ({t}) IF (NEGATE c ({key})) {c} ;'))
             print('queried %s in %.5f seconds' % (key, time.time() - t0))
+        gen_span.end()
+        score_span = phases.start('scoring')
         scored_rules = []
         threshold = sum(base_scores)
-        for batch in itertools.batched(enumerate(rules), args.threads):
-            procs = []
-            for i, (c, k, r) in batch:
-                path = os.path.join(tmpdir, f'g_{iteration}_{i}.cg3')
-                procs.append(start_rule(path, r))
-            for (i, (c, k, r)), p in zip(batch, procs):
-                s = finish_rule(p)
-                print(i, s, r)
-                if s < threshold:
-                    scored_rules.append((s, i, r, k))
+        candidates = list(enumerate(rules))
+        procs = []
+        phases.count('candidates', len(candidates))
+        for i, (c, k, r) in candidates:
+            path = os.path.join(tmpdir, f'g_{iteration}_{i}.cg3')
+            procs.append(start_rule(path, r))
+        for (i, (c, k, r)), p in zip(candidates, procs):
+            s = finish_rule(p)
+            print(i, s, r)
+            if s < threshold:
+                scored_rules.append((s, i, r, k))
+        score_span.end()
         scored_rules.sort()
         used_keys = set()
         selected = []
@@ -365,15 +388,13 @@ with (TemporaryDirectory() as tmpdir_,
             update = os.path.join(tmpdir, f'g_{iteration}.cg3')
             with open(update, 'w') as fout:
                 fout.write(RULE_HEADER + '\n'.join(selected))
-            proc = subprocess.run(['vislcg3', '--in-binary', '--out-binary',
-                                   '-g', update],
-                                  capture_output=True, check=True,
-                                  input=(CG_BIN_HEADER +
-                                         b''.join(source_blocks) +
-                                         CG_BIN_FOOTER))
-            reload_source(proc.stdout)
+            with phases.timed('apply'):
+                out = cg_apply.Grammar(update).run_blocks(source_blocks)
+            with phases.timed('rescore'):
+                reload_source(out)
         print(f'## {iteration+1}:', sum(base_scores), file=rule_output)
         print(f'## {iteration+1}:', sum(base_scores))
         print(priority.most_common(args.lemma_count))
         if not selected:
             break
+    phases.begin_iteration(None)
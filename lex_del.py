@@ -1,13 +1,17 @@
 import argparse
+import applied_corpus
 import cg3
 import cg3_score
+import cg_apply
 from collections import Counter, defaultdict
 import io
 import itertools
 import json
 import os
-import subprocess
+import phases
+from rule_cache import WindowCache
 import time
+import work_queue
 from tempfile import TemporaryDirectory
 
 RULE_HEADER = 'DELIMITERS = "<$$$>" ;\n\n'
@@ -31,7 +35,15 @@ parser.add_argument('--batch_size', type=int, default=100)
 parser.add_argument('--out_dir', action='store')
 parser.add_argument('--score_proc', action='store')
 parser.add_argument('--threads', type=int, default=10)
+parser.add_argument('--queue', action='store',
+                    help='score candidates through a work_queue.py queue in '
+                    'this directory, which workers on other nodes can share')
+parser.add_argument('--queue_workers', type=int, default=0,
+                    help='local workers to start on the --queue')
+parser.add_argument('--profile', type=int,
+                    help='write a cProfile of this iteration to OUT.N.prof')
 args = parser.parse_args()
+phases.set_profile(args.profile, f'{args.out}.{args.profile}.prof')
 
 SKIP_WINDOWS = set()
 if args.skip_windows:
@@ -139,10 +151,9 @@ def reload_source(data, initial=False):
     source_maps = [None] * len(source)
 
 if args.append:
-    proc = subprocess.run(['vislcg3', '--in-binary', '--out-binary',
-                           '-g', args.out, '-I', args.source],
-                          capture_output=True, check=True)
-    reload_source(proc.stdout, initial=True)
+    with open(applied_corpus.apply(args.out, args.source, RULE_HEADER),
+              'rb') as fin:
+        reload_source(fin.read(), initial=True)
 else:
     with open(args.source, 'rb') as fin:
         reload_source(fin.read(), initial=True)
@@ -217,6 +228,10 @@ def gen_rules_window(window_num, cohort_num):
         for ctx in get_context(window_num, cohort_num):
             yield f'REMCOHORT ({key}) IF (NEGATE c (*)) {ctx} ;'
 
+# candidate rules of a cohort only change when its window does
+window_rules = WindowCache(lambda w, c: Counter(gen_rules_window(w, c)),
+                           source_blocks)
+
 CUR_SOURCE = None
 CUR_TARGET = None
 
@@ -224,17 +239,24 @@ def start_rule(prefix, rule):
     gpath = prefix + '.cg3'
     with open(gpath, 'w') as fout:
         fout.write(RULE_HEADER + rule)
-    return subprocess.Popen(
+    phases.count('subprocesses')
+    job = pool.submit(
         [(args.score_proc or 'ch4_pipe_score/ch4_pipe_score'),
-         gpath, CUR_SOURCE, CUR_TARGET, args.lang],
-        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+         gpath, CUR_SOURCE, CUR_TARGET, args.lang])
+    job.span = phases.start('candidate', rule=rule)
+    return job
 
-def finish_rule(proc):
-    out, err = proc.communicate()
-    return int(out.decode('utf-8').split()[1])
+def finish_rule(job):
+    out = job.result()
+    job.span.end()
+    return int(out.split()[1])
 
 open_mode = 'a' if args.append else 'w'
-with (TemporaryDirectory() as tmpdir_,
+# files the scorers read go in the queue directory when there is one,
+# so that workers on other nodes can see them
+with (work_queue.open_pool(args.threads, args.queue,
+                           args.queue_workers) as pool,
+      TemporaryDirectory(dir=args.queue) as tmpdir_,
       open(args.out, open_mode) as rule_output):
     if args.append:
         rule_output.write('\n')
@@ -254,9 +276,11 @@ with (TemporaryDirectory() as tmpdir_,
     empty_count = 0
 
     for iteration in range(args.iterations):
+        phases.begin_iteration(iteration)
         CUR_SOURCE = os.path.join(tmpdir, f'input.{iteration}.bin')
         with open(CUR_SOURCE, 'wb') as fout:
             fout.write(CG_BIN_HEADER + b''.join(source_blocks) + CG_BIN_FOOTER)
+        gen_span = phases.start('generation')
         for key in exclude:
             extra[key] = 0
         ops = [(int(100 * c / max(len(lemma_index[k]), 1)), c, k)
@@ -270,31 +294,35 @@ with (TemporaryDirectory() as tmpdir_,
             for batch in itertools.batched(lemma_index[key], args.batch_size):
                 bct = Counter()
                 for w, c in batch:
-                    bct.update(gen_rules_window(w, c))
+                    bct.update(window_rules(w, c))
                 ct.update(dict(bct.most_common(args.rule_count * 2)))
             freq.update(dict(((key, r), c)
                              for r, c in ct.most_common(args.rule_count)))
             print('\tfinished', key, 'in %.3f seconds' % (time.time() - t0))
+        gen_span.end()
+        score_span = phases.start('scoring')
         scored_rules = []
         ok_keys = set()
         failed_keys = set()
         threshold = sum(base_scores)
-        for batch in itertools.batched(enumerate(freq.most_common(args.rule_count)), args.threads):
-            procs = []
-            for i, ((k, r), c) in batch:
-                prefix = os.path.join(tmpdir, f'g_{iteration}_{i}')
-                procs.append(start_rule(prefix, r))
-            for (i, ((k, r), c)), proc in zip(batch, procs):
-                s = finish_rule(proc)
-                print(i, s, r)
-                if (threshold - s) > (c / 2):
-                #if s < threshold:
-                    ok_keys.add(k)
-                    scored_rules.append((s, i, r,
-                                         set([(x[0], k)
-                                              for x in lemma_index[k]])))
-                else:
-                    failed_keys.add(k)
+        candidates = list(enumerate(freq.most_common(args.rule_count)))
+        procs = []
+        phases.count('candidates', len(candidates))
+        for i, ((k, r), c) in candidates:
+            prefix = os.path.join(tmpdir, f'g_{iteration}_{i}')
+            procs.append(start_rule(prefix, r))
+        for (i, ((k, r), c)), proc in zip(candidates, procs):
+            s = finish_rule(proc)
+            print(i, s, r)
+            if (threshold - s) > (c / 2):
+            #if s < threshold:
+                ok_keys.add(k)
+                scored_rules.append((s, i, r,
+                                     set([(x[0], k)
+                                          for x in lemma_index[k]])))
+            else:
+                failed_keys.add(k)
+        score_span.end()
         scored_rules.sort()
         used = set()
         selected = []
@@ -309,13 +337,12 @@ with (TemporaryDirectory() as tmpdir_,
             update = os.path.join(tmpdir, f'g_{iteration}.cg3')
             with open(update, 'w') as fout:
                 fout.write(RULE_HEADER + '\n'.join(selected))
-            proc = subprocess.run(['vislcg3', '--in-binary', '--out-binary',
-                                   '-g', update],
-                                  capture_output=True, check=True,
-                                  input=(CG_BIN_HEADER +
-                                         b''.join(source_blocks) +
-                                         CG_BIN_FOOTER))
-            reload_source(proc.stdout)
+            with phases.timed('apply'):
+                out = cg_apply.Grammar(update).run_blocks(source_blocks)
+            with phases.timed('rescore'):
+                reload_source(out)
+                changed = window_rules.sync(source_blocks)
+            print(f'{len(changed)}/{len(source_blocks)} windows changed')
         print(f'## {iteration+1}:', sum(base_scores), file=rule_output)
         print(f'## {iteration+1}:', sum(base_scores))
         print(f'{exclude=}')
@@ -323,3 +350,4 @@ with (TemporaryDirectory() as tmpdir_,
             empty_count += 1
             if empty_count == 3:
                 break
+    phases.begin_iteration(None)
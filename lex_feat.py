@@ -1,13 +1,17 @@
 import argparse
+import applied_corpus
 import cg3
 import cg3_score
+import cg_apply
 from collections import Counter, defaultdict
 import io
 import itertools
 import json
 import os
-import subprocess
+import phases
+from rule_cache import WindowCache
 from tempfile import TemporaryDirectory
+import work_queue
 
 RULE_HEADER = 'DELIMITERS = "<$$$>" ;\nPROTECT (SOURCE) ;\n\n'
 
@@ -30,7 +34,15 @@ parser.add_argument('--batch_size', type=int, default=20)
 parser.add_argument('--out_dir', action='store')
 parser.add_argument('--score_proc', action='store')
 parser.add_argument('--threads', type=int, default=10)
+parser.add_argument('--queue', action='store',
+                    help='score candidates through a work_queue.py queue in '
+                    'this directory, which workers on other nodes can share')
+parser.add_argument('--queue_workers', type=int, default=0,
+                    help='local workers to start on the --queue')
+parser.add_argument('--profile', type=int,
+                    help='write a cProfile of this iteration to OUT.N.prof')
 args = parser.parse_args()
+phases.set_profile(args.profile, f'{args.out}.{args.profile}.prof')
 
 SKIP_WINDOWS = set()
 if args.skip_windows:
@@ -161,10 +173,9 @@ def reload_source(data, initial=False):
     source_maps = [None] * len(source)
 
 if args.append:
-    proc = subprocess.run(['vislcg3', '--in-binary', '--out-binary',
-                           '-g', args.out, '-I', args.source],
-                          capture_output=True, check=True)
-    reload_source(proc.stdout, initial=True)
+    with open(applied_corpus.apply(args.out, args.source, RULE_HEADER),
+              'rb') as fin:
+        reload_source(fin.read(), initial=True)
 else:
     with open(args.source, 'rb') as fin:
         reload_source(fin.read(), initial=True)
@@ -270,23 +281,34 @@ def gen_rules_window(window_num):
                                 ts += ' - ' + escape_set_name(f)
                             yield (f'SUBSTITUTE ({t1}) ({t2}) {ts} IF {ctx} ;', (ts0, f))
 
+# candidate rules of a window only change when its block does
+window_rules = WindowCache(lambda w: Counter(gen_rules_window(w)),
+                           source_blocks)
+
 CUR_SOURCE = None
 CUR_TARGET = None
 
 def start_rule(gpath, rule):
     with open(gpath, 'w') as fout:
         fout.write(RULE_HEADER + rule)
-    return subprocess.Popen(
+    phases.count('subprocesses')
+    job = pool.submit(
         [(args.score_proc or 'ch4_pipe_score/ch4_pipe_score'),
-         gpath, CUR_SOURCE, CUR_TARGET, args.lang, '--count-feats'],
-        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+         gpath, CUR_SOURCE, CUR_TARGET, args.lang, '--count-feats'])
+    job.span = phases.start('candidate', rule=rule)
+    return job
 
-def finish_rule(proc):
-    out, err = proc.communicate()
-    return int(out.decode('utf-8').split()[1])
+def finish_rule(job):
+    out = job.result()
+    job.span.end()
+    return int(out.split()[1])
 
 open_mode = 'a' if args.append else 'w'
-with (TemporaryDirectory() as tmpdir_,
+# files the scorers read go in the queue directory when there is one,
+# so that workers on other nodes can see them
+with (work_queue.open_pool(args.threads, args.queue,
+                           args.queue_workers) as pool,
+      TemporaryDirectory(dir=args.queue) as tmpdir_,
       open(args.out, open_mode) as rule_output):
     if args.append:
         rule_output.write('\n')
@@ -309,20 +331,22 @@ with (TemporaryDirectory() as tmpdir_,
     skip_entirely = set()
 
     for iteration in range(args.iterations):
+        phases.begin_iteration(iteration)
         CUR_SOURCE = os.path.join(tmpdir, f'input.{iteration}.bin')
         with open(CUR_SOURCE, 'wb') as fout:
             fout.write(CG_BIN_HEADER + b''.join(source_blocks) + CG_BIN_FOOTER)
+        gen_span = phases.start('generation')
         rule_counter = defaultdict(Counter)
         pos_counter = Counter()
         for batch in itertools.batched(range(len(source)), args.batch_size):
             pct = Counter()
             rct = defaultdict(Counter)
             for window_num in batch:
-                for r, p in gen_rules_window(window_num):
+                for (r, p), n in window_rules(window_num).items():
                     if p in skip_entirely or p in skip_next:
                         continue
-                    pct[p] += 1
-                    rct[p][r] += 1
+                    pct[p] += n
+                    rct[p][r] += n
             for p, _ in pct.most_common(args.pos_count * 2):
                 mc = rct[p].most_common(args.rule_count * 2)
                 mc = mc[(skip_count[p]*(args.rule_count>>1)):]
@@ -334,18 +358,22 @@ with (TemporaryDirectory() as tmpdir_,
         for p, _ in pos_counter.most_common(args.pos_count):
             rules += [(r, p, c) for r, c in
                       rule_counter[p].most_common(args.rule_count)]
+        gen_span.end()
+        score_span = phases.start('scoring')
         scored_rules = []
         threshold = sum(base_scores)
-        for batch in itertools.batched(enumerate(rules), args.threads):
-            procs = []
-            for i, (r, k, c) in batch:
-                path = os.path.join(tmpdir, f'g_{iteration}_{i}.cg3')
-                procs.append(start_rule(path, r))
-            for (i, (r, k, c)), p in zip(batch, procs):
-                s = finish_rule(p)
-                print(i, s, r)
-                if s < threshold:
-                    scored_rules.append((s, i, r, k))
+        candidates = list(enumerate(rules))
+        procs = []
+        phases.count('candidates', len(candidates))
+        for i, (r, k, c) in candidates:
+            path = os.path.join(tmpdir, f'g_{iteration}_{i}.cg3')
+            procs.append(start_rule(path, r))
+        for (i, (r, k, c)), p in zip(candidates, procs):
+            s = finish_rule(p)
+            print(i, s, r)
+            if s < threshold:
+                scored_rules.append((s, i, r, k))
+        score_span.end()
         scored_rules.sort()
         used = set()
         selected = []
@@ -364,14 +392,14 @@ with (TemporaryDirectory() as tmpdir_,
             update = os.path.join(tmpdir, f'g_{iteration}.cg3')
             with open(update, 'w') as fout:
                 fout.write(RULE_HEADER + '\n'.join(selected))
-            proc = subprocess.run(['vislcg3', '--in-binary', '--out-binary',
-                                   '-g', update],
-                                  capture_output=True, check=True,
-                                  input=(CG_BIN_HEADER +
-                                         b''.join(source_blocks) +
-                                         CG_BIN_FOOTER))
-            reload_source(proc.stdout)
+            with phases.timed('apply'):
+                out = cg_apply.Grammar(update).run_blocks(source_blocks)
+            with phases.timed('rescore'):
+                reload_source(out)
+                changed = window_rules.sync(source_blocks)
+            print(f'{len(changed)}/{len(source_blocks)} windows changed')
         print(f'## {iteration+1}:', sum(base_scores), file=rule_output)
         print(f'## {iteration+1}:', sum(base_scores))
         if not selected:
             break
+    phases.begin_iteration(None)
@@ -1,13 +1,18 @@
 import argparse
+import applied_corpus
+from bin_corpus import BinCorpus
 import cg3
 import cg3_score
+import cg_apply
 from collections import Counter, defaultdict
 import io
 import itertools
 import json
 import os
-import subprocess
+import phases
+from rule_cache import WindowCache
 import time
+import work_queue
 from tempfile import TemporaryDirectory
 
 RULE_HEADER = 'DELIMITERS = "<$$$>" ;\nPROTECT (SOURCE) ;\n\n'
@@ -31,7 +36,15 @@ parser.add_argument('--batch_size', type=int, default=100)
 parser.add_argument('--out_dir', action='store')
 parser.add_argument('--score_proc', action='store')
 parser.add_argument('--threads', type=int, default=10)
+parser.add_argument('--queue', action='store',
+                    help='score candidates through a work_queue.py queue in '
+                    'this directory, which workers on other nodes can share')
+parser.add_argument('--queue_workers', type=int, default=0,
+                    help='local workers to start on the --queue')
+parser.add_argument('--profile', type=int,
+                    help='write a cProfile of this iteration to OUT.N.prof')
 args = parser.parse_args()
+phases.set_profile(args.profile, f'{args.out}.{args.profile}.prof')
 
 SKIP_WINDOWS = set()
 if args.skip_windows:
@@ -53,16 +66,15 @@ def count_lemmas(window):
 target = []
 target_blocks = []
 target_counts = []
-with open(args.target, 'rb') as fin:
-    for i, block in enumerate(cg3_score.iter_blocks(fin.read())):
-        if i == args.max_sents:
-            break
-        if i in SKIP_WINDOWS:
-            continue
-        target_blocks.append(block)
-        window = cg3.parse_binary_window(block[5:])
-        target.append(window)
-        target_counts.append(count_lemmas(window))
+target_corpus = BinCorpus(args.target, max_sents=args.max_sents,
+                          cache_size=0, use_index=True)
+for i in range(len(target_corpus)):
+    if i in SKIP_WINDOWS:
+        continue
+    target_blocks.append(target_corpus[i])
+    window = target_corpus.window(i)
+    target.append(window)
+    target_counts.append(count_lemmas(window))
 
 def score_window(window_num, window):
     dct = count_lemmas(window)
@@ -78,7 +90,7 @@ source_counts = []
 source_maps = []
 base_scores = []
 
-def reload_source(data, initial=False):
+def reload_source(blocks, initial=False):
     global source, source_blocks, lemma_index, source_lemmas, ambiguity, source_counts, source_maps, base_scores
     source = []
     source_blocks = []
@@ -89,7 +101,7 @@ def reload_source(data, initial=False):
     ambiguity = Counter()
     source_counts = []
     base_scores = []
-    for i, block in enumerate(cg3_score.iter_blocks(data)):
+    for i, block in enumerate(blocks):
         if initial:
             if i == args.max_sents:
                 break
@@ -98,7 +110,7 @@ def reload_source(data, initial=False):
         if len(source) == len(target):
             break
         source_blocks.append(block)
-        window = cg3.parse_binary_window(block[5:])
+        window = cg3.parse_binary_window(bytes(block[5:]))
         cur = []
         for j, cohort in enumerate(window.cohorts):
             key = None
@@ -127,13 +139,12 @@ def reload_source(data, initial=False):
     source_maps = [None] * len(source)
 
 if args.append:
-    proc = subprocess.run(['vislcg3', '--in-binary', '--out-binary',
-                           '-g', args.out, '-I', args.source],
-                          capture_output=True, check=True)
-    reload_source(proc.stdout, initial=True)
+    with open(applied_corpus.apply(args.out, args.source, RULE_HEADER),
+              'rb') as fin:
+        reload_source(cg3_score.iter_blocks(fin.read()), initial=True)
 else:
-    with open(args.source, 'rb') as fin:
-        reload_source(fin.read(), initial=True)
+    reload_source(BinCorpus(args.source, max_sents=args.max_sents,
+                            cache_size=0, use_index=True), initial=True)
 
 def map_window(window_num):
     global source_maps
@@ -220,18 +231,20 @@ def score_rule(rpath, key, rule):
     with open(rpath, 'w') as fout:
         fout.write(RULE_HEADER + rule)
     windows = sorted(set([x[0] for x in lemma_index[key]]))
-    inp = CG_BIN_HEADER + b''.join(source_blocks[i] for i in windows) + CG_BIN_FOOTER
-    proc = subprocess.run(['vislcg3', '--in-binary', '--out-binary',
-                           '-g', rpath],
-                          capture_output=True, input=inp)
+    out = cg_apply.Grammar(rpath).run_blocks(
+        source_blocks[i] for i in windows)
     diff = 0
     for i, window in zip(windows,
-                         cg3.parse_binary_stream(io.BytesIO(proc.stdout),
+                         cg3.parse_binary_stream(io.BytesIO(out),
                                                  windows_only=True)):
         s, d = score_window(i, window)
         diff += s - base_scores[i]
     return diff, set(windows)
 
+# candidate rules of a cohort only change when its window does
+window_rules = WindowCache(lambda w, c: Counter(gen_rules_window(w, c)),
+                           source_blocks)
+
 CUR_SOURCE = None
 CUR_TARGET = None
 
@@ -239,17 +252,24 @@ def start_rule(prefix, rule):
     gpath = prefix + '.cg3'
     with open(gpath, 'w') as fout:
         fout.write(RULE_HEADER + rule)
-    return subprocess.Popen(
+    phases.count('subprocesses')
+    job = pool.submit(
         [(args.score_proc or 'ch4_pipe_score/ch4_pipe_score'),
-         gpath, CUR_SOURCE, CUR_TARGET, args.lang],
-        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+         gpath, CUR_SOURCE, CUR_TARGET, args.lang])
+    job.span = phases.start('candidate', rule=rule)
+    return job
 
-def finish_rule(proc):
-    out, err = proc.communicate()
-    return int(out.decode('utf-8').split()[1])
+def finish_rule(job):
+    out = job.result()
+    job.span.end()
+    return int(out.split()[1])
 
 open_mode = 'a' if args.append else 'w'
-with (TemporaryDirectory() as tmpdir_,
+# files the scorers read go in the queue directory when there is one,
+# so that workers on other nodes can see them
+with (work_queue.open_pool(args.threads, args.queue,
+                           args.queue_workers) as pool,
+      TemporaryDirectory(dir=args.queue) as tmpdir_,
       open(args.out, open_mode) as rule_output):
     if args.append:
         rule_output.write('\n')
@@ -266,9 +286,11 @@ with (TemporaryDirectory() as tmpdir_,
         fout.write(CG_BIN_HEADER + b''.join(target_blocks) + CG_BIN_FOOTER)
 
     for iteration in range(args.iterations):
+        phases.begin_iteration(iteration)
         CUR_SOURCE = os.path.join(tmpdir, f'input.{iteration}.bin')
         with open(CUR_SOURCE, 'wb') as fout:
             fout.write(CG_BIN_HEADER + b''.join(source_blocks) + CG_BIN_FOOTER)
+        gen_span = phases.start('generation')
         freq = Counter()
         for key, count in ambiguity.most_common(args.lemma_count):
             print(key, count)
@@ -277,25 +299,29 @@ with (TemporaryDirectory() as tmpdir_,
             for batch in itertools.batched(lemma_index[key], args.batch_size):
                 bct = Counter()
                 for w, c in batch:
-                    bct.update(gen_rules_window(w, c))
+                    bct.update(window_rules(w, c))
                 ct.update(dict(bct.most_common(args.rule_count * 2)))
             freq.update(dict(((key, r), c)
                              for r, c in ct.most_common(args.rule_count)))
             print('\tfinished', key, 'in %.3f seconds' % (time.time() - t0))
+        gen_span.end()
+        score_span = phases.start('scoring')
         scored_rules = []
         threshold = sum(base_scores)
-        for batch in itertools.batched(enumerate(freq.most_common(args.rule_count)), args.threads):
-            procs = []
-            for i, ((k, r), c) in batch:
-                prefix = os.path.join(tmpdir, f'g_{iteration}_{i}')
-                procs.append(start_rule(prefix, r))
-            for (i, ((k, r), c)), proc in zip(batch, procs):
-                s = finish_rule(proc)
-                print(i, s, r)
-                if s < threshold:
-                    scored_rules.append((s, i, r,
-                                         set([x[0]
-                                              for x in lemma_index[k]])))
+        candidates = list(enumerate(freq.most_common(args.rule_count)))
+        procs = []
+        phases.count('candidates', len(candidates))
+        for i, ((k, r), c) in candidates:
+            prefix = os.path.join(tmpdir, f'g_{iteration}_{i}')
+            procs.append(start_rule(prefix, r))
+        for (i, ((k, r), c)), proc in zip(candidates, procs):
+            s = finish_rule(proc)
+            print(i, s, r)
+            if s < threshold:
+                scored_rules.append((s, i, r,
+                                     set([x[0]
+                                          for x in lemma_index[k]])))
+        score_span.end()
         scored_rules.sort()
         used = set()
         selected = []
@@ -309,14 +335,14 @@ with (TemporaryDirectory() as tmpdir_,
             update = os.path.join(tmpdir, f'g_{iteration}.cg3')
             with open(update, 'w') as fout:
                 fout.write(RULE_HEADER + '\n'.join(selected))
-            proc = subprocess.run(['vislcg3', '--in-binary', '--out-binary',
-                                   '-g', update],
-                                  capture_output=True, check=True,
-                                  input=(CG_BIN_HEADER +
-                                         b''.join(source_blocks) +
-                                         CG_BIN_FOOTER))
-            reload_source(proc.stdout)
+            with phases.timed('apply'):
+                out = cg_apply.Grammar(update).run_blocks(source_blocks)
+            with phases.timed('rescore'):
+                reload_source(cg3_score.iter_blocks(out))
+                changed = window_rules.sync(source_blocks)
+            print(f'{len(changed)}/{len(source_blocks)} windows changed')
         print(f'## {iteration+1}:', sum(base_scores), file=rule_output)
         print(f'## {iteration+1}:', sum(base_scores))
         if not selected:
             break
+    phases.begin_iteration(None)
@@ -1,9 +1,14 @@
+import bisect
 from cg3 import parse_binary_stream, Window
 from collections import Counter, defaultdict
 from dataclasses import dataclass, field
+import gen_pool
 import itertools
+import numpy as np
 import utils
 
+# rules are looked up by their position here, so any change to the list
+# shows up in new linearizers, but a Rule must not be edited once it is in
 ALL_RULES = []
 
 @dataclass
@@ -48,6 +53,95 @@ def parse_rule_file(fname, to_global=True):
         ALL_RULES += ret
     return ret
 
+# mode of each rule as stored in RuleIndex.modes
+MODES = ['L', 'R', 'S', 'MR', 'F', 'B']
+MODE_ID = {m: i for i, m in enumerate(MODES)}
+
+class RuleIndex:
+    # Rules filed under the rarest tag of their ltags and, separately, of
+    # their rtags (rarest among the rules indexed so far), so that a
+    # cohort only checks the rules filed under one of its own tags. Rules
+    # with no tags on a side are filed under None and checked every time.
+    # The modes and weights of the rules are also kept in arrays indexed
+    # by rule id, which grow by doubling as rules are added.
+    def __init__(self):
+        self.rules = []
+        self.freq = Counter()
+        self.left = defaultdict(list)
+        self.right = defaultdict(list)
+        self.modes = np.zeros(64, dtype=np.int8)
+        self.weights = np.zeros(64)
+
+    def key(self, tags):
+        if not tags:
+            return None
+        return min(tags, key=lambda t: (self.freq[t], t))
+
+    def extend(self, rules):
+        rules = list(rules)
+        size = len(self.modes)
+        while size < len(self.rules) + len(rules):
+            size *= 2
+        if size > len(self.modes):
+            self.modes = np.resize(self.modes, size)
+            self.weights = np.resize(self.weights, size)
+        for r in rules:
+            self.freq.update(r.ltags)
+            self.freq.update(r.rtags)
+        for r in rules:
+            i = len(self.rules)
+            self.rules.append(r)
+            self.modes[i] = MODE_ID[r.mode]
+            self.weights[i] = r.weight
+            self.left[self.key(r.ltags)].append(i)
+            self.right[self.key(r.rtags)].append(i)
+
+    def match(self, pat):
+        # indices of the rules whose ltags and whose rtags are all in pat
+        left = []
+        right = []
+        for t in itertools.chain([None], pat):
+            for i in self.left.get(t, ()):
+                if self.rules[i].ltags <= pat:
+                    left.append(i)
+            for i in self.right.get(t, ()):
+                if self.rules[i].rtags <= pat:
+                    right.append(i)
+        return left, right
+
+def plain_number(x):
+    # weights are summed as floats; whole ones are handed back as ints so
+    # that learned rules are written as they were before
+    x = float(x)
+    return int(x) if x.is_integer() else x
+
+_INDEX = RuleIndex()
+_INDEX_IDS = []
+
+def rule_index():
+    # The index of ALL_RULES, extended with whatever has been appended
+    # since it was last built, and rebuilt if the rules it has are no
+    # longer the first ones in ALL_RULES (the list was replaced, cleared,
+    # refilled or had an item swapped). The index holds on to its rules,
+    # so their ids can't have been reused.
+    global _INDEX, _INDEX_IDS
+    n = len(_INDEX_IDS)
+    if n > len(ALL_RULES) or list(map(id, ALL_RULES[:n])) != _INDEX_IDS:
+        _INDEX = RuleIndex()
+        _INDEX_IDS = []
+    if len(_INDEX_IDS) < len(ALL_RULES):
+        new = ALL_RULES[len(_INDEX_IDS):]
+        _INDEX.extend(new)
+        _INDEX_IDS += map(id, new)
+    return _INDEX
+
+@dataclass
+class Trial:
+    # what a rule would change in a WindowLinearizer, kept apart from it
+    linearized: dict = field(default_factory=dict)
+    fronting: defaultdict = field(default_factory=lambda: defaultdict(Counter))
+    backing: defaultdict = field(default_factory=lambda: defaultdict(Counter))
+
 class WindowLinearizer:
     def __init__(self, window, extra_rules=None):
         self.layers = defaultdict(list)
@@ -62,13 +156,19 @@ class WindowLinearizer:
         self.heads = {0: 0}
         self.fronting = defaultdict(Counter)
         self.backing = defaultdict(Counter)
-        self.extra_fronting = defaultdict(Counter)
-        self.extra_backing = defaultdict(Counter)
+        if self.extra_rules:
+            self.index = RuleIndex()
+            self.index.extend(ALL_RULES + self.extra_rules)
+        else:
+            self.index = rule_index()
         for cohort in window.cohorts:
             self.process_cohort(cohort)
         for head in self.layers:
-            self.process_layer(head)
-        self.sequence = list(self.extract(0))
+            self.linearized[head] = self.process_layer(head)
+        # the sequence before shifts, which add_rule splices changes into
+        self.unshifted = list(self.extract(0))
+        self.unshifted_pos = {w: i for i, w in enumerate(self.unshifted)}
+        self.sequence = self.unshifted[:]
         self.apply_shifts(self.sequence)
 
     def process_cohort(self, cohort):
@@ -86,51 +186,77 @@ class WindowLinearizer:
                     break
             break
         pat = set(self.readings[cohort.dep_self])
-        for i, r in enumerate(ALL_RULES + self.extra_rules):
-            if r.ltags <= pat:
-                if r.mode == 'MR':
-                    self.shifts.append(cohort.dep_self)
-                else:
-                    self.lrules[cohort.dep_self].add(i)
-            if r.rtags <= pat:
-                self.rrules[cohort.dep_self].add(i)
+        left, right = self.match_rules(pat)
+        for i in left:
+            if self.index.rules[i].mode == 'MR':
+                self.shifts.append(cohort.dep_self)
+            else:
+                self.lrules[cohort.dep_self].add(i)
+        self.rrules[cohort.dep_self].update(right)
+
+    def match_rules(self, pat):
+        return self.index.match(pat)
 
     def calc_weights(self, head):
         if head in self.weights:
             return
         layer = self.layers[head]
-        weights = [[0 for i in layer] for j in layer]
-        for i, wi in enumerate(layer):
-            for j, wj in enumerate(layer):
-                if wj == head:
-                    continue
-                if i == j:
-                    continue
-                rules = self.lrules[wi] & self.rrules[wj]
-                for ri in rules:
-                    rl = (ALL_RULES + self.extra_rules)[ri]
-                    if wi == head:
-                        if rl.mode == 'L':
-                            weights[j][i] += rl.weight
-                        elif rl.mode == 'R':
-                            weights[i][j] += rl.weight
-                        elif rl.mode == 'B':
-                            self.backing[self.heads[wi]][wj] += rl.weight
-                        elif rl.mode == 'F':
-                            self.fronting[self.heads[wi]][wj] += rl.weight
-                    elif rl.mode == 'S':
-                        weights[i][j] += rl.weight
+        weights = np.zeros((len(layer), len(layer)))
         self.weights[head] = weights
+        # the rules that match on the left of one word in the layer and on
+        # the right of another, as columns of a word x rule matrix per side
+        ids = sorted(set().union(*(self.lrules[w] for w in layer)) &
+                     set().union(*(self.rrules[w] for w in layer)))
+        if not ids:
+            return
+        col = {ri: k for k, ri in enumerate(ids)}
+        lmat = np.zeros((len(layer), len(ids)))
+        rmat = np.zeros((len(layer), len(ids)))
+        for i, w in enumerate(layer):
+            for ri in self.lrules[w]:
+                if ri in col:
+                    lmat[i, col[ri]] = 1
+            for ri in self.rrules[w]:
+                if ri in col:
+                    rmat[i, col[ri]] = 1
+        ids = np.array(ids)
+        modes = self.index.modes[ids]
+        rule_weights = self.index.weights[ids]
+        def of_mode(mode, weighted=True):
+            # weights (or 1s) of the rules in ids that have this mode
+            return np.where(modes == MODE_ID[mode],
+                            rule_weights if weighted else 1, 0)
+        # [i, j] = total weight of the rules matching layer[i] on the left
+        # and layer[j] on the right
+        sib = (lmat * of_mode('S')) @ rmat.T
+        if head in layer:
+            h = layer.index(head)
+            sib[h, :] = 0
+            sib[:, h] = 0
+            # [j, k] = 1 if rule k matches the head and layer[j]
+            pair = lmat[h] * rmat
+            pair[h] = 0
+            weights[:, h] += pair @ of_mode('L')
+            weights[h, :] += pair @ of_mode('R')
+            gp = self.heads[head]
+            for mode, counter in [('B', self.backing[gp]),
+                                  ('F', self.fronting[gp])]:
+                hits = pair @ of_mode(mode, weighted=False)
+                for j, w in enumerate(pair @ of_mode(mode)):
+                    if hits[j]:
+                        counter[layer[j]] += plain_number(w)
+        np.fill_diagonal(sib, 0)
+        weights += sib
 
     def process_layer(self, head, temp_weights=None):
         layer = self.layers[head][:]
         if len(layer) == 1:
-            self.linearized[head] = layer
-            return
+            return layer
         self.calc_weights(head)
+        weights = self.weights[head].tolist()
 
         def w(i, j):
-            return (self.weights[head][i][j] +
+            return (weights[i][j] +
                     (temp_weights or {}).get((layer[i], layer[j]), 0))
 
         best_row = [layer.index(head)]
@@ -154,40 +280,79 @@ class WindowLinearizer:
             options.sort()
             best_row.insert(options[-1][-1], n)
 
-        self.linearized[head] = [layer[n] for n in best_row]
+        return [layer[n] for n in best_row]
 
-    def is_moved(self, i):
+    def is_moved(self, i, trial=None):
         gp = self.heads[self.heads[i]]
-        fw = self.fronting[gp][i] + self.extra_fronting[gp][i]
-        bw = self.backing[gp][i] + self.extra_backing[gp][i]
+        fw = self.fronting[gp][i]
+        bw = self.backing[gp][i]
+        if trial is not None:
+            fw += trial.fronting[gp][i]
+            bw += trial.backing[gp][i]
         return ((fw - max(bw, 0)) > 0 or (bw - max(fw, 0)) > 0)
 
-    def extract(self, head):
-        front_plain = self.fronting[head] + self.extra_fronting[head]
-        back_plain = self.backing[head] + self.extra_backing[head]
+    def output_parent(self, i):
+        # the node whose extract() yields the words of extract(i)
+        if self.is_moved(i):
+            return self.heads[self.heads[i]]
+        return self.heads[i]
+
+    def output_ancestors(self, i):
+        ret = [i]
+        while i != 0:
+            i = self.output_parent(i)
+            ret.append(i)
+        return ret
+
+    def extract(self, head, trial=None):
+        front_plain = +self.fronting[head]
+        back_plain = +self.backing[head]
+        linearized = self.linearized[head]
+        if trial is not None:
+            front_plain = self.fronting[head] + trial.fronting[head]
+            back_plain = self.backing[head] + trial.backing[head]
+            linearized = trial.linearized.get(head, linearized)
         # double + because negative backing != fronting
         front = +(front_plain - (+back_plain))
         back = +(back_plain - (+front_plain))
         for n, w in front.most_common():
-            yield from self.extract(n)
-        for i in self.linearized[head]:
+            yield from self.extract(n, trial)
+        for i in linearized:
             if i == head:
                 yield i
-            elif self.is_moved(i):
+            elif self.is_moved(i, trial):
                 continue
             else:
-                yield from self.extract(i)
+                yield from self.extract(i, trial)
         for n, w in reversed(back.most_common()):
-            yield from self.extract(n)
+            yield from self.extract(n, trial)
 
     def apply_shifts(self, sequence, extra_shifts=None):
-        for sh in (self.shifts + (extra_shifts or [])):
-            for i, w in enumerate(sequence):
-                if w == sh and i + 1 < len(sequence):
-                    sequence[i], sequence[i+1] = sequence[i+1], sequence[i]
-                    break
-
-    def add_rule(self, rule, index=None):
+        shifts = self.shifts + (extra_shifts or [])
+        if not shifts:
+            return
+        pos = {w: i for i, w in enumerate(sequence)}
+        for sh in shifts:
+            i = pos.get(sh)
+            if i is not None and i + 1 < len(sequence):
+                nxt = sequence[i+1]
+                sequence[i], sequence[i+1] = nxt, sh
+                pos[sh], pos[nxt] = i + 1, i
+
+    def rule_effect(self, rule, index=None):
+        # Work out what adding rule does, as the runs of self.unshifted
+        # that it reorders, each given as (start, new words), plus the
+        # shifts it adds. With index, self is updated to include the rule
+        # (except for the runs and shifts, which add_rule applies);
+        # without, self is left as it is. A rule that reorders a layer only
+        # changes the output of extract() for its head, and one that
+        # fronts or backs words (or undoes that) only that of the first
+        # node whose output has both their old and new places, and each of
+        # those outputs keeps the same words, so only they are
+        # re-extracted. Fronting and backing go in a Trial either way, so
+        # that the old places can be read from self, and are only then
+        # added to self with index.
+        trial = Trial()
         left = set()
         right = set()
         for cid, ctags in self.readings.items():
@@ -203,17 +368,18 @@ class WindowLinearizer:
                 if index is not None:
                     self.rrules[cid].add(index)
         update = set()
+        changed = set()
+        moves = []
         temp_weights = {}
         extra_shifts = []
         def set_weight(head, a, b):
-            nonlocal temp_weights, self, update
             update.add(head)
             if index is None:
                 temp_weights[(a, b)] = rule.weight
             else:
                 ai = self.layers[head].index(a)
                 bi = self.layers[head].index(b)
-                self.weights[head][ai][bi] += rule.weight
+                self.weights[head][ai, bi] += rule.weight
         if rule.mode == 'MR':
             extra_shifts = list(left)
         else:
@@ -235,39 +401,87 @@ class WindowLinearizer:
                     for r in layer:
                         if r == head or r not in right:
                             continue
-                        gp = self.heads[head]
-                        if index is None:
-                            if rule.mode == 'F':
-                                self.extra_fronting[gp][r] += rule.weight
-                            else:
-                                self.extra_backing[gp][r] += rule.weight
-                        else:
-                            if rule.mode == 'F':
-                                self.fronting[gp][r] += rule.weight
-                            else:
-                                self.backing[gp][r] += rule.weight
-        orig_lin = {}
+                        moves.append((self.heads[head], r))
         for head in update:
-            orig_lin[head] = self.linearized[head][:]
-            self.process_layer(head, temp_weights)
-        seq = list(self.extract(0))
-        self.apply_shifts(seq, extra_shifts)
-
-        assert(len(self.sequence) == len(seq))
+            order = self.process_layer(head, temp_weights)
+            if order == self.linearized[head]:
+                continue
+            changed.add(head)
+            if index is not None:
+                self.linearized[head] = order
+            else:
+                trial.linearized[head] = order
+        for gp, r in moves:
+            if rule.mode == 'F':
+                trial.fronting[gp][r] += rule.weight
+            else:
+                trial.backing[gp][r] += rule.weight
+        for gp, r in moves:
+            # r is yielded by gp if it ends up moved and by its head if it
+            # doesn't (a negative weight or one that cancels earlier ones
+            # can put it back), so the output of the first node, as things
+            # are now, to yield both where it is and where it goes changes
+            dest = gp if self.is_moved(r, trial) else self.heads[r]
+            above = set(self.output_ancestors(dest))
+            n = self.output_parent(r)
+            while n not in above:
+                n = self.output_parent(n)
+            changed.add(n)
+        # only the outermost, by the output before the rule
+        outer = [n for n in changed
+                 if not any(a in changed for a in self.output_ancestors(n)[1:])]
+        runs = []
+        for node in outer:
+            words = list(self.extract(node, trial))
+            start = min(self.unshifted_pos[w] for w in words)
+            assert(set(words) ==
+                   set(self.unshifted[start:start+len(words)]))
+            runs.append((start, words))
+        if index is not None:
+            for gp, r in moves:
+                if rule.mode == 'F':
+                    self.fronting[gp][r] += rule.weight
+                else:
+                    self.backing[gp][r] += rule.weight
+        return runs, extra_shifts
 
+    def add_rule(self, rule, index=None):
+        # the new sequence with rule added; with index, it is also added
+        # to self as rule number index
+        runs, extra_shifts = self.rule_effect(rule, index)
         if index is None:
-            self.linearized.update(orig_lin)
-            self.extra_fronting.clear()
-            self.extra_backing.clear()
-        else:
-            self.sequence = seq
-            self.shifts += extra_shifts
+            seq = self.unshifted[:]
+            for start, words in runs:
+                seq[start:start+len(words)] = words
+            self.apply_shifts(seq, extra_shifts)
+            assert(len(self.sequence) == len(seq))
+            return seq
+        for start, words in runs:
+            self.unshifted[start:start+len(words)] = words
+            for i, w in enumerate(words, start):
+                self.unshifted_pos[w] = i
+        seq = self.unshifted[:]
+        self.apply_shifts(seq, extra_shifts)
+        assert(len(self.sequence) == len(seq))
+        self.sequence = seq
+        self.shifts += extra_shifts
         return seq
 
+    def reordered_runs(self, rule):
+        # (old words, new words) for each run of self.sequence that rule
+        # would reorder, or None if it or an earlier rule shifts words,
+        # since shifts apply to the whole sequence
+        if self.shifts or rule.mode == 'MR':
+            return None
+        runs, _ = self.rule_effect(rule)
+        return [(self.sequence[start:start+len(words)], words)
+                for start, words in runs]
+
     def get_weight_difference(self, head, left, right):
         l = self.layers[head].index(left)
         r = self.layers[head].index(right)
-        return self.weights[head][l][r] - self.weights[head][r][l]
+        return plain_number(self.weights[head][l, r] -
+                            self.weights[head][r, l])
 
 def linearize_file(fname, format='cg'):
     with open(fname, 'rb') as fin:
@@ -296,6 +510,29 @@ def linearize_file(fname, format='cg'):
                           sep='\t')
             print()
 
+def count_inversions(spans):
+    # number of pairs p < q where spans[q] ends before spans[p] starts,
+    # skipping Nones, with a Fenwick tree over the starts seen so far
+    starts = sorted({sp[0] for sp in spans if sp is not None})
+    tree = [0] * (len(starts) + 1)
+    seen = 0
+    ret = 0
+    for sp in spans:
+        if sp is None:
+            continue
+        # earlier spans starting no later than this one ends
+        k = bisect.bisect_right(starts, sp[1])
+        while k > 0:
+            ret -= tree[k]
+            k -= k & -k
+        ret += seen
+        k = bisect.bisect_left(starts, sp[0]) + 1
+        while k < len(tree):
+            tree[k] += 1
+            k += k & -k
+        seen += 1
+    return ret
+
 @dataclass
 class BaseSentence:
     source: Window = None
@@ -306,6 +543,7 @@ class BaseSentence:
     wl: WindowLinearizer = None
     descriptions: list = field(default_factory=list)
     id2idx: dict = field(default_factory=dict)
+    spans: dict = field(default_factory=dict)
 
     def preprocess(self):
         pass
@@ -314,6 +552,12 @@ class BaseSentence:
         # return True if a is unambiguously before b in the correct order
         raise NotImplementedError
 
+    def target_span(self, a):
+        # (first, last) position of a in the correct order, such that
+        # before(a, b) is last(a) < first(b), or None if a is never before
+        # or after anything
+        raise NotImplementedError
+
     @classmethod
     def from_input(cls, src, tgt):
         ret = cls(source=src, target=tgt)
@@ -322,6 +566,7 @@ class BaseSentence:
             ret.make_descriptions(cohort)
         ret.wl = WindowLinearizer(ret.source)
         ret.preprocess()
+        ret.spans = {w: ret.target_span(w) for w in ret.wl.sequence}
         return ret
 
     def describe_word(self, wid):
@@ -345,9 +590,24 @@ class BaseSentence:
                 if self.before(j, i):
                     yield i, j
 
+    def count_wrong_pairs(self, seq=None):
+        # len(list(self.wrong_pairs(seq))) in O(n log n)
+        s = seq or self.wl.sequence
+        return count_inversions([self.spans[w] for w in s])
+
     def score(self, rule):
         seq = self.wl.add_rule(rule)
-        return len(list(self.wrong_pairs(seq)))
+        return self.count_wrong_pairs(seq)
+
+    def score_delta(self, rule):
+        # score(rule) - count_wrong_pairs(), counting only within the runs
+        # of words that the rule reorders when it can
+        runs = self.wl.reordered_runs(rule)
+        if runs is None:
+            return self.score(rule) - self.count_wrong_pairs()
+        return sum(count_inversions([self.spans[w] for w in new]) -
+                   count_inversions([self.spans[w] for w in old])
+                   for old, new in runs)
 
     def weight(self, head, i, j):
         return max(self.wl.get_weight_difference(head, i, j) + 1, 1)
@@ -363,6 +623,7 @@ class BaseSentence:
 
     def gen_rules(self):
         self.base_score = 0
+        pos = {w: k for k, w in enumerate(self.wl.sequence)}
         for i, j in self.wrong_pairs():
             self.base_score += 1
             if self.heads[i] == j:
@@ -387,7 +648,7 @@ class BaseSentence:
                 w += max(self.wl.fronting[self.heads[j]][i], 0)
                 yield from self.expand_rule(self.heads[i], i, 'F', w)
             # TODO: un-front, un-back
-            elif (self.wl.sequence.index(i) + 1 == self.wl.sequence.index(j)
+            elif (pos[i] + 1 == pos[j]
                   and self.before(i, self.heads[j])
                   and not any(self.before(j, x) and self.before(x, i)
                               for x in self.wl.sequence)):
@@ -395,11 +656,25 @@ class BaseSentence:
             else:
                 pass # no pattern, see if changes elsewhere fix it
 
+# the trainer whose candidates are being scored; forked gen_pool workers
+# find it (and the corpus, shared copy-on-write) here instead of having it
+# pickled
+ACTIVE = None
+
+def score_shard(start, end):
+    # score differences for ACTIVE.candidates[start:end]
+    return [ACTIVE.score_rule(rule)
+            for rule in ACTIVE.candidates[start:end]]
+
 @dataclass
 class BaseTrainer:
     corpus: list = field(default_factory=list)
     iterations: int = 10
     count: int = 100
+    threads: int = 1
+    # tag => ids of the sentences whose tagset has it, in order
+    postings: dict = field(default_factory=dict)
+    candidates: list = field(default_factory=list)
     sentence_class = BaseSentence
 
     def load_corpus(self, src_fname, tgt_fname):
@@ -410,6 +685,33 @@ class BaseTrainer:
                 for src, tgt in zip(
                         parse_binary_stream(sfin, windows_only=True),
                         utils.conllu_sentences(tfin))]
+        self.postings = defaultdict(list)
+        for i, sent in enumerate(self.corpus):
+            for tag in sent.tagset:
+                self.postings[tag].append(i)
+
+    def rule_sentences(self, rule):
+        # ids of the sentences which have all the tags of rule
+        tags = rule.ltags | rule.rtags
+        if not tags:
+            return range(len(self.corpus))
+        lists = sorted((self.postings.get(t, []) for t in tags), key=len)
+        ret = set(lists[0])
+        for ls in lists[1:]:
+            if not ret:
+                break
+            ret.intersection_update(ls)
+        return sorted(ret)
+
+    def score_rule(self, rule):
+        # change in the number of wrong pairs over the corpus if rule were
+        # added
+        diff = 0
+        for i in self.rule_sentences(rule):
+            sent = self.corpus[i]
+            if rule.ltags < sent.tagset and rule.rtags < sent.tagset:
+                diff += sent.score_delta(rule)
+        return diff
 
     def generate_rule(self):
         rule_freq = Counter()
@@ -421,14 +723,17 @@ class BaseTrainer:
                 if rs not in rules:
                     rules[rs] = rule
         print('starting score', sum(s.base_score for s in self.corpus))
+        global ACTIVE
+        ACTIVE = self
+        self.candidates = [rules[rs]
+                           for rs, _ in rule_freq.most_common(self.count)]
+        diffs = []
+        for part in gen_pool.map_shards(score_shard, len(self.candidates),
+                                        self.threads):
+            diffs += part
         results = []
-        for rs, _ in rule_freq.most_common(self.count):
-            rule = rules[rs]
-            diff = 0
-            for sent in self.corpus:
-                if rule.ltags < sent.tagset and rule.rtags < sent.tagset:
-                    diff += sent.score(rule) - sent.base_score
-            #print(diff, rs)
+        for diff, rule in zip(diffs, self.candidates):
+            #print(diff, rule.to_string())
             if diff < 0:
                 results.append((diff, rule))
         if results:
@@ -457,9 +762,12 @@ class BaseTrainer:
         parser.add_argument('--initial_rules', action='store')
         parser.add_argument('--iterations', type=int, default=10)
         parser.add_argument('--count', type=int, default=100)
+        parser.add_argument('--threads', type=int, default=1,
+                            help='processes to score candidates with')
         args = parser.parse_args()
         self.iterations = args.iterations
         self.count = args.count
+        self.threads = args.threads
 
         with open(args.output_rules, 'w') as fout:
 
@@ -0,0 +1,129 @@
+import atexit
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import cProfile
+import json
+import os
+import resource
+import sys
+import time
+
+# Wall time spent in each phase of a learner iteration (generation,
+# intersection, scoring, apply, rescore), summed over the run, plus
+# counters such as the number of candidates scored. When TBL_PHASES names
+# a file the totals are written there as JSON on exit, which is how
+# bench.py collects them.
+#
+# When TBL_TRACE names a file, every span is also appended to it as a
+# JSON line with its wall and CPU time (ours and that of the children we
+# waited for) and how much the counters moved while it was open:
+# subprocesses started, bytes piped through CG and candidates scored.
+# summarize_logs.py --trace aggregates these.
+wall = defaultdict(float)
+counts = Counter()
+COUNTERS = ['subprocesses', 'bytes_in', 'bytes_out', 'candidates']
+
+SCRIPT = os.path.basename(sys.argv[0])
+_pid = os.getpid()
+_iteration = None
+_trace = None
+if os.environ.get('TBL_TRACE'):
+    _trace = open(os.environ['TBL_TRACE'], 'a', buffering=1)
+
+# iteration to run under cProfile and where to write its stats
+_profile_iteration = None
+_profile_path = None
+_profiler = None
+
+def cpu_times():
+    t = os.times()
+    return t.user + t.system, t.children_user + t.children_system
+
+def event(phase, **fields):
+    if _trace is None or os.getpid() != _pid:
+        return
+    ev = {'script': SCRIPT, 'pid': _pid, 'iteration': _iteration,
+          'phase': phase}
+    ev.update(fields)
+    _trace.write(json.dumps(ev) + '\n')
+
+class Span:
+    def __init__(self, phase, fields):
+        self.phase = phase
+        self.fields = fields
+        self.start = time.time()
+        self.t0 = time.perf_counter()
+        self.cpu0, self.child0 = cpu_times()
+        self.counts0 = [counts[k] for k in COUNTERS]
+
+    def end(self, **fields):
+        elapsed = time.perf_counter() - self.t0
+        wall[self.phase] += elapsed
+        if _trace is None:
+            return
+        cpu, child = cpu_times()
+        ev = {'start': self.start, 'wall': elapsed, 'cpu': cpu - self.cpu0,
+              'child_cpu': child - self.child0}
+        for k, c in zip(COUNTERS, self.counts0):
+            ev[k] = counts[k] - c
+        ev.update(self.fields)
+        ev.update(fields)
+        event(self.phase, **ev)
+
+def start(phase, **fields):
+    # for spans that don't fit in a with block; call .end() on the result
+    return Span(phase, fields)
+
+@contextmanager
+def timed(phase, **fields):
+    span = Span(phase, fields)
+    try:
+        yield span
+    finally:
+        span.end()
+
+def count(name, n=1):
+    counts[name] += n
+
+def set_profile(iteration, path):
+    global _profile_iteration, _profile_path
+    _profile_iteration = iteration
+    _profile_path = path
+
+def _stop_profile():
+    global _profiler
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(_profile_path)
+        print(f'wrote profile of iteration {_profile_iteration} to {_profile_path}')
+        _profiler = None
+
+def begin_iteration(iteration):
+    # called at the top of each iteration and with None after the last
+    # one, so that events are labelled and --profile covers one iteration
+    global _iteration, _profiler
+    _stop_profile()
+    _iteration = iteration
+    if iteration is not None and iteration == _profile_iteration:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+def report():
+    return {
+        'wall': dict(wall),
+        'counts': dict(counts),
+        'max_mem_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'children_max_mem_kb':
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+def dump(path):
+    with open(path, 'w') as fout:
+        json.dump(report(), fout, indent=2)
+
+# not in forked gen_pool workers, which also run atexit handlers
+# inherited from this process if they exit normally
+atexit.register(lambda: os.getpid() == _pid and _stop_profile())
+if os.environ.get('TBL_PHASES'):
+    atexit.register(lambda: os.getpid() == _pid
+                    and dump(os.environ['TBL_PHASES']))
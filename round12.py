@@ -1,19 +1,18 @@
-from cg3 import parse_binary_stream as parse_cg3
+import applied_corpus
+import batch_score
 import cg3_score
-from metrics import PER
+import cg_apply
+from error_index import ErrorIndex
+import phases
+from tbl import Learner, desc_c, desc_r, get_rel
 
 import argparse
 from collections import Counter, defaultdict
-import io
 from itertools import combinations
 import json
 import os
 import resource
-import sqlite3
-import struct
-import subprocess
 import sys
-from tempfile import TemporaryDirectory, NamedTemporaryFile
 import time
 
 START = time.time()
@@ -30,115 +29,12 @@ PROTECT (SOURCE) ;
 '''.lstrip()
 LEAF_POS = ['CCONJ', 'ADP', 'DET', 'PUNCT', 'INTJ', 'PART', 'AUX']
 
-parser = argparse.ArgumentParser()
-parser.add_argument('source')
-parser.add_argument('target')
-parser.add_argument('iterations', type=int)
-parser.add_argument('out')
-parser.add_argument('--weights', action='store', default='{}')
-parser.add_argument('--count', type=int, default=25,
-                    help='number of templates to expand')
-parser.add_argument('--ctx', type=int, default=2,
-                    help='max context tests')
-parser.add_argument('--beam', type=int, default=25,
-                    help='max instantiations of a single pattern')
-parser.add_argument('--rule_count', type=int, default=25,
-                    help='number of rules to try')
-parser.add_argument('--context_similarity', type=float, default=0.9,
-                    help='threshold for discarding more complex context as equivalent')
-parser.add_argument('--append', action='store_true',
-                    help='retain any rules already present in output file')
-parser.add_argument('--max_sents', type=int, default=0,
-                    help='use only first N sentences')
-parser.add_argument('--target_feats', action='store',
-                    help='skip removing features not in this JSON list')
-parser.add_argument('--skip_windows', action='store',
-                    help='skip windows with indecies in this JSON list')
-parser.add_argument('--score_report', action='store_true',
-                    help='print the contribution of each factor to the final error score')
-parser.add_argument('--rtypes', action='store',
-                    help='only generate certain rule types')
-args = parser.parse_args()
-
-WEIGHTS = defaultdict(lambda: 1, json.loads(args.weights))
-EXCLUDE = set()
-TARGET_FEATS = None
-if args.target_feats:
-    with open(args.target_feats) as fin:
-        TARGET_FEATS = set(json.loads(fin.read()))
-SKIP_WINDOWS = set()
-if args.skip_windows:
-    with open(args.skip_windows) as fin:
-        SKIP_WINDOWS = set(json.loads(fin.read()))
-if args.rtypes:
-    RTYPES = json.loads(args.rtypes)
-
-def desc_r(reading):
-    ret = reading.lemma
-    for t in reading.tags:
-        if t != 'SOURCE':
-            ret += ' ' + t
-            break
-    return ret
-def desc_c(cohort):
-    for r in cohort.readings:
-        if 'SOURCE' in r.tags:
-            return desc_r(r)
-    return desc_r(cohort.readings[0])
-
-def get_rel(cohort):
-    for r in cohort.readings:
-        for t in r.tags:
-            if t[0] == '@':
-                return t
-
-def tags_to_feature_dict(tags, dct=None):
-    if dct is None:
-        dct = defaultdict(Counter)
-    for t in tags:
-        if '=' in t:
-            k, v = t.split('=', 1)
-            if TARGET_FEATS is not None and k not in TARGET_FEATS:
-                continue
-            dct[k][v] += 1
-    return dct
-
-def tags_to_flat_feature_dict(desc, tags, dct):
-    for t in tags:
-        if '=' in t:
-            k, v = t.split('=', 1)
-            if TARGET_FEATS is not None and k not in TARGET_FEATS:
-                continue
-            dct[(desc, t)] += 1
-
-def collect_words_and_feats(window, for_eval=True, for_gen=True):
-    words = Counter()
-    feats = defaultdict(lambda: defaultdict(Counter))
-    feats_flat = Counter()
-    for c in window.cohorts:
-        for r in c.readings:
-            if 'SOURCE' in r.tags:
-                continue
-            d = desc_r(r)
-            words[d] += 1
-            if for_gen:
-                tags_to_feature_dict(r.tags, feats[d])
-            if for_eval:
-                tags_to_flat_feature_dict(d, r.tags, feats_flat)
-    return words, feats, feats_flat
-
-with open(args.target, 'rb') as fin:
-    target = list(parse_cg3(fin, windows_only=True))
-    if args.max_sents > 0:
-        target = target[:args.max_sents]
-target_words_and_feats = [collect_words_and_feats(w) for w in target]
-
-def gen_rules(window, slw, tlw):
-    if window in SKIP_WINDOWS:
+def gen_rules(lr, window, slw, tlw):
+    if window in lr.skip_windows:
         return []
     rules = []
-    src_words, src_feats, _ = collect_words_and_feats(slw, for_eval=False)
-    tgt_words, tgt_feats, _ = target_words_and_feats[window]
+    src_words, src_feats, _ = lr.collect_words_and_feats(slw, for_eval=False)
+    tgt_words, tgt_feats, _ = lr.target_words_and_feats[window]
     extra = +(src_words - tgt_words)
     missing = +(tgt_words - src_words)
     for idx, cohort in enumerate(slw.cohorts):
@@ -207,7 +103,7 @@ def gen_rules(window, slw, tlw):
                         rules.append(('substitute', f'{fi} {fj}', '*')+suf)
     def error_key(row):
         return '-'.join(row[k] for k in [0, 1, 2, 5])
-    return [r for r in rules if error_key(r) not in EXCLUDE]
+    return [r for r in rules if error_key(r) not in lr.exclude]
 
 def format_rule(rtype, target, tags=None, desttags=None, context=None):
     ls = []
@@ -284,19 +180,16 @@ def collect_neighbors(slw, idx, dct):
         elif cohort.dep_parent == ds:
             dct['c'].add(cohort.dep_self)
 
-def select_contexts(cur, dct, rtype):
+def select_contexts(index, dct, rtype, similarity):
     RANGE = 10
     ret = defaultdict(Counter)
     for rel in dct:
-        cs = list(dct[rel])
-        qs = ', '.join(['?']*len(cs))
-        cur.execute(
-            f'SELECT cohort, pattern FROM tests WHERE is_feat = ? AND cohort IN ({qs})',
-            [(rtype == 'substitute' and rel != 't')] + cs)
+        is_feat = (rtype == 'substitute' and rel != 't')
+        tests = index.tests_for(dct[rel], lambda r: r[2] == is_feat)
         d2 = defaultdict(set)
         c2 = Counter()
         # shorter tests first
-        for c, p in sorted(cur.fetchall(), key=lambda r: len(r[1])):
+        for c, p, _ in sorted(tests, key=lambda r: len(r[1])):
             if rel == 't' and 'LINK' in p:
                 continue
             d2[p].add(c)
@@ -313,27 +206,28 @@ def select_contexts(cur, dct, rtype):
                 pj = ls[j][0]
                 comp = len(d2[pattern].intersection(d2[pj])) / count
                 #print(pattern, count, pj, ls[j][1], comp)
-                if comp >= args.context_similarity:
+                if comp >= similarity:
                     break
             else:
                 ret[rel][pattern] = count
     return ret
 
-def rel_ranges(include_parent):
+def rel_ranges(max_ctx, include_parent):
     mn = 1 if include_parent else 0
-    for n in range(1, args.ctx+1):
+    for n in range(1, max_ctx+1):
         for i_p in range(mn, 2):
             for i_s in range(n-i_p+1):
                 yield i_p, i_s, (n-i_p-i_s)
 
-def contextualize_rules(contexts, dct, ekey, include_parent=False):
-    ct = args.count >> 2
+def contextualize_rules(contexts, dct, ekey, limit, max_ctx,
+                        include_parent=False):
+    ct = limit >> 2
     cp = [(f'p {k}',v) for k,v in contexts['p'].most_common(ct)]
     cs = [(f's {k}',v) for k,v in contexts['s'].most_common(ct)]
     cs += [(f'NEGATE s {k}',v) for k,v in contexts['negs'].most_common(ct)]
     cc = [(f'c {k}',v) for k,v in contexts['c'].most_common(ct)]
     cc += [(f'NEGATE c {k}',v) for k,v in contexts['negc'].most_common(ct)]
-    for i_p, i_s, i_c in rel_ranges(include_parent):
+    for i_p, i_s, i_c in rel_ranges(max_ctx, include_parent):
         for t_p in combinations(cp, i_p):
             for t_s in combinations(cs, i_s):
                 for t_c in combinations(cc, i_c):
@@ -347,276 +241,212 @@ def contextualize_rules(contexts, dct, ekey, include_parent=False):
                                min(count, tgi),
                                ekey)
 
-def run_grammar(ipath, gpath, opath):
-    try:
-        subprocess.run(['vislcg3', '--in-binary', '--out-binary', '-g',
-                        gpath, '-I', ipath, '-O', opath],
-                       capture_output=True, check=True)
-    except subprocess.CalledProcessError:
-        with open(gpath) as fin:
-            print(fin.read())
-        raise
-    with open(opath, 'rb') as fout:
-        yield from parse_cg3(fout, windows_only=True)
-
-CG_BIN_HEADER = b'CGBF\x01\x00\x00\x00'
-CG_BIN_FOOTER = b'\x02\x01\x02\x02' # FLUSH, EXIT
-def run_windows(gpath, windows):
-    inp = CG_BIN_HEADER + b''.join(source_blocks[i] for i in windows) + CG_BIN_FOOTER
-    proc = subprocess.run(['vislcg3', '--in-binary', '--out-binary',
-                           '-g', gpath],
-                          capture_output=True, check=True, input=inp)
-    #yield from parse_cg3(io.BytesIO(proc.stdout), windows_only=True)
-    yield from cg3_score.iter_blocks(proc.stdout)
-
-def calc_intersection(rules: list, ipath, gpath: str, opath: str):
-    if not rules:
-        return [], {}
-    with open(gpath, 'w') as fout:
-        for i, r in enumerate(rules):
-            fout.write(r[2].replace('{NUM}', str(i)) + '\n')
-    target_windows = defaultdict(set)
-    targets = defaultdict(set)
-    contexts = defaultdict(set)
-    for idx, window in enumerate(run_grammar(ipath, gpath, opath)):
-        if idx in SKIP_WINDOWS or idx >= len(target):
-            continue
-        for cohort in window.cohorts:
-            for tag, heads in cohort.relations.items():
-                if tag[0] == 'r' and tag[1:].isdigit():
-                    contexts[int(tag[1:])].update(heads)
-                elif tag.startswith('tr') and tag[2:].isdigit():
-                    targets[int(tag[2:])].add(cohort.dep_self)
-                    target_windows[int(tag[2:])].add(idx)
-    intersections = [set() for i in range(len(rules))]
-    for i in range(len(rules)):
-        if not contexts[i]:
-            continue
-        for j in range(i):
-            if (targets[i] & targets[j]
-                or targets[i] & contexts[j]
-                or targets[j] & contexts[i]):
-                intersections[i].add(j)
-                intersections[j].add(i)
-    return intersections, {k: sorted(v) for k, v in target_windows.items()}
-
-def score_window(slw, tlw, index):
-    if index in SKIP_WINDOWS:
-        return 0
-    score = 0
-    score += WEIGHTS['cohorts'] * abs(len(slw.cohorts) - len(tlw.cohorts))
-    src_words, _, src_feats = collect_words_and_feats(slw, for_gen=False)
-    tgt_words, _, tgt_feats = target_words_and_feats[index]
-    extra, missing = cg3_score.symmetric_difference(src_words, tgt_words)
-    score += WEIGHTS['missing'] * missing
-    score += WEIGHTS['extra'] * extra
-    score += WEIGHTS['ambig'] * (src_words.total() - len(slw.cohorts))
-    score += WEIGHTS['ins'] * len([s for s in slw.cohorts if s.static.lemma == '"<ins>"'])
-    score += WEIGHTS['unk'] * sum([ct for lm, ct in src_words.items()
-                                   if lm.startswith('"@')])
-    mf, ef = cg3_score.symmetric_difference(tgt_feats, src_feats)
-    score += WEIGHTS['missing_feats'] * mf
-    score += WEIGHTS['extra_feats'] * ef
-    return score
-
-def score_buffer(slb, tlw, index):
-    if index in SKIP_WINDOWS:
-        return 0
-    score = 0
-    src_words, src_feats, src_counts = cg3_score.parse_window(
-        slb, TARGET_FEATS)
-    score += WEIGHTS['cohorts'] * abs(src_counts['cohort'] - len(tlw.cohorts))
-    tgt_words, _, tgt_feats = target_words_and_feats[index]
-    extra, missing = cg3_score.symmetric_difference(src_words, tgt_words)
-    score += WEIGHTS['missing'] * missing
-    score += WEIGHTS['extra'] * extra
-    score += WEIGHTS['ambig'] * (src_counts['reading'] - src_counts['cohort'])
-    score += WEIGHTS['ins'] * src_counts['ins']
-    score += WEIGHTS['unk'] * src_counts['unk']
-    mf, ef = cg3_score.symmetric_difference(tgt_feats, src_feats)
-    score += WEIGHTS['missing_feats'] * mf
-    score += WEIGHTS['extra_feats'] * ef
-    return score
-
-source = []
-source_blocks = []
-window_scores = []
-base_score = 0
-def update_source(fname):
-    global source, source_blocks, window_scores, base_score
-    with open(fname, 'rb') as fin:
-        source = list(parse_cg3(fin, windows_only=True))
-        fin.seek(0)
-        source_blocks = list(cg3_score.iter_blocks(fin.read()))
-    window_scores = [score_window(s, t, i) for i, (s, t) in enumerate(zip(source, target))]
-    base_score = sum(window_scores)
-update_source(args.source)
-print(f'{len(source)=}, {len(target)=}')
-
-from cg3 import parse_binary_window
-BINARY = True
-def score_rule(rule, gpath, windows):
-    with open(gpath, 'w') as fout:
-        fout.write(RULE_HEADER + rule[1])
-    score = 0
-    last_window = 0
-    for idx, slb in zip(windows, run_windows(gpath, windows)):
-        score += sum(window_scores[last_window:idx])
-        if BINARY:
-            score += score_buffer(slb, target[idx], idx)
-            #print(parse_binary_window(slb[5:]))
-        else:
-            slw = parse_binary_window(slb[5:])
-            score += score_window(slw, target[idx], idx)
-        last_window = idx+1
-    score += sum(window_scores[last_window:])
-    return score
-
-initial_rule_output = RULE_HEADER
-initial_source = args.source
-if args.append:
-    with open(args.out) as fin:
-        initial_rule_output = fin.read().strip() + '\n\n'
-        if not initial_rule_output.startswith(RULE_HEADER):
-            initial_rule_output = RULE_HEADER + initial_rule_output
-    new_source = NamedTemporaryFile(delete=False, delete_on_close=False)
-    initial_source = new_source.name
-    subprocess.run(['vislcg3', '--in-binary', '--out-binary', '-g',
-                    args.out, '-I', args.source, '-O', new_source.name],
-                   capture_output=True)
-    update_source(new_source.name)
-
-with (TemporaryDirectory() as tmpdir,
-      open(args.out, 'w') as rule_output):
-    db_path = os.path.join(tmpdir, 'db.sqlite')
-    con = sqlite3.connect(db_path)
-    cur = con.cursor()
-    cur.execute('CREATE TABLE errors(rule, tags1, tags2, window, cohort, cohort_key)')
-    cur.execute('CREATE TABLE context(rtype, rule TEXT, relation TEXT, count INT, error_label TEXT)')
-    cur.execute('CREATE TABLE tests(cohort INTEGER, pattern TEXT, is_feat)')
-    cur.execute('CREATE INDEX test_index ON tests(cohort)')
-    con.commit()
-    rule_output.write(initial_rule_output)
-
-    def log_scores(iteration, src_path):
-        global target, rule_output, EXCLUDE
-        update_source(src_path)
-        base_per = PER(source, target, TARGET_FEATS)
-        rule_output.write('####################\n')
-        rule_output.write(f'## {iteration}: {base_score} PER_lem {base_per[0]:.2f}% PER_form {base_per[1]:.2f}%\n')
-        rule_output.write('####################\n')
-        print(f'{iteration=}, {base_score=}, {len(EXCLUDE)=} PER_lem {base_per[0]:.2f}% PER_form {base_per[1]:.2f}%')
-
-    for iteration in range(args.iterations):
-        src_path = os.path.join(tmpdir, f'output.{iteration}.bin')
-        if iteration == 0:
-            src_path = initial_source
-        log_scores(iteration, src_path)
-        tgt_path = os.path.join(tmpdir, f'output.{iteration+1}.bin')
-
-        for table in ['errors', 'context', 'tests']:
-            cur.execute(f'DELETE FROM {table}')
-        con.commit()
-
-        for window, (slw, tlw) in enumerate(zip(source, target)):
-            if window in SKIP_WINDOWS:
-                continue
-            cur.executemany('INSERT INTO errors VALUES(?, ?, ?, ?, ?, ?)',
-                            gen_rules(window, slw, tlw))
+# Errors found by gen_rules are grouped into patterns in an ErrorIndex,
+# and the most common ones are expanded into rules with the context tests
+# most often seen around their occurrences.
+class ContextLearner(Learner):
+    def __init__(self, *args, ctx=2, beam=25, rule_count=25,
+                 context_similarity=0.9, batch_score=False, bench_batch=False,
+                 export_db=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ctx = ctx
+        self.beam = beam
+        self.rule_count = rule_count
+        self.context_similarity = context_similarity
+        self.batch_score = batch_score
+        self.bench_batch = bench_batch
+        self.export_db = export_db
+        self.candidates = ErrorIndex(
+            ['rule', 'tags1', 'tags2', 'window', 'cohort', 'cohort_key'],
+            ['rule', 'tags1', 'tags2', 'cohort_key'],
+            ['window', 'cohort'],
+            ['cohort', 'pattern', 'is_feat'])
+
+    def gen_shard(self, windows):
+        # (window, error rows, test rows) for each window
+        ret = []
+        for window in windows:
+            slw = self.source[window]
+            tests = []
             for ch in slw.cohorts:
-                cur.executemany(
-                    'INSERT INTO tests(cohort, pattern, is_feat) VALUES(?, ?, ?)',
-                    [(ch.dep_self, dc, is_feat) for dc, is_feat in describe_cohort(ch, slw)])
-            con.commit()
+                tests += [(ch.dep_self, dc, is_feat)
+                          for dc, is_feat in describe_cohort(ch, slw)]
+            ret.append((window, self.gen_rules(self, window, slw,
+                                               self.target[window]),
+                        tests))
+        return ret
+
+    def candidate_rules(self, count):
+        # (count, rule text, relation text, error label)
+        index = self.candidates
+
+        def excluded(pattern):
+            return '-'.join(pattern) in self.exclude
 
         patterns = []
-        for rt in RTYPES:
-            cur.execute('SELECT COUNT(*) AS ct, rule, tags1, tags2, cohort_key FROM errors WHERE rule = ? GROUP BY rule, tags1, tags2, cohort_key ORDER BY ct DESC LIMIT ?', (rt, args.count))
-            patterns += cur.fetchall()
+        for rt in self.rtypes:
+            patterns += index.top_patterns(rt, count, excluded)
 
-        for count, rule, tags1, tags2, ckey in patterns:
+        context = []
+        for _, rule, tags1, tags2, ckey in patterns:
             label = f'{rule}-{tags1}-{tags2}-{ckey}'
-            cur.execute('SELECT window, cohort FROM errors WHERE rule = ? AND tags1 = ? AND tags2 = ? AND cohort_key = ?',
-                        (rule, tags1, tags2, ckey))
             neighbors = defaultdict(set)
-            for wnum, cnum in cur.fetchall():
-                slw = source[wnum]
+            for wnum, cnum in index.occurrences((rule, tags1, tags2, ckey)):
+                slw = self.source[wnum]
                 collect_neighbors(slw, cnum, neighbors)
-            dct = select_contexts(cur, neighbors, rule)
+            dct = select_contexts(index, neighbors, rule,
+                                  self.context_similarity)
             rules = list(contextualize_rules(
                 dct,
                 {'rtype': rule, 'tags': tags1, 'desttags': tags2},
-                label,
+                label, count, self.ctx,
                 include_parent=(rule == 'rem-parent')))
             rules.sort(key=lambda x: x[3], reverse=True)
-            cur.executemany('INSERT INTO context VALUES(?, ?, ?, ?, ?)',
-                            rules[:args.beam])
-            con.commit()
+            context += rules[:self.beam]
+
+        if self.export_db:
+            index.export_sqlite(
+                self.export_db, context,
+                ['rtype', 'rule', 'relation', 'count', 'error_label'])
 
-        failed_errors = set()
-        non_failed = set()
         rules = []
-        for rt in RTYPES:
-            cur.execute('SELECT count, rule, relation, error_label FROM context WHERE rtype = ? ORDER BY count LIMIT ?', (rt, args.rule_count))
-            rules += cur.fetchall()
-
-        gpath = os.path.join(tmpdir, f'intersection.{iteration}.cg3')
-        opath = os.path.join(tmpdir, f'intersection.{iteration}.bin')
-        intersections, target_windows = calc_intersection(
-            rules, src_path, gpath, opath)
-
-        scored_rules = []
-        for rule_idx, rule in enumerate(rules):
-            gpath = os.path.join(tmpdir, f'g{rule_idx:05}.cg3')
-            s = score_rule(rule, gpath, target_windows[rule_idx])
-            print(s, rule[1])
-            if s < base_score:
-                scored_rules.append((s, rule, rule_idx))
-                non_failed.add(rule[-1])
-            else:
-                failed_errors.add(rule[-1])
-        scored_rules.sort()
-        added = set()
-        new_words = set()
-        selected_rules = []
-        for score, rule, i in scored_rules:
-            if intersections[i] & added:
-                continue
-            if rule[1][0] == 'A':
-                key = rule[1].split(')')[0]
-                if key in new_words:
-                    continue
-                new_words.add(key)
-            selected_rules.append(rule)
-            added.add(i)
-
-        gpath = os.path.join(tmpdir, f'grammar.{iteration}.cg3')
-        rule_str = '\n'.join(r[1] for r in selected_rules)
-        with open(gpath, 'w') as fout:
-            fout.write(RULE_HEADER + rule_str)
-        rule_output.write(rule_str + '\n\n')
-        EXCLUDE.update(failed_errors - non_failed)
-        subprocess.run(['vislcg3', '--in-binary', '--out-binary', '-g',
-                        gpath, '-I', src_path, '-O', tgt_path],
-                       capture_output=True)
-    # log final values after all iterations
-    log_scores(args.iterations, tgt_path)
-
-if args.score_report:
-    factors = ['cohorts', 'missing', 'extra', 'ambig', 'ins', 'unk',
-               'missing_feats', 'extra_feats']
-    scores = []
-    for f in factors:
-        WEIGHTS = {fn: 0 for fn in factors}
-        WEIGHTS[f] = 1
-        scores.append(sum(score_window(s, t, i)
-                          for i, (s, t) in enumerate(zip(source, target))))
-    total = sum(scores)
-    for f, s in zip(factors, scores):
-        p = (100.0 * s) / total
-        print(f, s, f'{p:0.2f}%')
-
-print(json.dumps({
-    'max_mem_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
-    'time_sec': time.time() - START,
-}), file=sys.stderr)
+        for rt in self.rtypes:
+            rows = sorted([r for r in context if r[0] == rt],
+                          key=lambda r: r[3])
+            rules += [(ct, rule, rel, label)
+                      for _, rule, rel, ct, label in rows[:self.rule_count]]
+        return rules
+
+    def exclude_key(self, rule):
+        return rule[-1]
+
+    def score_rules_batched(self, rules, gprefix, target_windows):
+        rule_texts = [r[1] for r in rules]
+        rule_windows = [target_windows[i] for i in range(len(rules))]
+        groups = batch_score.group_rules(rule_windows)
+        print(f'batched {len(rules)} rules into {len(groups)} groups')
+        scores = [self.base_score] * len(rules)
+        for n, members in enumerate(groups):
+            gpath = f'{gprefix}{n:05}.cg3'
+            with open(gpath, 'w') as fout:
+                fout.write(batch_score.group_grammar(self.header, rule_texts,
+                                                     members))
+            inp = batch_score.group_stream(self.source_blocks, rule_windows,
+                                           members)
+            out = cg_apply.Grammar(gpath).run(inp)
+            per_rule = batch_score.split_output(out, rule_windows, members)
+            for i in members:
+                stats = cg3_score.decode_blocks(per_rule[i], self.target_feats)
+                for n, idx in enumerate(rule_windows[i]):
+                    scores[i] += (self.score_buffer(stats.window(n), idx)
+                                  - self.window_scores[idx])
+        return scores
+
+    def score_rules(self, rules, target_windows, tmpdir):
+        if not (self.batch_score or self.bench_batch):
+            return super().score_rules(rules, target_windows, tmpdir)
+        t0 = time.time()
+        scores = self.score_rules_batched(
+            rules, os.path.join(tmpdir, 'b'), target_windows)
+        t1 = time.time()
+        if not self.bench_batch:
+            return [(s, rule, i)
+                    for i, (rule, s) in enumerate(zip(rules, scores))]
+        results = super().score_rules(rules, target_windows, tmpdir)
+        t2 = time.time()
+        agree = len([a for a, b in zip(results, scores) if a[0] == b])
+        print(f'batch benchmark: per-rule {t2-t1:.2f}s, batched {t1-t0:.2f}s, {agree}/{len(rules)} scores agree')
+        return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source')
+    parser.add_argument('target')
+    parser.add_argument('iterations', type=int)
+    parser.add_argument('out')
+    parser.add_argument('--weights', action='store', default='{}')
+    parser.add_argument('--count', type=int, default=25,
+                        help='number of templates to expand')
+    parser.add_argument('--ctx', type=int, default=2,
+                        help='max context tests')
+    parser.add_argument('--beam', type=int, default=25,
+                        help='max instantiations of a single pattern')
+    parser.add_argument('--rule_count', type=int, default=25,
+                        help='number of rules to try')
+    parser.add_argument('--context_similarity', type=float, default=0.9,
+                        help='threshold for discarding more complex context as equivalent')
+    parser.add_argument('--append', action='store_true',
+                        help='retain any rules already present in output file')
+    parser.add_argument('--max_sents', type=int, default=0,
+                        help='use only first N sentences')
+    parser.add_argument('--target_feats', action='store',
+                        help='skip removing features not in this JSON list')
+    parser.add_argument('--skip_windows', action='store',
+                        help='skip windows with indecies in this JSON list')
+    parser.add_argument('--score_report', action='store_true',
+                        help='print the contribution of each factor to the final error score')
+    parser.add_argument('--rtypes', action='store',
+                        help='only generate certain rule types')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='processes to use for generating candidate rules')
+    parser.add_argument('--batch_score', action='store_true',
+                        help='score candidates with disjoint windows in a single CG run')
+    parser.add_argument('--bench_batch', action='store_true',
+                        help='score candidates both per-rule and batched and report timing')
+    parser.add_argument('--export_db', action='store',
+                        help='write the error, test, and context tables to this sqlite file each iteration (for debugging)')
+    parser.add_argument('--profile', type=int,
+                        help='write a cProfile of this iteration to OUT.N.prof')
+    args = parser.parse_args()
+    phases.set_profile(args.profile, f'{args.out}.{args.profile}.prof')
+
+    target_feats = None
+    if args.target_feats:
+        with open(args.target_feats) as fin:
+            target_feats = set(json.loads(fin.read()))
+    skip_windows = set()
+    if args.skip_windows:
+        with open(args.skip_windows) as fin:
+            skip_windows = set(json.loads(fin.read()))
+    rtypes = RTYPES
+    if args.rtypes:
+        rtypes = json.loads(args.rtypes)
+
+    lr = ContextLearner(args.target, RULE_HEADER, rtypes, gen_rules, None,
+                        None, weights=json.loads(args.weights),
+                        target_feats=target_feats, skip_windows=skip_windows,
+                        max_sents=args.max_sents, threads=args.threads,
+                        ctx=args.ctx, beam=args.beam,
+                        rule_count=args.rule_count,
+                        context_similarity=args.context_similarity,
+                        batch_score=args.batch_score,
+                        bench_batch=args.bench_batch,
+                        export_db=args.export_db)
+
+    initial_rule_output = RULE_HEADER
+    initial_source = args.source
+    if args.append:
+        with open(args.out) as fin:
+            initial_rule_output = fin.read().strip() + '\n\n'
+            if not initial_rule_output.startswith(RULE_HEADER):
+                initial_rule_output = RULE_HEADER + initial_rule_output
+        initial_source = applied_corpus.apply(args.out, args.source,
+                                              RULE_HEADER)
+
+    with lr.start_generation():
+        lr.update_source(initial_source)
+        print(f'len(source)={len(lr.source)}, len(target)={len(lr.target)}')
+
+        lr.run(initial_source, args.out, args.iterations, args.count,
+               initial_rule_output, original_source=args.source)
+
+    if args.score_report:
+        lr.score_report()
+
+    print(json.dumps({
+        'max_mem_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'time_sec': time.time() - START,
+    }), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
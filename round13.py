@@ -1,17 +1,12 @@
-from cg3 import parse_binary_stream as parse_cg3
-import cg3_score
-from metrics import PER
+import applied_corpus
+import checkpoint
+import phases
+from tbl import Learner, desc_c, desc_r, get_rel
 
 import argparse
-from collections import Counter, defaultdict
-import io
 import json
-import os
 import resource
-import struct
-import subprocess
 import sys
-from tempfile import TemporaryDirectory, NamedTemporaryFile
 import time
 
 START = time.time()
@@ -37,101 +32,6 @@ LIST UPOS = ADJ ADP ADV AUX CCONJ DET INTJ NOUN NUM PART PRON PROPN PUNCT SCONJ
 '''.lstrip()
 LEAF_POS = ['CCONJ', 'ADP', 'DET', 'PUNCT', 'INTJ', 'PART', 'AUX']
 
-parser = argparse.ArgumentParser()
-parser.add_argument('source')
-parser.add_argument('target')
-parser.add_argument('iterations', type=int)
-parser.add_argument('out')
-parser.add_argument('--weights', action='store', default='{}')
-parser.add_argument('--count', type=int, default=25,
-                    help='number of rules to test per iteration')
-parser.add_argument('--append', action='store_true',
-                    help='retain any rules already present in output file')
-parser.add_argument('--max_sents', type=int, default=0,
-                    help='use only first N sentences')
-parser.add_argument('--target_feats', action='store',
-                    help='skip removing features not in this JSON list')
-parser.add_argument('--skip_windows', action='store',
-                    help='skip windows with indecies in this JSON list')
-parser.add_argument('--score_report', action='store_true',
-                    help='print the contribution of each factor to the final error score')
-parser.add_argument('--rtypes', action='store',
-                    help='only generate certain rule types')
-args = parser.parse_args()
-
-WEIGHTS = defaultdict(lambda: 1, json.loads(args.weights))
-EXCLUDE = set()
-TARGET_FEATS = None
-if args.target_feats:
-    with open(args.target_feats) as fin:
-        TARGET_FEATS = set(json.loads(fin.read()))
-SKIP_WINDOWS = set()
-if args.skip_windows:
-    with open(args.skip_windows) as fin:
-        SKIP_WINDOWS = set(json.loads(fin.read()))
-if args.rtypes:
-    RTYPES = json.loads(args.rtypes)
-
-def desc_r(reading):
-    ret = reading.lemma
-    for t in reading.tags:
-        if t != 'SOURCE':
-            ret += ' ' + t
-            break
-    return ret
-def desc_c(cohort):
-    for r in cohort.readings:
-        if 'SOURCE' in r.tags:
-            return desc_r(r)
-    return desc_r(cohort.readings[0])
-
-def get_rel(cohort):
-    for r in cohort.readings:
-        for t in r.tags:
-            if t[0] == '@':
-                return t
-
-def tags_to_feature_dict(tags, dct=None):
-    if dct is None:
-        dct = defaultdict(Counter)
-    for t in tags:
-        if '=' in t:
-            k, v = t.split('=', 1)
-            if TARGET_FEATS is not None and k not in TARGET_FEATS:
-                continue
-            dct[k][v] += 1
-    return dct
-
-def tags_to_flat_feature_dict(desc, tags, dct):
-    for t in tags:
-        if '=' in t:
-            k, v = t.split('=', 1)
-            if TARGET_FEATS is not None and k not in TARGET_FEATS:
-                continue
-            dct[(desc, t)] += 1
-
-def collect_words_and_feats(window, for_eval=True, for_gen=True):
-    words = Counter()
-    feats = defaultdict(lambda: defaultdict(Counter))
-    feats_flat = Counter()
-    for c in window.cohorts:
-        for r in c.readings:
-            if 'SOURCE' in r.tags:
-                continue
-            d = desc_r(r)
-            words[d] += 1
-            if for_gen:
-                tags_to_feature_dict(r.tags, feats[d])
-            if for_eval:
-                tags_to_flat_feature_dict(d, r.tags, feats_flat)
-    return words, feats, feats_flat
-
-with open(args.target, 'rb') as fin:
-    target = list(parse_cg3(fin, windows_only=True))
-    if args.max_sents > 0:
-        target = target[:args.max_sents]
-target_words_and_feats = [collect_words_and_feats(w) for w in target]
-
 def format_rule(rtype, target, ctx, tag1, tag2):
     if rtype == 'remove':
         return f'REMOVE ({tag1}) IF (0 ({target})) ({ctx}) ;'
@@ -201,11 +101,11 @@ def source_lex(cohort):
                     break
             return ' '.join(ls)
 
-def gen_rules(window, slw, tlw):
-    if window in SKIP_WINDOWS:
+def gen_rules(lr, window, slw, tlw):
+    if window in lr.skip_windows:
         return
-    src_words, src_feats, _ = collect_words_and_feats(slw, for_eval=False)
-    tgt_words, tgt_feats, _ = target_words_and_feats[window]
+    src_words, src_feats, _ = lr.collect_words_and_feats(slw, for_eval=False)
+    tgt_words, tgt_feats, _ = lr.target_words_and_feats[window]
     extra = +(src_words - tgt_words)
     missing = +(tgt_words - src_words)
     dep2idx = {}
@@ -322,233 +222,101 @@ def gen_rules(window, slw, tlw):
                             yield ('add-feat', reading.tags[0] + ' ' + alt,
                                    None, k, feat)
 
-def run_grammar(ipath, gpath, opath):
-    try:
-        subprocess.run(['vislcg3', '--in-binary', '--out-binary', '-g',
-                        gpath, '-I', ipath, '-O', opath],
-                       capture_output=True, check=True)
-    except subprocess.CalledProcessError:
-        with open(gpath) as fin:
-            print(fin.read())
-        raise
-    with open(opath, 'rb') as fout:
-        yield from parse_cg3(fout, windows_only=True)
-
-CG_BIN_HEADER = b'CGBF\x01\x00\x00\x00'
-CG_BIN_FOOTER = b'\x02\x01\x02\x02' # FLUSH, EXIT
-def run_windows(gpath, windows):
-    inp = CG_BIN_HEADER + b''.join(source_blocks[i] for i in windows) + CG_BIN_FOOTER
-    proc = subprocess.run(['vislcg3', '--in-binary', '--out-binary',
-                           '-g', gpath],
-                          capture_output=True, check=True, input=inp)
-    #yield from parse_cg3(io.BytesIO(proc.stdout), windows_only=True)
-    yield from cg3_score.iter_blocks(proc.stdout)
-
-def calc_intersection(rules: list, ipath, gpath: str, opath: str):
-    if not rules:
-        return [], {}
-    with open(gpath, 'w') as fout:
-        for i, r in enumerate(rules):
-            fout.write(r[2].replace('{NUM}', str(i)) + '\n')
-    target_windows = defaultdict(set)
-    targets = defaultdict(set)
-    contexts = defaultdict(set)
-    for idx, window in enumerate(run_grammar(ipath, gpath, opath)):
-        if idx in SKIP_WINDOWS or idx >= len(target):
-            continue
-        for cohort in window.cohorts:
-            for tag, heads in cohort.relations.items():
-                if tag[0] == 'r' and tag[1:].isdigit():
-                    contexts[int(tag[1:])].update(heads)
-                elif tag.startswith('tr') and tag[2:].isdigit():
-                    targets[int(tag[2:])].add(cohort.dep_self)
-                    target_windows[int(tag[2:])].add(idx)
-    intersections = [set() for i in range(len(rules))]
-    for i in range(len(rules)):
-        if not contexts[i]:
-            continue
-        for j in range(i):
-            if (targets[i] & targets[j]
-                or targets[i] & contexts[j]
-                or targets[j] & contexts[i]):
-                intersections[i].add(j)
-                intersections[j].add(i)
-    return intersections, {k: sorted(v) for k, v in target_windows.items()}
-
-def score_window(slw, tlw, index):
-    if index in SKIP_WINDOWS:
-        return 0
-    score = 0
-    score += WEIGHTS['cohorts'] * abs(len(slw.cohorts) - len(tlw.cohorts))
-    src_words, _, src_feats = collect_words_and_feats(slw, for_gen=False)
-    tgt_words, _, tgt_feats = target_words_and_feats[index]
-    extra, missing = cg3_score.symmetric_difference(src_words, tgt_words)
-    score += WEIGHTS['missing'] * missing
-    score += WEIGHTS['extra'] * extra
-    score += WEIGHTS['ambig'] * (src_words.total() - len(slw.cohorts))
-    score += WEIGHTS['ins'] * len([s for s in slw.cohorts if s.static.lemma == '"<ins>"'])
-    score += WEIGHTS['unk'] * sum([ct for lm, ct in src_words.items()
-                                   if lm.startswith('"@')])
-    mf, ef = cg3_score.symmetric_difference(tgt_feats, src_feats)
-    score += WEIGHTS['missing_feats'] * mf
-    score += WEIGHTS['extra_feats'] * ef
-    return score
-
-def score_buffer(slb, tlw, index):
-    if index in SKIP_WINDOWS:
-        return 0
-    score = 0
-    src_words, src_feats, src_counts = cg3_score.parse_window(
-        slb, TARGET_FEATS)
-    score += WEIGHTS['cohorts'] * abs(src_counts['cohort'] - len(tlw.cohorts))
-    tgt_words, _, tgt_feats = target_words_and_feats[index]
-    extra, missing = cg3_score.symmetric_difference(src_words, tgt_words)
-    score += WEIGHTS['missing'] * missing
-    score += WEIGHTS['extra'] * extra
-    score += WEIGHTS['ambig'] * (src_counts['reading'] - src_counts['cohort'])
-    score += WEIGHTS['ins'] * src_counts['ins']
-    score += WEIGHTS['unk'] * src_counts['unk']
-    mf, ef = cg3_score.symmetric_difference(tgt_feats, src_feats)
-    score += WEIGHTS['missing_feats'] * mf
-    score += WEIGHTS['extra_feats'] * ef
-    return score
-
-source = []
-source_blocks = []
-window_scores = []
-base_score = 0
-def update_source(fname):
-    global source, source_blocks, window_scores, base_score
-    with open(fname, 'rb') as fin:
-        source = list(parse_cg3(fin, windows_only=True))
-        fin.seek(0)
-        source_blocks = list(cg3_score.iter_blocks(fin.read()))
-    window_scores = [score_window(s, t, i) for i, (s, t) in enumerate(zip(source, target))]
-    base_score = sum(window_scores)
-update_source(args.source)
-print(f'{len(source)=}, {len(target)=}')
-
-def score_rule(rule, gpath, windows):
-    with open(gpath, 'w') as fout:
-        fout.write(RULE_HEADER + rule[1])
-    score = 0
-    last_window = 0
-    for idx, slb in zip(windows, run_windows(gpath, windows)):
-        score += sum(window_scores[last_window:idx])
-        score += score_buffer(slb, target[idx], idx)
-        last_window = idx+1
-    score += sum(window_scores[last_window:])
-    return score
-
-initial_rule_output = RULE_HEADER
-initial_source = args.source
-if args.append:
-    with open(args.out) as fin:
-        initial_rule_output = fin.read().strip() + '\n\n'
-        if not initial_rule_output.startswith(RULE_HEADER):
-            initial_rule_output = RULE_HEADER + initial_rule_output
-    new_source = NamedTemporaryFile(delete=False, delete_on_close=False)
-    initial_source = new_source.name
-    subprocess.run(['vislcg3', '--in-binary', '--out-binary', '-g',
-                    args.out, '-I', args.source, '-O', new_source.name],
-                   capture_output=True)
-    update_source(new_source.name)
-
-with (TemporaryDirectory() as tmpdir,
-      open(args.out, 'w') as rule_output):
-    rule_output.write(initial_rule_output)
-
-    def log_scores(iteration, src_path):
-        global target, rule_output, EXCLUDE
-        update_source(src_path)
-        base_per = PER(source, target, TARGET_FEATS, SKIP_WINDOWS)
-        rule_output.write('####################\n')
-        rule_output.write(f'## {iteration}: {base_score} PER_lem {base_per[0]:.2f}% PER_form {base_per[1]:.2f}%\n')
-        rule_output.write('####################\n')
-        print(f'{iteration=}, {base_score=}, {len(EXCLUDE)=} PER_lem {base_per[0]:.2f}% PER_form {base_per[1]:.2f}%')
-
-    for iteration in range(args.iterations):
-        src_path = os.path.join(tmpdir, f'output.{iteration}.bin')
-        if iteration == 0:
-            src_path = initial_source
-        log_scores(iteration, src_path)
-        tgt_path = os.path.join(tmpdir, f'output.{iteration+1}.bin')
-
-        potential_rules = defaultdict(Counter)
-
-        for window, (slw, tlw) in enumerate(zip(source, target)):
-            if window in SKIP_WINDOWS:
-                continue
-            for rule in gen_rules(window, slw, tlw):
-                if rule in EXCLUDE:
-                    continue
-                potential_rules[rule[0]][rule] += 1
-
-        failed_errors = set()
-        non_failed = set()
-        rules = []
-        for rt in RTYPES:
-            for r, _ in potential_rules[rt].most_common(args.count):
-                rules.append((r, format_rule(*r),
-                              format_relation(r[1], r[2])))
-
-        gpath = os.path.join(tmpdir, f'intersection.{iteration}.cg3')
-        opath = os.path.join(tmpdir, f'intersection.{iteration}.bin')
-        intersections, target_windows = calc_intersection(
-            rules, src_path, gpath, opath)
-
-        scored_rules = []
-        for rule_idx, rule in enumerate(rules):
-            gpath = os.path.join(tmpdir, f'g{rule_idx:05}.cg3')
-            s = score_rule(rule, gpath, target_windows[rule_idx])
-            print(s, rule[1])
-            if s < base_score:
-                scored_rules.append((s, rule, rule_idx))
-                non_failed.add(rule[0])
-            else:
-                failed_errors.add(rule[0])
-        scored_rules.sort()
-        added = set()
-        new_words = set()
-        selected_rules = []
-        for score, rule, i in scored_rules:
-            if intersections[i] & added:
-                continue
-            if rule[1][0] == 'A':
-                key = rule[1].split(')')[0]
-                if key in new_words:
-                    continue
-                new_words.add(key)
-            selected_rules.append(rule)
-            added.add(i)
-
-        gpath = os.path.join(tmpdir, f'grammar.{iteration}.cg3')
-        rule_str = '\n'.join(r[1] for r in selected_rules)
-        with open(gpath, 'w') as fout:
-            fout.write(RULE_HEADER + rule_str)
-        rule_output.write(rule_str + '\n\n')
-        EXCLUDE.update(failed_errors - non_failed)
-        subprocess.run(['vislcg3', '--in-binary', '--out-binary', '-g',
-                        gpath, '-I', src_path, '-O', tgt_path],
-                       capture_output=True)
-    # log final values after all iterations
-    log_scores(args.iterations, tgt_path)
-
-if args.score_report:
-    factors = ['cohorts', 'missing', 'extra', 'ambig', 'ins', 'unk',
-               'missing_feats', 'extra_feats']
-    scores = []
-    for f in factors:
-        WEIGHTS = {fn: 0 for fn in factors}
-        WEIGHTS[f] = 1
-        scores.append(sum(score_window(s, t, i)
-                          for i, (s, t) in enumerate(zip(source, target))))
-    total = sum(scores)
-    for f, s in zip(factors, scores):
-        p = (100.0 * s) / total
-        print(f, s, f'{p:0.2f}%')
-
-print(json.dumps({
-    'max_mem_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
-    'time_sec': time.time() - START,
-}), file=sys.stderr)
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source')
+    parser.add_argument('target')
+    parser.add_argument('iterations', type=int)
+    parser.add_argument('out')
+    parser.add_argument('--weights', action='store', default='{}')
+    parser.add_argument('--count', type=int, default=25,
+                        help='number of rules to test per iteration')
+    parser.add_argument('--append', action='store_true',
+                        help='retain any rules already present in output file')
+    parser.add_argument('--max_sents', type=int, default=0,
+                        help='use only first N sentences')
+    parser.add_argument('--target_feats', action='store',
+                        help='skip removing features not in this JSON list')
+    parser.add_argument('--skip_windows', action='store',
+                        help='skip windows with indecies in this JSON list')
+    parser.add_argument('--score_report', action='store_true',
+                        help='print the contribution of each factor to the final error score')
+    parser.add_argument('--rtypes', action='store',
+                        help='only generate certain rule types')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='processes to use for generating candidate rules')
+    parser.add_argument('--checkpoint_every', type=int, default=0,
+                        help='save a checkpoint at the start of every N iterations')
+    parser.add_argument('--checkpoint_dir', action='store',
+                        help='where to keep checkpoints (default: OUT.checkpoint)')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue from the latest checkpoint, if there is one')
+    parser.add_argument('--profile', type=int,
+                        help='write a cProfile of this iteration to OUT.N.prof')
+    args = parser.parse_args()
+    phases.set_profile(args.profile, f'{args.out}.{args.profile}.prof')
+    if args.resume and args.append:
+        parser.error('--resume cannot be combined with --append')
+    checkpoint_dir = args.checkpoint_dir or args.out + '.checkpoint'
+
+    target_feats = None
+    if args.target_feats:
+        with open(args.target_feats) as fin:
+            target_feats = set(json.loads(fin.read()))
+    skip_windows = set()
+    if args.skip_windows:
+        with open(args.skip_windows) as fin:
+            skip_windows = set(json.loads(fin.read()))
+    rtypes = RTYPES
+    if args.rtypes:
+        rtypes = json.loads(args.rtypes)
+
+    lr = Learner(args.target, RULE_HEADER, rtypes, gen_rules,
+                 lambda r: format_rule(*r),
+                 lambda r: format_relation(r[1], r[2]),
+                 weights=json.loads(args.weights), target_feats=target_feats,
+                 skip_windows=skip_windows, max_sents=args.max_sents,
+                 threads=args.threads)
+
+    initial_rule_output = RULE_HEADER
+    initial_source = args.source
+    if args.append:
+        with open(args.out) as fin:
+            initial_rule_output = fin.read().strip() + '\n\n'
+            if not initial_rule_output.startswith(RULE_HEADER):
+                initial_rule_output = RULE_HEADER + initial_rule_output
+        initial_source = applied_corpus.apply(args.out, args.source,
+                                              RULE_HEADER)
+
+    start_iteration = 0
+    if args.resume:
+        state = checkpoint.load(checkpoint_dir)
+        if state is None:
+            print(f'no checkpoint in {checkpoint_dir}, starting from scratch')
+        else:
+            start_iteration = state['iteration']
+            initial_rule_output = state['output']
+            initial_source = state['source']
+            lr.exclude = set(tuple(r) for r in state['exclude'])
+            print(f'resuming at iteration {start_iteration}, checkpointed base_score={state["base_score"]}')
+
+    with lr.start_generation():
+        lr.update_source(initial_source)
+        print(f'len(source)={len(lr.source)}, len(target)={len(lr.target)}')
+
+        lr.run(initial_source, args.out, args.iterations, args.count,
+               initial_rule_output, start_iteration=start_iteration,
+               original_source=args.source,
+               checkpoint_every=args.checkpoint_every,
+               checkpoint_dir=checkpoint_dir)
+
+    if args.score_report:
+        lr.score_report()
+
+    print(json.dumps({
+        'max_mem_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'time_sec': time.time() - START,
+    }), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
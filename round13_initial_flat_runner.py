@@ -10,6 +10,9 @@ parser.add_argument('src')
 parser.add_argument('tgt')
 parser.add_argument('tgt_feats')
 parser.add_argument('--skip_windows', action='store')
+parser.add_argument('--checkpoint_every', action='store', default='10')
+parser.add_argument('--resume', action='store_true',
+                    help='continue each run from its latest checkpoint')
 args = parser.parse_args()
 
 def run_config(grammar, count, weights):
@@ -18,12 +21,15 @@ def run_config(grammar, count, weights):
     skip = []
     if args.skip_windows:
         skip = ['--skip_windows', args.skip_windows]
+    if args.resume:
+        skip.append('--resume')
     subprocess.run(['python3', 'round13.py',
                     args.src, args.tgt,
                     '300', grammar,
                     '--weights', weights,
                     '--count', count,
-                    '--target_feats', args.tgt_feats] + skip,
+                    '--target_feats', args.tgt_feats,
+                    '--checkpoint_every', args.checkpoint_every] + skip,
                    capture_output=True)
     print('finished', grammar, 'after', time.time() - start, 'seconds at',
           datetime.datetime.now())
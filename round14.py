@@ -1,579 +1,307 @@
-from cg3 import parse_binary_stream as parse_cg3
-import cg3_score
-from metrics import PER
+import applied_corpus
+import batch_score
+import footprint
+import phases
+import rule_graph
+from round13 import RTYPES, RULE_HEADER, format_relation, format_rule, gen_rules
+from score_pool import FACTORS, ScorePool
+from tbl import Learner, is_blocked, select_rule
 
 import argparse
-from collections import Counter, defaultdict
-import io
+from collections import defaultdict
+import heapq
 import json
+import math
 import os
 import resource
-import struct
-import subprocess
 import sys
-from tempfile import TemporaryDirectory, NamedTemporaryFile
 import time
 
 START = time.time()
-LAST_ITER_START = START
-
-RTYPES = [
-    'remove',
-    'replace',
-    'addcohort',
-    'remcohort',
-    'func2feat',
-    'feat2func',
-    'feat-from-func',
-    'agreement',
-    'add-feat',
-]
-RULE_HEADER = '''
-OPTIONS += addcohort-attach ;
-DELIMITERS = "<$$$>" ;
-PROTECT (SOURCE) ;
-LIST UPOS = ADJ ADP ADV AUX CCONJ DET INTJ NOUN NUM PART PRON PROPN PUNCT SCONJ SYM VERB X UNK ;
-
-
-'''.lstrip()
-LEAF_POS = ['CCONJ', 'ADP', 'DET', 'PUNCT', 'INTJ', 'PART', 'AUX']
-
-parser = argparse.ArgumentParser()
-parser.add_argument('source')
-parser.add_argument('target')
-parser.add_argument('iterations', type=int)
-parser.add_argument('out')
-parser.add_argument('target_lang')
-parser.add_argument('--weights', action='store', default='{}')
-parser.add_argument('--count', type=int, default=25,
-                    help='number of rules to test per iteration')
-parser.add_argument('--append', action='store_true',
-                    help='retain any rules already present in output file')
-parser.add_argument('--max_sents', type=int, default=0,
-                    help='use only first N sentences')
-parser.add_argument('--skip_windows', action='store',
-                    help='skip windows with indecies in this JSON list')
-parser.add_argument('--rtypes', action='store',
-                    help='only generate certain rule types')
-parser.add_argument('--threads', type=int, default=10)
-args = parser.parse_args()
-
-WEIGHTS = defaultdict(lambda: 1, json.loads(args.weights))
-EXCLUDE = set()
-SKIP_WINDOWS = set()
-if args.skip_windows:
-    with open(args.skip_windows) as fin:
-        SKIP_WINDOWS = set(json.loads(fin.read()))
-if args.rtypes:
-    RTYPES = json.loads(args.rtypes)
 
 TARGET_FEATS = {
     'blx': {"Adjz", "Aspect", "Caus", "Degree", "Emph", "Loc", "Mood", "Nmlz", "NumType", "Number", "Pluraction", "Polarity", "Poss", "Redup", "Voice"},
     'eng': {"Animacy", "Case", "Definite", "Degree", "Gender", "LexCat", "Mood", "Number", "NumType", "Person", "PronType", "Tense", "VerbForm"},
     'grc': {"Aspect", "Case", "Definite", "Degree", "ExtPos", "Gender", "Mood", "NumType", "Number", "Person", "Polarity", "Poss", "PronType", "Reflex", "Tense", "VerbForm", "Voice"},
-}[args.target_lang]
-
-SCORE_ARGS = [args.target_lang]
-factors = ['cohorts', 'missing', 'extra', 'ambig', 'ins', 'unk', 'missing_feats', 'extra_feats']
-for key in factors:
-    SCORE_ARGS += ['--'+key.replace('_', '-'), str(WEIGHTS[key]-1)]
-
-def desc_r(reading):
-    ret = reading.lemma
-    for t in reading.tags:
-        if t != 'SOURCE':
-            ret += ' ' + t
-            break
-    return ret
-def desc_c(cohort):
-    for r in cohort.readings:
-        if 'SOURCE' in r.tags:
-            return desc_r(r)
-    return desc_r(cohort.readings[0])
-
-def get_rel(cohort):
-    for r in cohort.readings:
-        for t in r.tags:
-            if t[0] == '@':
-                return t
-
-def tags_to_feature_dict(tags, dct=None):
-    if dct is None:
-        dct = defaultdict(Counter)
-    for t in tags:
-        if '=' in t:
-            k, v = t.split('=', 1)
-            if TARGET_FEATS is not None and k not in TARGET_FEATS:
-                continue
-            dct[k][v] += 1
-    return dct
-
-def tags_to_flat_feature_dict(desc, tags, dct):
-    for t in tags:
-        if '=' in t:
-            k, v = t.split('=', 1)
-            if TARGET_FEATS is not None and k not in TARGET_FEATS:
-                continue
-            dct[(desc, t)] += 1
-
-def collect_words_and_feats(window, for_eval=True, for_gen=True):
-    words = Counter()
-    feats = defaultdict(lambda: defaultdict(Counter))
-    feats_flat = Counter()
-    for c in window.cohorts:
-        for r in c.readings:
-            if 'SOURCE' in r.tags:
-                continue
-            d = desc_r(r)
-            words[d] += 1
-            if for_gen:
-                tags_to_feature_dict(r.tags, feats[d])
-            if for_eval:
-                tags_to_flat_feature_dict(d, r.tags, feats_flat)
-    return words, feats, feats_flat
-
-with open(args.target, 'rb') as fin:
-    target = list(parse_cg3(fin, windows_only=True))
-    fin.seek(0)
-    target_blocks = list(cg3_score.iter_blocks(fin.read()))
-    if args.max_sents > 0:
-        target = target[:args.max_sents]
-        target_blocks = target_blocks[:args.max_sents]
-target_words_and_feats = [collect_words_and_feats(w) for w in target]
-
-def format_rule(rtype, target, ctx, tag1, tag2):
-    if rtype == 'remove':
-        return f'REMOVE ({tag1}) IF (0 ({target})) ({ctx}) ;'
-    elif rtype == 'replace':
-        return f'''
-WITH ({target}) IF ({ctx}) {{
-    SELECT ({tag1}) ;
-    SUBSTITUTE ({tag1}) ({tag2}) (*) ;
-}} ;
-        '''.strip()
-    elif rtype == 'addcohort':
-        return f'ADDCOHORT ("<ins>" {tag1} @dep) BEFORE (*) IF (0 ({target})) (NEGATE c ({tag1})) ({ctx}) ;'
-    elif rtype == 'remcohort':
-        return f'REMCOHORT (*) IF (0 ({target})) ({ctx}) ;'
-    # tag1 is category, tag2 is value
-    elif rtype == 'func2feat':
-        return f'''
-WITH ({target}) IF (w{ctx} LINK NEGATE c (*)) {{
-    SUBSTITUTE (/^{tag1}=.*$/r) (*) (*) ;
-    SUBSTITUTE (*) ({tag2}) (*) ;
-    REMCOHORT _C1_ ;
-}} ;
-        '''.strip()
-    elif rtype == 'feat2func':
-        return f'''
-WITH ({target} {tag2}) IF ({ctx}) (NEGATE c ({tag1})) {{
-    SUBSTITUTE ({tag2}) (*) (*) ;
-    ADDCOHORT ("<ins>" {tag1} @dep) BEFORE (*) ;
-}} ;
-        '''.strip()
-    elif rtype == 'feat-from-func':
-        return f'''
-WITH ({target}) - ({tag2}) IF ({ctx}) {{
-    SUBSTITUTE (/^{tag1}=.*$/r) (*) (*) ;
-    SUBSTITUTE (*) ({tag2}) (*) ;
-}} ;
-        '''.strip()
-    elif rtype == 'agreement':
-        return f'''
-LIST {tag1} = /^({tag1}=.*)$/r ;
-WITH ({target}) IF ({ctx} + {tag1}) {{
-    SUBSTITUTE {tag1} (*) (*) ;
-    SUBSTITUTE (*) (VSTR:$1) (*) IF (jC1 {tag1}) ;
-}} ;
-        '''.strip()
-    elif rtype == 'add-feat':
-        return f'SUBSTITUTE (*) ({tag2}) ({target}) - (/^{tag1}=.*$/r) ;'
-
-def format_relation(target, ctx):
-    if ctx:
-        return f'''
-ADDRELATION (tr{{NUM}}) (*) (0 ({target})) TO (0 (*)) ;
-ADDRELATION (r{{NUM}}) (*) (0 ({target})) TO ({ctx}) ;
-        '''.strip()
-    else:
-        return f'ADDRELATION (tr{{NUM}}) (*) (0 ({target})) TO (0 (*)) ;'
-
-def source_lex(cohort):
-    for r in cohort.readings:
-        if 'SOURCE' in r.tags:
-            ls = [r.lemma]
-            ls.append(([t for t in r.tags if t != 'SOURCE' and '=' not in t]
-                       or ['UNK'])[0])
-            for t in r.tags:
-                if t.startswith('LId[SDBH]='):
-                    ls.append(t)
-                    break
-            return ' '.join(ls)
-
-def gen_rules(window, slw, tlw):
-    if window in SKIP_WINDOWS:
-        return
-    src_words, src_feats, _ = collect_words_and_feats(slw, for_eval=False)
-    tgt_words, tgt_feats, _ = target_words_and_feats[window]
-    extra = +(src_words - tgt_words)
-    missing = +(tgt_words - src_words)
-    dep2idx = {}
-    all_extra = set()
-    deletable = set()
-    word_lists = []
-    source_desc = []
-    lexical_desc = []
-    rels = []
-    for idx, cohort in enumerate(slw.cohorts):
-        dep2idx[cohort.dep_self] = idx
-        word_lists.append([desc_r(r) for r in cohort.readings
-                           if 'SOURCE' not in r.tags])
-        if all(w in extra for w in word_lists[-1]):
-            all_extra.add(idx)
-            if all(c.dep_parent != cohort.dep_self for c in slw.cohorts):
-                deletable.add(idx)
-        source_desc.append(source_lex(cohort))
-        lexical_desc.append(source_desc[-1] or desc_c(cohort))
-        rels.append(get_rel(cohort))
-    def neighbors(cohort):
-        for i, c in enumerate(slw.cohorts):
-            if c.dep_self == cohort.dep_parent:
-                yield i, c, 'p'
-            elif c.dep_parent == cohort.dep_self:
-                yield i, c, 'c'
-            elif c.dep_parent == cohort.dep_parent and c.dep_self != cohort.dep_self:
-                yield i, c, 's'
-    def lexical_context(cohort):
-        for i, c, r in neighbors(cohort):
-            yield f'{r} ({lexical_desc[i]})'
-    def context_with_feat(cohort, feat):
-        for i, c, rel in neighbors(cohort):
-            if rel == 's':
-                continue
-            if any(feat in r.tags and 'SOURCE' not in r.tags
-                   for r in c.readings):
-                yield i, f'{rel} ({rels[i]})'
-    # don't insert words if we're already very imbalanced
-    not_overload = (len(slw.cohorts) < len(tlw.cohorts) + 5)
-    for idx, cohort in enumerate(slw.cohorts):
-        lctx = list(lexical_context(cohort))
-        if len(word_lists[idx]) > 1:
-            for w in word_lists[idx]:
-                for lc in lctx:
-                    yield ('remove', lexical_desc[idx], lc, w, None)
-        if idx in all_extra:
-            for w in missing:
-                for lc in lctx:
-                    yield ('replace', lexical_desc[idx], lc,
-                           word_lists[idx][0], w)
-            if idx in deletable:
-                for lc in lctx:
-                    yield ('remcohort', lexical_desc[idx], lc,
-                           None, None)
-        can_insert = (not_overload and not any(l in lexical_desc[idx] for l in LEAF_POS))
-        if can_insert:
-            for m in missing:
-                for lc in lctx:
-                    yield ('addcohort', lexical_desc[idx], lc, m, None)
-        for reading in cohort.readings:
-            if 'SOURCE' in reading.tags:
-                continue
-            d = desc_r(reading)
-            role_desc = reading.tags[0] + ' ' + rels[idx]
-            scount = src_words[d]
-            tcount = tgt_words[d]
-            if tcount == 0:
-                continue
-            rf = dict([t.split('=', 1) for t in reading.tags if '=' in t])
-            sf = src_feats[d]
-            tf = tgt_feats[d]
-            for k, v in rf.items():
-                if sf[k][v] <= tf[k][v]:
-                    continue
-                st = sf[k].total()
-                tt = tf[k].total()
-                if can_insert:
-                    for m in missing:
-                        for lc in lctx: # TODO: ???
-                            yield ('feat2func', lexical_desc[idx], lc,
-                                   m, f'{k}={v}')
-                            yield ('feat2func', role_desc, lc, m,
-                                   f'{k}={v}')
-                for v2 in tf[k]:
-                    if v != v2 and sf[k][v2] < tf[k][v2]:
-                        feat = f'{k}={v2}'
-                        for i, c in context_with_feat(cohort, feat):
-                            if i in deletable:
-                                yield ('func2feat', lexical_desc[idx],
-                                       c, k, feat)
-                            yield ('feat-from-func', lexical_desc[idx],
-                                   c, k, feat)
-                            yield ('feat-from-func', role_desc, c, k, feat)
-                            yield ('agreement', lexical_desc[idx],
-                                   c, k, feat)
-                            yield ('agreement', role_desc, c, k, feat)
-                        for i, c, r in neighbors(cohort):
-                            if r == 's':
-                                continue
-                            yield ('feat-from-func', role_desc,
-                                   f'{r} ({lexical_desc[i]})', k, feat)
-            for k in tf:
-                if k in rf:
-                    continue
-                diff = +(tf[k] - sf[k])
-                for v in diff:
-                    feat = f'{k}={v}'
-                    for i, c in context_with_feat(cohort, feat):
-                        yield ('agreement', lexical_desc[idx], c, k, feat)
-                    yield ('add-feat', reading.tags[0], None, k, feat)
-                    for alt in reading.tags:
-                        if '=' in alt:
-                            yield ('add-feat', reading.tags[0] + ' ' + alt,
-                                   None, k, feat)
-
-def run_grammar(ipath, gpath, opath):
-    try:
-        subprocess.run(['vislcg3', '--in-binary', '--out-binary', '-g',
-                        gpath, '-I', ipath, '-O', opath],
-                       capture_output=True, check=True)
-    except subprocess.CalledProcessError:
-        with open(gpath) as fin:
-            print(fin.read())
-        raise
-    with open(opath, 'rb') as fout:
-        yield from parse_cg3(fout, windows_only=True)
-
-CG_BIN_HEADER = b'CGBF\x01\x00\x00\x00'
-CG_BIN_FOOTER = b'\x02\x01\x02\x02' # FLUSH, EXIT
-def run_windows(gpath, windows):
-    inp = CG_BIN_HEADER + b''.join(source_blocks[i] for i in windows) + CG_BIN_FOOTER
-    proc = subprocess.run(['vislcg3', '--in-binary', '--out-binary',
-                           '-g', gpath],
-                          capture_output=True, check=True, input=inp)
-    #yield from parse_cg3(io.BytesIO(proc.stdout), windows_only=True)
-    yield from cg3_score.iter_blocks(proc.stdout)
-
-def start_rule(rule, prefix, windows, rule_idx):
-    gpath = prefix + '.cg3'
-    spath = prefix + '.input.bin'
-    tpath = prefix + '.output.bin'
-    with open(gpath, 'w') as fout:
-        fout.write(RULE_HEADER + rule[1])
-    with open(spath, 'wb') as fout:
-        fout.write(CG_BIN_HEADER + b''.join(source_blocks[i] for i in windows) + CG_BIN_FOOTER)
-    with open(tpath, 'wb') as fout:
-        fout.write(CG_BIN_HEADER + b''.join(target_blocks[i] for i in windows) + CG_BIN_FOOTER)
-    static_score = sum([sum(window_scores[a+1:b])
-                        for a, b in zip([0] + windows, windows + [-1])])
-    args = ['ch4_score/ch4_score', gpath, spath, tpath] + SCORE_ARGS
-    proc = subprocess.Popen(args, stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE)
-    return (proc, rule, static_score, rule_idx)
-
-def finish_rule(proc, rule, static_score, rule_idx):
-    stdout, stderr = proc.communicate()
-    s = int(stdout.decode('utf-8').split()[1])
-    return (s + static_score, rule, rule_idx)
-
-def calc_intersection(rules: list, ipath, gpath: str, opath: str):
-    if not rules:
-        return [], {}
-    with open(gpath, 'w') as fout:
-        for i, r in enumerate(rules):
-            fout.write(r[2].replace('{NUM}', str(i)) + '\n')
-    target_windows = defaultdict(set)
-    targets = defaultdict(set)
-    contexts = defaultdict(set)
-    for idx, window in enumerate(run_grammar(ipath, gpath, opath)):
-        if idx in SKIP_WINDOWS or idx >= len(target):
-            continue
-        for cohort in window.cohorts:
-            for tag, heads in cohort.relations.items():
-                if tag[0] == 'r' and tag[1:].isdigit():
-                    contexts[int(tag[1:])].update(heads)
-                elif tag.startswith('tr') and tag[2:].isdigit():
-                    targets[int(tag[2:])].add(cohort.dep_self)
-                    target_windows[int(tag[2:])].add(idx)
-    intersections = [set() for i in range(len(rules))]
-    for i in range(len(rules)):
-        if not contexts[i]:
-            continue
-        for j in range(i):
-            if (targets[i] & targets[j]
-                or targets[i] & contexts[j]
-                or targets[j] & contexts[i]):
-                intersections[i].add(j)
-                intersections[j].add(i)
-    return intersections, {k: sorted(v) for k, v in target_windows.items()}
-
-def score_window(slw, tlw, index):
-    if index in SKIP_WINDOWS:
-        return 0
-    score = 0
-    score += WEIGHTS['cohorts'] * abs(len(slw.cohorts) - len(tlw.cohorts))
-    src_words, _, src_feats = collect_words_and_feats(slw, for_gen=False)
-    tgt_words, _, tgt_feats = target_words_and_feats[index]
-    extra, missing = cg3_score.symmetric_difference(src_words, tgt_words)
-    score += WEIGHTS['missing'] * missing
-    score += WEIGHTS['extra'] * extra
-    score += WEIGHTS['ambig'] * (src_words.total() - len(slw.cohorts))
-    score += WEIGHTS['ins'] * len([s for s in slw.cohorts if s.static.lemma == '"<ins>"'])
-    score += WEIGHTS['unk'] * sum([ct for lm, ct in src_words.items()
-                                   if lm.startswith('"@')])
-    mf, ef = cg3_score.symmetric_difference(tgt_feats, src_feats)
-    score += WEIGHTS['missing_feats'] * mf
-    score += WEIGHTS['extra_feats'] * ef
-    return score
-
-def score_buffer(slb, tlw, index):
-    if index in SKIP_WINDOWS:
-        return 0
-    score = 0
-    src_words, src_feats, src_counts = cg3_score.parse_window(
-        slb, TARGET_FEATS)
-    score += WEIGHTS['cohorts'] * abs(src_counts['cohort'] - len(tlw.cohorts))
-    tgt_words, _, tgt_feats = target_words_and_feats[index]
-    extra, missing = cg3_score.symmetric_difference(src_words, tgt_words)
-    score += WEIGHTS['missing'] * missing
-    score += WEIGHTS['extra'] * extra
-    score += WEIGHTS['ambig'] * (src_counts['reading'] - src_counts['cohort'])
-    score += WEIGHTS['ins'] * src_counts['ins']
-    score += WEIGHTS['unk'] * src_counts['unk']
-    mf, ef = cg3_score.symmetric_difference(tgt_feats, src_feats)
-    score += WEIGHTS['missing_feats'] * mf
-    score += WEIGHTS['extra_feats'] * ef
-    return score
-
-source = []
-source_blocks = []
-window_scores = []
-base_score = 0
-def update_source(fname):
-    global source, source_blocks, window_scores, base_score
-    with open(fname, 'rb') as fin:
-        source = list(parse_cg3(fin, windows_only=True))
-        fin.seek(0)
-        source_blocks = list(cg3_score.iter_blocks(fin.read()))
-    window_scores = [score_window(s, t, i) for i, (s, t) in enumerate(zip(source, target))]
-    base_score = sum(window_scores)
-update_source(args.source)
-print(f'{len(source)=}, {len(target)=}')
-
-def score_rule(rule, gpath, windows):
-    with open(gpath, 'w') as fout:
-        fout.write(RULE_HEADER + rule[1])
-    score = 0
-    last_window = 0
-    for idx, slb in zip(windows, run_windows(gpath, windows)):
-        score += sum(window_scores[last_window:idx])
-        score += score_buffer(slb, target[idx], idx)
-        last_window = idx+1
-    score += sum(window_scores[last_window:])
-    return score
-
-initial_rule_output = RULE_HEADER
-initial_source = args.source
-if args.append:
-    with open(args.out) as fin:
-        initial_rule_output = fin.read().strip() + '\n\n'
-        if not initial_rule_output.startswith(RULE_HEADER):
-            initial_rule_output = RULE_HEADER + initial_rule_output
-    new_source = NamedTemporaryFile(delete=False, delete_on_close=False)
-    initial_source = new_source.name
-    subprocess.run(['vislcg3', '--in-binary', '--out-binary', '-g',
-                    args.out, '-I', args.source, '-O', new_source.name],
-                   capture_output=True)
-    update_source(new_source.name)
-
-with (TemporaryDirectory() as tmpdir,
-      open(args.out, 'w') as rule_output):
-    rule_output.write(initial_rule_output)
-
-    def log_scores(iteration, src_path):
-        global target, rule_output, EXCLUDE, LAST_ITER_START
-        update_source(src_path)
-        base_per = PER(source, target, TARGET_FEATS, SKIP_WINDOWS)
-        rule_output.write('####################\n')
-        rule_output.write(f'## {iteration}: {base_score} PER_lem {base_per[0]:.2f}% PER_form {base_per[1]:.2f}%\n')
-        rule_output.write('####################\n')
-        diff = time.time() - LAST_ITER_START
-        LAST_ITER_START = time.time()
-        print(f'{iteration=}, {base_score=}, {len(EXCLUDE)=} PER_lem {base_per[0]:.2f}% PER_form {base_per[1]:.2f}% round duration {diff:.2f}')
-
-    for iteration in range(args.iterations):
-        src_path = os.path.join(tmpdir, f'output.{iteration}.bin')
-        if iteration == 0:
-            src_path = initial_source
-        log_scores(iteration, src_path)
-        tgt_path = os.path.join(tmpdir, f'output.{iteration+1}.bin')
-
-        potential_rules = defaultdict(Counter)
-
-        for window, (slw, tlw) in enumerate(zip(source, target)):
-            if window in SKIP_WINDOWS:
-                continue
-            for rule in gen_rules(window, slw, tlw):
-                if rule in EXCLUDE:
-                    continue
-                potential_rules[rule[0]][rule] += 1
-
-        failed_errors = set()
-        non_failed = set()
-        rules = []
-        for rt in RTYPES:
-            for r, _ in potential_rules[rt].most_common(args.count):
-                rules.append((r, format_rule(*r),
-                              format_relation(r[1], r[2])))
-
-        gpath = os.path.join(tmpdir, f'intersection.{iteration}.cg3')
-        opath = os.path.join(tmpdir, f'intersection.{iteration}.bin')
-        intersections, target_windows = calc_intersection(
-            rules, src_path, gpath, opath)
-
-        scored_rules = []
-        for sec_start in range(0, len(rules), args.threads):
-            procs = []
-            for rule_idx, rule in enumerate(rules[sec_start:sec_start+args.threads], sec_start):
-                prefix = os.path.join(tmpdir, f'r{rule_idx:05}')
-                procs.append(start_rule(rule, prefix,
-                                        target_windows[rule_idx],
-                                        rule_idx))
-            for p in procs:
-                s, r, ri = finish_rule(*p)
-                print(s, r[1])
-                if s < base_score:
-                    scored_rules.append((s, r, ri))
-                    non_failed.add(r[0])
-                else:
-                    failed_errors.add(r[0])
-        scored_rules.sort()
-        added = set()
+}
+
+# round13's rules, scored by a ScorePool of worker processes which keep
+# their own copy of the target and the current source
+class PoolLearner(Learner):
+    def __init__(self, pool, *args, best_first=False, batch_score=False,
+                 bench_batch=False, footprint_from_scoring=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = pool
+        self.best_first = best_first
+        self.batch_score = batch_score
+        self.bench_batch = bench_batch
+        self.footprint_from_scoring = footprint_from_scoring
+        # per-window scores of the current source as the workers score it,
+        # which deltas (and so bounds on them) are relative to
+        self.pool_scores = []
+
+    def update_source(self, fname):
+        super().update_source(fname)
+        self.pool.set_source(fname)
+        self.pool_scores = self.pool.wait(self.pool.submit_scores(
+            list(range(len(self.window_scores)))))
+
+    def delta_bound(self, windows):
+        # The lowest change in score that a rule which only touches these
+        # windows could possibly produce. With no negative weights a window
+        # can't score below 0, so the best a rule can do is zero them all.
+        if any(self.weights[k] < 0 for k in FACTORS):
+            return None
+        return -sum(self.pool_scores[w] for w in windows)
+
+    def can_improve(self, windows, best_delta=0):
+        bound = self.delta_bound(windows)
+        return bound is None or bound < best_delta
+
+    def start_rule(self, rule, windows, rule_idx):
+        job = self.pool.submit(self.header + rule[1], windows)
+        return (job, rule, rule_idx)
+
+    def finish_rule(self, job, rule, rule_idx):
+        return (self.base_score + self.pool.wait(job), rule, rule_idx)
+
+    def score_per_rule(self, rules, target_windows):
+        # rules which can't get below base_score are left out of the
+        # results, so improving() doesn't count them as failed either
+        procs = []
+        for rule_idx, rule in enumerate(rules):
+            windows = target_windows[rule_idx]
+            if self.can_improve(windows):
+                procs.append(self.start_rule(rule, windows, rule_idx))
+        if len(procs) < len(rules):
+            print(f'precheck skipped {len(rules)-len(procs)}/{len(rules)} rules')
+        return [self.finish_rule(*p) for p in procs]
+
+    def score_batched(self, rules, target_windows):
+        rule_texts = [r[1] for r in rules]
+        rule_windows = [target_windows[i] for i in range(len(rules))]
+        groups = batch_score.group_rules(rule_windows)
+        print(f'batched {len(rules)} rules into {len(groups)} groups')
+        jobs = [self.pool.submit_group(self.header, rule_texts, rule_windows,
+                                       g)
+                for g in groups]
+        deltas = {}
+        for job in jobs:
+            deltas.update(self.pool.wait(job))
+        return [(self.base_score + deltas[i], rule, i)
+                for i, rule in enumerate(rules)]
+
+    def score_best_first(self, rules, target_windows, intersections):
+        # Lazy version of the greedy selection in select_rules(). Candidates
+        # are queued by the lowest score they could reach (ties going to the
+        # ones gen_rules found the most errors for) and a candidate only gets
+        # scored when it reaches the front. A scored rule at the front is at
+        # least as good as anything still queued, so it can be selected right
+        # away, and anything blocked by a selected rule by then is dropped
+        # unscored. Entries are (score, scored?, tiebreak, index).
+        base_score = self.base_score
+        queue = []
+        for i, rule in enumerate(rules):
+            bound = self.delta_bound(target_windows[i])
+            key = -math.inf if bound is None else base_score + bound
+            queue.append((key, 0, -self.rule_counts[i], i))
+        heapq.heapify(queue)
+        results = []
+        selected = []
+        added = 0
         new_words = set()
-        selected_rules = []
-        for score, rule, i in scored_rules:
-            if intersections[i] & added:
+        blocked = 0
+        while queue and queue[0][0] < base_score:
+            if queue[0][1]:
+                score, _, rule, i = heapq.heappop(queue)
+                if not is_blocked(rule, i, intersections, added, new_words):
+                    added = select_rule(rule, i, added, new_words)
+                    selected.append(rule)
                 continue
-            if rule[1][0] == 'A':
-                key = rule[1].split(')')[0]
-                if key in new_words:
+            # score as many of the front candidates as there are workers
+            jobs = []
+            while (queue and not queue[0][1] and queue[0][0] < base_score
+                   and len(jobs) < self.threads):
+                i = heapq.heappop(queue)[3]
+                if is_blocked(rules[i], i, intersections, added, new_words):
+                    blocked += 1
                     continue
-                new_words.add(key)
-            selected_rules.append(rule)
-            added.add(i)
-
-        gpath = os.path.join(tmpdir, f'grammar.{iteration}.cg3')
-        rule_str = '\n'.join(r[1] for r in selected_rules)
-        with open(gpath, 'w') as fout:
-            fout.write(RULE_HEADER + rule_str)
-        rule_output.write(rule_str + '\n\n')
-        EXCLUDE.update(failed_errors - non_failed)
-        subprocess.run(['vislcg3', '--in-binary', '--out-binary', '-g',
-                        gpath, '-I', src_path, '-O', tgt_path],
-                       capture_output=True)
-    # log final values after all iterations
-    log_scores(args.iterations, tgt_path)
-
-print(json.dumps({
-    'max_mem_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
-    'time_sec': time.time() - START,
-}), file=sys.stderr)
+                jobs.append(self.start_rule(rules[i], target_windows[i], i))
+            for job in jobs:
+                score, rule, i = self.finish_rule(*job)
+                results.append((score, rule, i))
+                heapq.heappush(queue, (score, 1, rule, i))
+        # whatever is left unscored can't get below base_score; like the
+        # blocked ones it isn't in results, so it isn't excluded either
+        hopeless = len([1 for key, scored, _, i in queue if not scored])
+        results.sort(key=lambda r: r[2])
+        print(f'best-first: scored {len(results)}/{len(rules)} rules, skipped {blocked} blocked and {hopeless} that could not beat {base_score}')
+        return results, selected
+
+    def candidate_windows(self, rules):
+        # windows each rule could possibly target, for scoring runs which
+        # work out the real footprint themselves
+        postings = footprint.TagPostings(self.source_blocks,
+                                         len(self.window_scores))
+        names = footprint.set_names(self.header)
+        ret = {}
+        for i, rule in enumerate(rules):
+            tags = footprint.literal_tags(rule[0][1], names)
+            ret[i] = sorted(postings.candidates(tags) - self.skip_windows)
+        return ret
+
+    def score_with_footprint(self, rules, candidates):
+        procs = []
+        results = []
+        targets = {}
+        contexts = {}
+        target_windows = {}
+        for rule_idx, rule in enumerate(rules):
+            windows = candidates[rule_idx]
+            if not self.can_improve(windows):
+                continue # left out of results, as in score_per_rule()
+            grammar = footprint.relation_grammar(self.header, rule[1],
+                                                 rule[2])
+            procs.append((self.pool.submit_footprint(grammar, windows), rule,
+                          rule_idx))
+        for job, rule, rule_idx in procs:
+            delta, (t, c, w) = self.pool.wait(job)
+            results.append((self.base_score + delta, rule, rule_idx))
+            targets[rule_idx] = t
+            contexts[rule_idx] = c
+            target_windows[rule_idx] = w
+        results.sort(key=lambda r: r[2])
+        intersections = rule_graph.interaction_masks(len(rules), targets,
+                                                     contexts)
+        return results, intersections, target_windows
+
+    def choose_rules(self, rules, src_path, tmpdir, iteration):
+        isect_span = phases.start('intersection')
+        t0 = time.time()
+        if self.footprint_from_scoring:
+            target_windows = self.candidate_windows(rules)
+        else:
+            gpath = os.path.join(tmpdir, f'intersection.{iteration}.cg3')
+            opath = os.path.join(tmpdir, f'intersection.{iteration}.bin')
+            intersections, target_windows = self.calc_intersection(
+                rules, src_path, gpath, opath)
+        t1 = time.time()
+        isect_span.end()
+        score_span = phases.start('scoring')
+
+        selected_rules = None
+        self.pool.set_source(src_path)
+        if self.footprint_from_scoring:
+            results, intersections, target_windows = (
+                self.score_with_footprint(rules, target_windows))
+        elif self.best_first:
+            results, selected_rules = self.score_best_first(
+                rules, target_windows, intersections)
+        elif self.bench_batch:
+            t0 = time.time()
+            results = self.score_per_rule(rules, target_windows)
+            t1 = time.time()
+            batched = self.score_batched(rules, target_windows)
+            t2 = time.time()
+            batched = {i: score for score, rule, i in batched}
+            agree = len([1 for score, rule, i in results
+                         if batched[i] == score])
+            print(f'batch benchmark: per-rule {t1-t0:.2f}s, batched {t2-t1:.2f}s, {agree}/{len(results)} scores agree')
+        elif self.batch_score:
+            results = self.score_batched(rules, target_windows)
+        else:
+            results = self.score_per_rule(rules, target_windows)
+        footprint_step = ('prefilter' if self.footprint_from_scoring
+                          else 'intersection pass')
+        print(f'{footprint_step} {t1-t0:.2f}s, scoring {time.time()-t1:.2f}s')
+        phases.count('candidates', len(rules))
+        score_span.end()
+        scored_rules = self.improving(results)
+        print('scoring:', self.pool.report())
+        if selected_rules is None:
+            selected_rules = self.select_rules(scored_rules, intersections)
+        return selected_rules
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source')
+    parser.add_argument('target')
+    parser.add_argument('iterations', type=int)
+    parser.add_argument('out')
+    parser.add_argument('target_lang')
+    parser.add_argument('--weights', action='store', default='{}')
+    parser.add_argument('--count', type=int, default=25,
+                        help='number of rules to test per iteration')
+    parser.add_argument('--append', action='store_true',
+                        help='retain any rules already present in output file')
+    parser.add_argument('--max_sents', type=int, default=0,
+                        help='use only first N sentences')
+    parser.add_argument('--skip_windows', action='store',
+                        help='skip windows with indecies in this JSON list')
+    parser.add_argument('--rtypes', action='store',
+                        help='only generate certain rule types')
+    parser.add_argument('--threads', type=int, default=10,
+                        help='processes to use for generating and scoring candidate rules')
+    parser.add_argument('--batch_score', action='store_true',
+                        help='score candidates with disjoint windows in a single CG run')
+    parser.add_argument('--best_first', action='store_true',
+                        help='score candidates lazily in order of their best possible score, skipping ones that can no longer be selected')
+    parser.add_argument('--bench_batch', action='store_true',
+                        help='score candidates both per-rule and batched and report timing')
+    parser.add_argument('--footprint_from_scoring', action='store_true',
+                        help='skip the separate ADDRELATION pass and find the windows each rule touches during scoring')
+    parser.add_argument('--profile', type=int,
+                        help='write a cProfile of this iteration to OUT.N.prof')
+    args = parser.parse_args()
+    phases.set_profile(args.profile, f'{args.out}.{args.profile}.prof')
+    if args.footprint_from_scoring and (args.best_first or args.batch_score
+                                        or args.bench_batch):
+        parser.error('--footprint_from_scoring only works with per-rule scoring')
+
+    weights = defaultdict(lambda: 1, json.loads(args.weights))
+    target_feats = TARGET_FEATS[args.target_lang]
+    skip_windows = set()
+    if args.skip_windows:
+        with open(args.skip_windows) as fin:
+            skip_windows = set(json.loads(fin.read()))
+    rtypes = RTYPES
+    if args.rtypes:
+        rtypes = json.loads(args.rtypes)
+
+    initial_rule_output = RULE_HEADER
+    initial_source = args.source
+    if args.append:
+        with open(args.out) as fin:
+            initial_rule_output = fin.read().strip() + '\n\n'
+            if not initial_rule_output.startswith(RULE_HEADER):
+                initial_rule_output = RULE_HEADER + initial_rule_output
+        initial_source = applied_corpus.apply(args.out, args.source,
+                                              RULE_HEADER)
+
+    with ScorePool(args.threads, args.target, weights, target_feats,
+                   max_sents=args.max_sents,
+                   skip_windows=skip_windows) as pool:
+        lr = PoolLearner(pool, args.target, RULE_HEADER, rtypes, gen_rules,
+                         lambda r: format_rule(*r),
+                         lambda r: format_relation(r[1], r[2]),
+                         weights=weights, target_feats=target_feats,
+                         skip_windows=skip_windows, max_sents=args.max_sents,
+                         threads=args.threads, best_first=args.best_first,
+                         batch_score=args.batch_score,
+                         bench_batch=args.bench_batch,
+                         footprint_from_scoring=args.footprint_from_scoring)
+        # the generation workers are forked before the score pool's first
+        # job starts its workers and threads, and both last the whole run
+        with lr.start_generation():
+            lr.update_source(initial_source)
+            print(f'len(source)={len(lr.source)}, len(target)={len(lr.target)}')
+            lr.run(initial_source, args.out, args.iterations, args.count,
+                   initial_rule_output, original_source=args.source)
+
+    print(json.dumps({
+        'max_mem_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'time_sec': time.time() - START,
+    }), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+from collections import Counter, defaultdict
+import heapq
+
+# Candidate rule counts summed over all windows, kept up to date across
+# iterations by swapping out the contribution of each window whose parsed
+# object changed (i.e. which missed update_source()'s cache), rather than
+# regenerating every window.
+#
+# Rules are tuples starting with their type. Each window's Counter is
+# stored unfiltered, so rules excluded since it was generated are dropped
+# in most_common() instead.
+class CandidateCounts:
+    def __init__(self):
+        self.sources = {}    # window => parsed window the rules came from
+        self.window_rules = {}   # window => Counter, in generation order
+        self.positions = {}      # window => rule => index in window_rules
+        self.totals = defaultdict(Counter)   # rule type => rule => count
+        self.postings = defaultdict(set)     # rule => windows
+
+    def __len__(self):
+        return len(self.sources)
+
+    def stale(self, windows):
+        # windows is (window index, parsed window) pairs
+        return [i for i, slw in windows if self.sources.get(i) is not slw]
+
+    def remove(self, window):
+        self.sources.pop(window, None)
+        self.positions.pop(window, None)
+        for rule, count in self.window_rules.pop(window, Counter()).items():
+            totals = self.totals[rule[0]]
+            totals[rule] -= count
+            if totals[rule] <= 0:
+                del totals[rule]
+            self.postings[rule].discard(window)
+            if not self.postings[rule]:
+                del self.postings[rule]
+
+    def update(self, window, slw, rules):
+        self.remove(window)
+        self.sources[window] = slw
+        self.window_rules[window] = rules
+        self.positions[window] = {r: i for i, r in enumerate(rules)}
+        for rule, count in rules.items():
+            self.totals[rule[0]][rule] += count
+            self.postings[rule].add(window)
+
+    def first_seen(self, rule):
+        window = min(self.postings[rule])
+        return window, self.positions[window][rule]
+
+    def most_common(self, rtype, n, exclude=()):
+        # same as most_common() on a Counter filled by a pass over the
+        # windows in order, so ties go to the rule seen first
+        if n <= 0:
+            return []
+        counts = [(c, r) for r, c in self.totals[rtype].items()
+                  if r not in exclude]
+        if len(counts) > n:
+            cut = heapq.nlargest(n, [c for c, r in counts])[-1]
+            counts = [x for x in counts if x[0] >= cut]
+        counts.sort(key=lambda x: (-x[0], self.first_seen(x[1])))
+        return [(r, c) for c, r in counts[:n]]
+
+# Memoizes fn(window, *args) until the window's block changes. sync() is
+# called with the new blocks whenever the source is reloaded.
+class WindowCache:
+    def __init__(self, fn, blocks):
+        self.fn = fn
+        self.blocks = list(blocks)
+        self.values = {}   # window => args => fn(window, *args)
+
+    def __call__(self, window, *args):
+        values = self.values.setdefault(window, {})
+        if args not in values:
+            values[args] = self.fn(window, *args)
+        return values[args]
+
+    def sync(self, blocks):
+        blocks = list(blocks)
+        changed = [i for i, b in enumerate(blocks)
+                   if i >= len(self.blocks) or self.blocks[i] != b]
+        changed += range(len(blocks), len(self.blocks))
+        for i in changed:
+            self.values.pop(i, None)
+        self.blocks = blocks
+        return changed
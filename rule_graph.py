@@ -0,0 +1,33 @@
+from collections import defaultdict
+
+# Rule interactions as Python int bitsets over rule indices, so checking a
+# rule against everything selected so far is a single &.
+# targets and contexts map rule index => set of cohort ids (dep_self).
+
+def interaction_masks(count, targets, contexts):
+    # inverted index: cohort id => bitset of rules targeting it
+    # or using it as context
+    target_rules = defaultdict(int)
+    context_rules = defaultdict(int)
+    has_context = 0
+    for i in range(count):
+        bit = 1 << i
+        for c in targets.get(i, ()):
+            target_rules[c] |= bit
+        for c in contexts.get(i, ()):
+            context_rules[c] |= bit
+        if contexts.get(i):
+            has_context |= bit
+    masks = []
+    for i in range(count):
+        m = 0
+        for c in targets.get(i, ()):
+            m |= target_rules[c] | context_rules.get(c, 0)
+        for c in contexts.get(i, ()):
+            m |= target_rules.get(c, 0)
+        # a pair only counts if the later of the two rules has a context
+        keep = has_context & ~((2 << i) - 1)
+        if (has_context >> i) & 1:
+            keep |= (1 << i) - 1
+        masks.append(m & keep)
+    return masks
@@ -1,8 +1,8 @@
+import cg_apply
 from stream import Cohort, Sentence, read_stream
 
 from collections import defaultdict
 from dataclasses import dataclass, field, replace
-import subprocess
 import tempfile
 import textwrap
 from typing import Optional
@@ -22,9 +22,9 @@ class Context:
 
 def apply_grammar(grammar: str, infile: str, outfile: str, trace: bool = True, prefix: str = '@') -> None:
     tr = ['--trace'] if trace else []
-    subprocess.run(
-        ['vislcg3', '-g', grammar, '-I', infile, '-O', outfile, '--dep-delimit', '--print-ids', '--prefix', prefix] + tr,
-        capture_output=True,
+    cg_apply.apply_text_file(
+        grammar, infile, outfile,
+        ['--dep-delimit', '--print-ids', '--prefix', prefix] + tr,
     )
 
 @dataclass
@@ -37,10 +37,9 @@ train_tgt = read_bin(args.train_tgt)
 dev_src = read_bin(args.dev_src)
 dev_tgt = read_bin(args.dev_tgt)
 
-def score_buffer(slb, tgt_words, tgt_feats, tgt_counts):
+def score_buffer(src, tgt_words, tgt_feats, tgt_counts):
     score = 0
-    src_words, src_feats, src_counts = cg3_score.parse_window(
-        slb, TARGET_FEATS)
+    src_words, src_feats, src_counts = src
     score += WEIGHTS['cohorts'] * abs(src_counts['cohort'] - tgt_counts['cohort'])
     extra, missing = cg3_score.symmetric_difference(src_words, tgt_words)
     score += WEIGHTS['missing'] * missing
@@ -53,10 +52,8 @@ def score_buffer(slb, tgt_words, tgt_feats, tgt_counts):
     score += WEIGHTS['extra_feats'] * ef
     return score
 
-train_data = [cg3_score.parse_window(tb, TARGET_FEATS)
-              for tb in cg3_score.iter_blocks(train_tgt)]
-dev_data = [cg3_score.parse_window(tb, TARGET_FEATS)
-            for tb in cg3_score.iter_blocks(dev_tgt)]
+train_data = list(cg3_score.decode_stream(train_tgt, TARGET_FEATS))
+dev_data = list(cg3_score.decode_stream(dev_tgt, TARGET_FEATS))
 
 train_windows = [cg3.parse_binary_window(tb[5:])
                  for i, tb in enumerate(cg3_score.iter_blocks(train_tgt))
@@ -80,6 +77,7 @@ def score_output(buf, mode):
     global train_src, dev_src, scores
     windows = []
     loss = 0
+    stats = cg3_score.decode_stream(buf, TARGET_FEATS)
     for i, block in enumerate(cg3_score.iter_blocks(buf)):
         if mode == 'dev' and i in DEV_SKIP:
             continue
@@ -90,7 +88,7 @@ def score_output(buf, mode):
         elif mode == 'train' and i >= len(train_data):
             break
         tgt = train_data[i] if mode == 'train' else dev_data[i]
-        loss += score_buffer(block, *tgt)
+        loss += score_buffer(stats.window(i), *tgt)
         windows.append(cg3.parse_binary_window(block[5:]))
     pl, pf = metrics.PER(
         windows,
@@ -1,4 +1,5 @@
 import argparse
+from bin_corpus import BinCorpus
 import cg3
 import cg3_score
 from collections import Counter, defaultdict
@@ -32,9 +33,7 @@ def read_bin(path):
         return fin.read()
 
 train_src = read_bin(args.train_src)
-train_tgt = read_bin(args.train_tgt)
 dev_src = read_bin(args.dev_src)
-dev_tgt = read_bin(args.dev_tgt)
 
 def count_lemmas(window):
     lc = Counter()
@@ -57,11 +56,11 @@ def loss(window, tlc, tfc):
     #return al + bl, af + bf
     return al + bl, bf
 
-train_windows = [cg3.parse_binary_window(tb[5:])
-                 for i, tb in enumerate(cg3_score.iter_blocks(train_tgt))
+train_tgt = BinCorpus(args.train_tgt, cache_size=0, use_index=True)
+dev_tgt = BinCorpus(args.dev_tgt, cache_size=0, use_index=True)
+train_windows = [train_tgt.window(i) for i in range(len(train_tgt))
                  if i not in TRAIN_SKIP]
-dev_windows = [cg3.parse_binary_window(tb[5:])
-               for i, tb in enumerate(cg3_score.iter_blocks(dev_tgt))
+dev_windows = [dev_tgt.window(i) for i in range(len(dev_tgt))
                if i not in DEV_SKIP]
 
 train_data = [count_lemmas(w) for w in train_windows]
@@ -0,0 +1,188 @@
+import batch_score
+from bin_corpus import BinCorpus
+import cg3_score
+import cg_apply
+import footprint
+import phases
+
+from concurrent.futures import ProcessPoolExecutor
+import statistics
+import time
+
+CG_BIN_HEADER = b'CGBF\x01\x00\x00\x00'
+CG_BIN_FOOTER = b'\x02\x01\x02\x02' # FLUSH, EXIT
+
+FACTORS = ['cohorts', 'missing', 'extra', 'ambig', 'ins', 'unk',
+           'missing_feats', 'extra_feats']
+
+# state of a single worker process, filled in by init_worker()
+WORKER = {}
+
+def init_worker(target_path, max_sents, weights, target_feats, skip_windows):
+    with open(target_path, 'rb') as fin:
+        blocks = list(cg3_score.iter_blocks(fin.read()))
+    if max_sents > 0:
+        blocks = blocks[:max_sents]
+    WORKER['target'] = list(cg3_score.decode_blocks(blocks, target_feats,
+                                                    keep_source=True))
+    WORKER['weights'] = weights
+    WORKER['target_feats'] = target_feats
+    WORKER['skip_windows'] = skip_windows
+    WORKER['source_path'] = None
+    WORKER['source_blocks'] = []
+    WORKER['source_scores'] = {}
+
+def load_source(path):
+    if WORKER['source_path'] == path:
+        return
+    WORKER['source_blocks'] = BinCorpus(path)
+    WORKER['source_scores'] = {}
+    WORKER['source_path'] = path
+
+def run_cg(grammar, inp):
+    with cg_apply.Grammar(text=grammar) as g:
+        return g.run(inp)
+
+def score_blocks(windows, blocks):
+    stats = cg3_score.decode_blocks(blocks, WORKER['target_feats'])
+    score = 0
+    for idx, src in zip(windows, stats):
+        if idx in WORKER['skip_windows']:
+            continue
+        score += cg3_score.score_stats_ch4(src, WORKER['target'][idx],
+                                           WORKER['weights'])
+    return score
+
+def source_score(windows):
+    # score of the windows as they currently are, before any rule applies
+    cache = WORKER['source_scores']
+    missing = [i for i in windows if i not in cache]
+    if missing:
+        blocks = WORKER['source_blocks']
+        stats = cg3_score.decode_blocks([blocks[i] for i in missing],
+                                        WORKER['target_feats'])
+        for idx, src in zip(missing, stats):
+            cache[idx] = 0
+            if idx not in WORKER['skip_windows']:
+                cache[idx] = cg3_score.score_stats_ch4(
+                    src, WORKER['target'][idx], WORKER['weights'])
+    return sum(cache[i] for i in windows)
+
+def delta_blocks(windows, blocks):
+    return score_blocks(windows, blocks) - source_score(windows)
+
+def run_job(grammar, windows, source_path):
+    start = time.time()
+    load_source(source_path)
+    blocks = WORKER['source_blocks']
+    inp = CG_BIN_HEADER + b''.join(blocks[i] for i in windows) + CG_BIN_FOOTER
+    out = run_cg(grammar, inp)
+    delta = delta_blocks(windows, list(cg3_score.iter_blocks(out)))
+    return delta, time.time() - start
+
+def run_scores_job(windows, source_path):
+    # each window's score before any rule applies
+    start = time.time()
+    load_source(source_path)
+    source_score(windows)
+    cache = WORKER['source_scores']
+    return [cache[i] for i in windows], time.time() - start
+
+def run_footprint_job(grammar, windows, source_path):
+    # like run_job, but grammar also carries the rule's relation rules
+    # (see footprint.relation_grammar) and the touched cohorts come back too
+    start = time.time()
+    load_source(source_path)
+    blocks = WORKER['source_blocks']
+    in_blocks = [blocks[i] for i in windows]
+    out = run_cg(grammar, CG_BIN_HEADER + b''.join(in_blocks) + CG_BIN_FOOTER)
+    out_blocks = list(cg3_score.iter_blocks(out))
+    delta = delta_blocks(windows, out_blocks)
+    return ((delta, footprint.collect(windows, in_blocks, out_blocks)),
+            time.time() - start)
+
+def run_group_job(header, rules, rule_windows, source_path):
+    # rules and rule_windows are dicts keyed by rule index
+    start = time.time()
+    load_source(source_path)
+    members = sorted(rules)
+    inp = batch_score.group_stream(WORKER['source_blocks'], rule_windows,
+                                   members)
+    out = run_cg(batch_score.group_grammar(header, rules, members), inp)
+    per_rule = batch_score.split_output(out, rule_windows, members)
+    deltas = {i: delta_blocks(rule_windows[i], per_rule[i]) for i in members}
+    return deltas, time.time() - start
+
+# Long-lived scorer processes which keep the target corpus in memory
+# and score (grammar, window list) jobs against the current source file.
+# A job's result is the change in total score from applying the grammar,
+# which only depends on the windows it was given. Windows are scored the
+# way ch4_score did it when round14 ran that per candidate.
+class ScorePool:
+    def __init__(self, threads, target_path, weights, target_feats,
+                 max_sents=0, skip_windows=None):
+        weights = {k: weights[k] for k in FACTORS}
+        self.executor = ProcessPoolExecutor(
+            threads, initializer=init_worker,
+            initargs=(target_path, max_sents, weights, target_feats,
+                      set(skip_windows or [])))
+        self.source_path = None
+        self.latencies = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    def set_source(self, path):
+        # workers reload lazily when they see a new path
+        self.source_path = path
+
+    def submit(self, grammar, windows):
+        return (self.executor.submit(run_job, grammar, windows,
+                                     self.source_path),
+                time.time())
+
+    def submit_scores(self, windows):
+        return (self.executor.submit(run_scores_job, windows,
+                                     self.source_path),
+                time.time())
+
+    def submit_footprint(self, grammar, windows):
+        return (self.executor.submit(run_footprint_job, grammar, windows,
+                                     self.source_path),
+                time.time())
+
+    def submit_group(self, header, rules, rule_windows, members):
+        return (self.executor.submit(
+            run_group_job, header,
+            {i: rules[i] for i in members},
+            {i: rule_windows[i] for i in members},
+            self.source_path),
+                time.time())
+
+    def wait(self, job):
+        future, submitted = job
+        score, cg_time = future.result()
+        latency = time.time() - submitted
+        self.latencies.append((latency, cg_time))
+        # the CG run happens in the worker, so a job (one candidate, or a
+        # group of them) is only seen from here
+        phases.event('score_job', start=submitted, wall=latency,
+                     worker_sec=cg_time)
+        return score
+
+    def report(self):
+        if not self.latencies:
+            return 'no jobs'
+        total = [t for t, c in self.latencies]
+        work = [c for t, c in self.latencies]
+        ret = (f'{len(total)} jobs, latency mean {statistics.mean(total):.3f}s'
+               f' max {max(total):.3f}s, worker time mean'
+               f' {statistics.mean(work):.3f}s max {max(work):.3f}s')
+        self.latencies = []
+        return ret
@@ -1,5 +1,55 @@
+import argparse
 import glob
+import json
 from collections import Counter, defaultdict
+import sys
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--trace', nargs='+', metavar='JSONL',
+                    help='summarize these TBL_TRACE files by phase instead')
+args = parser.parse_args()
+
+PHASES = ['generation', 'intersection', 'scoring', 'apply', 'rescore']
+FIELDS = ['wall', 'cpu', 'child_cpu', 'subprocesses', 'bytes_in',
+          'bytes_out', 'candidates']
+
+def summarize_trace(paths):
+    # per script and phase, summed over every run (file and pid) of it
+    totals = defaultdict(Counter)
+    spans = Counter()
+    runs = defaultdict(set)
+    for path in paths:
+        with open(path) as fin:
+            for line in fin:
+                ev = json.loads(line)
+                key = (ev['script'], ev['phase'])
+                spans[key] += 1
+                runs[key].add((path, ev['pid']))
+                for f in FIELDS:
+                    totals[key][f] += ev.get(f) or 0
+    print('script', 'phase', 'runs', 'spans', 'wall', 'wall/run', 'share',
+          'cpu', 'child_cpu', 'subprocs', 'MB_in', 'MB_out', 'candidates',
+          sep='\t')
+    for script in sorted(set(s for s, p in totals)):
+        # nested spans (candidate, score_job) are left out of the share
+        top = sum(totals[(script, p)]['wall'] for p in PHASES)
+        phases = [p for p in PHASES if (script, p) in totals]
+        phases += sorted(p for s, p in totals
+                         if s == script and p not in PHASES)
+        for phase in phases:
+            key = (script, phase)
+            t = totals[key]
+            share = f'{100.0 * t["wall"] / top:.1f}%' if (
+                phase in PHASES and top) else '-'
+            print(script, phase, len(runs[key]), spans[key],
+                  f'{t["wall"]:.2f}', f'{t["wall"] / len(runs[key]):.2f}',
+                  share, f'{t["cpu"]:.2f}', f'{t["child_cpu"]:.2f}',
+                  t['subprocesses'], f'{t["bytes_in"] / 1e6:.1f}',
+                  f'{t["bytes_out"] / 1e6:.1f}', t['candidates'], sep='\t')
+
+if args.trace:
+    summarize_trace(args.trace)
+    sys.exit()
 
 xs = []
 ys = []
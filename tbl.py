@@ -0,0 +1,472 @@
+import cg3
+from cg3 import parse_binary_stream as parse_cg3
+import applied_corpus
+from bin_corpus import BinCorpus
+import cg3_score
+import cg_apply
+import checkpoint
+import gen_pool
+from metrics import PER
+import phases
+import rule_graph
+from rule_cache import CandidateCounts
+
+from collections import Counter, defaultdict
+import contextlib
+import copy
+import io
+import os
+from tempfile import TemporaryDirectory
+import time
+
+# Shared machinery for the transformation-based learners. A Learner holds
+# what the round* scripts kept in module globals (the target corpus, the
+# current source and its window scores, EXCLUDE) and runs the iteration
+# loop. The learner-specific parts are plugged in:
+#
+#   gen_rules(learner, window, slw, tlw) yields candidate rule keys,
+#     tuples starting with the rule type
+#   format_rule(key) gives the grammar text of a candidate
+#   format_relation(key) gives ADDRELATION rules marking its targets (tr)
+#     and contexts (r), with {NUM} standing in for the rule index
+#
+# Learners which generate, score or select another way (round12 and
+# fix_tree2 with an ErrorIndex, round14 with a ScorePool) subclass it and
+# override the step that differs: gen_shard/candidate_rules, score_rules,
+# score_window/score_windows or choose_rules. The lex_* scripts don't use
+# it: they pick rules per source lemma and score them with an external
+# scorer over a work_queue, which doesn't fit this loop.
+#
+# Nothing here reads command line arguments, so it can be imported from
+# tests and benchmarks.
+
+def desc_r(reading):
+    ret = reading.lemma
+    for t in reading.tags:
+        if t != 'SOURCE':
+            ret += ' ' + t
+            break
+    return ret
+
+def desc_c(cohort):
+    for r in cohort.readings:
+        if 'SOURCE' in r.tags:
+            return desc_r(r)
+    return desc_r(cohort.readings[0])
+
+def get_rel(cohort):
+    for r in cohort.readings:
+        for t in r.tags:
+            if t[0] == '@':
+                return t
+
+def tags_to_feature_dict(tags, target_feats, dct=None):
+    if dct is None:
+        dct = defaultdict(Counter)
+    for t in tags:
+        if '=' in t:
+            k, v = t.split('=', 1)
+            if target_feats is not None and k not in target_feats:
+                continue
+            dct[k][v] += 1
+    return dct
+
+def tags_to_flat_feature_dict(desc, tags, target_feats, dct):
+    for t in tags:
+        if '=' in t:
+            k, v = t.split('=', 1)
+            if target_feats is not None and k not in target_feats:
+                continue
+            dct[(desc, t)] += 1
+
+def collect_words_and_feats(window, target_feats, for_eval=True,
+                            for_gen=True):
+    words = Counter()
+    feats = defaultdict(lambda: defaultdict(Counter))
+    feats_flat = Counter()
+    for c in window.cohorts:
+        for r in c.readings:
+            if 'SOURCE' in r.tags:
+                continue
+            d = desc_r(r)
+            words[d] += 1
+            if for_gen:
+                tags_to_feature_dict(r.tags, target_feats, feats[d])
+            if for_eval:
+                tags_to_flat_feature_dict(d, r.tags, target_feats,
+                                          feats_flat)
+    return words, feats, feats_flat
+
+def new_word_key(rule):
+    # only one ADDCOHORT per inserted word per iteration
+    if rule[1][0] == 'A':
+        return rule[1].split(')')[0]
+    return None
+
+def is_blocked(rule, i, intersections, added, new_words):
+    # added is a bitset of the selected rule indices
+    if intersections[i] & added:
+        return True
+    return new_word_key(rule) in new_words
+
+def select_rule(rule, i, added, new_words):
+    key = new_word_key(rule)
+    if key is not None:
+        new_words.add(key)
+    return added | (1 << i)
+
+# the learner whose candidates are being generated; gen_pool workers are
+# forked with it here instead of having it pickled
+ACTIVE = None
+
+def gen_rules_shard(part, exclude):
+    # part is [(window, block)]: the worker's copy of the learner dates
+    # from when it was forked, so its source windows and EXCLUDE are stale
+    ACTIVE.exclude = exclude
+    ACTIVE.source = {window: cg3.parse_binary_window(bytes(block[5:]))
+                     for window, block in part}
+    return ACTIVE.gen_shard([window for window, block in part])
+
+class Learner:
+    def __init__(self, target_path, header, rtypes, gen_rules, format_rule,
+                 format_relation, weights=None, target_feats=None,
+                 skip_windows=None, max_sents=0, threads=1):
+        self.header = header
+        self.rtypes = rtypes
+        self.gen_rules = gen_rules
+        self.format_rule = format_rule
+        self.format_relation = format_relation
+        self.weights = defaultdict(lambda: 1, weights or {})
+        self.target_feats = target_feats
+        self.skip_windows = set(skip_windows or [])
+        self.threads = threads
+        self.exclude = set()
+        target_corpus = BinCorpus(target_path, max_sents=max_sents,
+                                  cache_size=0, use_index=True)
+        self.target = [target_corpus.window(i)
+                       for i in range(len(target_corpus))]
+        self.target_words_and_feats = [self.collect_words_and_feats(w)
+                                       for w in self.target]
+        self.source = []
+        self.source_blocks = []
+        self.window_scores = []
+        self.base_score = 0
+        # (window index, raw block) => (parsed window, score)
+        # most windows come out of vislcg3 unchanged, so only reparse the rest
+        self.window_cache = {}
+        # anything with stale() and update(window, slw, *rows), where
+        # gen_shard() gives the rows
+        self.candidates = CandidateCounts()
+        self.gen_windows = []
+        self.gen_pool = None
+        self.rule_counts = []
+        self.last_iter_start = time.time()
+
+    def collect_words_and_feats(self, window, for_eval=True, for_gen=True):
+        return collect_words_and_feats(window, self.target_feats, for_eval,
+                                       for_gen)
+
+    def score_window(self, slw, index):
+        if index in self.skip_windows:
+            return 0
+        w = self.weights
+        tlw = self.target[index]
+        score = 0
+        score += w['cohorts'] * abs(len(slw.cohorts) - len(tlw.cohorts))
+        src_words, _, src_feats = self.collect_words_and_feats(
+            slw, for_gen=False)
+        tgt_words, _, tgt_feats = self.target_words_and_feats[index]
+        extra, missing = cg3_score.symmetric_difference(src_words, tgt_words)
+        score += w['missing'] * missing
+        score += w['extra'] * extra
+        score += w['ambig'] * (src_words.total() - len(slw.cohorts))
+        score += w['ins'] * len([s for s in slw.cohorts
+                                 if s.static.lemma == '"<ins>"'])
+        score += w['unk'] * sum([ct for lm, ct in src_words.items()
+                                 if lm.startswith('"@')])
+        mf, ef = cg3_score.symmetric_difference(tgt_feats, src_feats)
+        score += w['missing_feats'] * mf
+        score += w['extra_feats'] * ef
+        return score
+
+    def score_buffer(self, src, index):
+        # src is one window of cg3_score.decode_blocks()
+        if index in self.skip_windows:
+            return 0
+        w = self.weights
+        score = 0
+        src_words, src_feats, src_counts = src
+        score += w['cohorts'] * abs(src_counts['cohort']
+                                    - len(self.target[index].cohorts))
+        tgt_words, _, tgt_feats = self.target_words_and_feats[index]
+        extra, missing = cg3_score.symmetric_difference(src_words, tgt_words)
+        score += w['missing'] * missing
+        score += w['extra'] * extra
+        score += w['ambig'] * (src_counts['reading'] - src_counts['cohort'])
+        score += w['ins'] * src_counts['ins']
+        score += w['unk'] * src_counts['unk']
+        mf, ef = cg3_score.symmetric_difference(tgt_feats, src_feats)
+        score += w['missing_feats'] * mf
+        score += w['extra_feats'] * ef
+        return score
+
+    def update_source(self, fname):
+        self.source_blocks = BinCorpus(fname)
+        self.source = []
+        self.window_scores = []
+        new_cache = {}
+        hits = 0
+        for i, block in enumerate(self.source_blocks):
+            key = (i, block)
+            if key in self.window_cache:
+                hits += 1
+                slw, score = self.window_cache[key]
+            else:
+                slw = self.source_blocks.window(i)
+                score = None
+                if i < len(self.target):
+                    score = self.score_window(slw, i)
+            self.source.append(slw)
+            if score is not None:
+                self.window_scores.append(score)
+            new_cache[key] = (slw, score)
+        self.window_cache = new_cache
+        self.base_score = sum(self.window_scores)
+        if self.source_blocks:
+            print(f'window cache: {hits}/{len(self.source_blocks)} hits ({100.0*hits/len(self.source_blocks):.1f}%)')
+
+    def run_grammar(self, ipath, gpath, opath):
+        data = cg_apply.apply_file(gpath, ipath, opath)
+        yield from parse_cg3(io.BytesIO(data), windows_only=True)
+
+    def run_windows(self, gpath, windows):
+        out = cg_apply.Grammar(gpath).run_blocks(
+            self.source_blocks[i] for i in windows)
+        yield from cg3_score.iter_blocks(out)
+
+    def calc_intersection(self, rules, ipath, gpath, opath):
+        if not rules:
+            return [], {}
+        with open(gpath, 'w') as fout:
+            for i, r in enumerate(rules):
+                fout.write(r[2].replace('{NUM}', str(i)) + '\n')
+        target_windows = defaultdict(set)
+        targets = defaultdict(set)
+        contexts = defaultdict(set)
+        for idx, window in enumerate(self.run_grammar(ipath, gpath, opath)):
+            if idx in self.skip_windows or idx >= len(self.target):
+                continue
+            for cohort in window.cohorts:
+                for tag, heads in cohort.relations.items():
+                    if tag[0] == 'r' and tag[1:].isdigit():
+                        contexts[int(tag[1:])].update(heads)
+                    elif tag.startswith('tr') and tag[2:].isdigit():
+                        targets[int(tag[2:])].add(cohort.dep_self)
+                        target_windows[int(tag[2:])].add(idx)
+        intersections = rule_graph.interaction_masks(len(rules), targets,
+                                                     contexts)
+        return intersections, {k: sorted(v) for k, v in target_windows.items()}
+
+    def score_windows(self, gpath, windows):
+        # (window index, score) of each window after running the grammar
+        stats = cg3_score.decode_blocks(self.run_windows(gpath, windows),
+                                        self.target_feats)
+        for n, idx in zip(range(len(stats)), windows):
+            yield idx, self.score_buffer(stats.window(n), idx)
+
+    def score_rule(self, rule, gpath, windows):
+        with open(gpath, 'w') as fout:
+            fout.write(self.header + rule[1])
+        score = 0
+        last_window = 0
+        for idx, s in self.score_windows(gpath, windows):
+            score += sum(self.window_scores[last_window:idx])
+            score += s
+            last_window = idx+1
+        score += sum(self.window_scores[last_window:])
+        return score
+
+    def gen_shard(self, windows):
+        # (window, candidate counts) for each window
+        return [(window, Counter(self.gen_rules(self, window,
+                                                self.source[window],
+                                                self.target[window])))
+                for window in windows]
+
+    def start_generation(self):
+        # forks the workers update_candidates() uses for the rest of the
+        # run; call it before starting any other worker pool
+        global ACTIVE
+        if self.threads <= 1:
+            return contextlib.nullcontext()
+        ACTIVE = self
+        self.gen_pool = gen_pool.GenPool(self.threads)
+        return self.gen_pool
+
+    def update_candidates(self):
+        # only windows which changed since the last iteration
+        self.gen_windows = self.candidates.stale(
+            (w, self.source[w])
+            for w in range(min(len(self.source), len(self.target)))
+            if w not in self.skip_windows)
+        if self.gen_pool is None or len(self.gen_windows) < 2:
+            parts = [self.gen_shard(self.gen_windows)]
+        else:
+            parts = self.gen_pool.map(
+                gen_rules_shard,
+                [(w, bytes(self.source_blocks[w])) for w in self.gen_windows],
+                self.exclude)
+        for part in parts:
+            for window, *rows in part:
+                self.candidates.update(window, self.source[window], *rows)
+        print(f'candidates: regenerated {len(self.gen_windows)}/{len(self.candidates)} windows')
+
+    def candidate_rules(self, count):
+        # (key, rule text, relation text) for the top count of each type,
+        # with how often each was generated in rule_counts
+        rules = []
+        self.rule_counts = []
+        for rt in self.rtypes:
+            for r, c in self.candidates.most_common(rt, count, self.exclude):
+                rules.append((r, self.format_rule(r),
+                              self.format_relation(r)))
+                self.rule_counts.append(c)
+        return rules
+
+    def exclude_key(self, rule):
+        # what goes in EXCLUDE when a rule fails
+        return rule[0]
+
+    def score_rules(self, rules, target_windows, tmpdir):
+        # (score, rule, index) for every rule
+        results = []
+        for rule_idx, rule in enumerate(rules):
+            gpath = os.path.join(tmpdir, f'g{rule_idx:05}.cg3')
+            with phases.timed('candidate', rule=rule[1]):
+                s = self.score_rule(rule, gpath, target_windows[rule_idx])
+            results.append((s, rule, rule_idx))
+        return results
+
+    def improving(self, results):
+        # the results which improve the score, best first; the keys of
+        # rules which never do are added to EXCLUDE
+        failed = set()
+        non_failed = set()
+        scored_rules = []
+        for s, rule, rule_idx in results:
+            print(s, rule[1])
+            if s < self.base_score:
+                scored_rules.append((s, rule, rule_idx))
+                non_failed.add(self.exclude_key(rule))
+            else:
+                failed.add(self.exclude_key(rule))
+        scored_rules.sort()
+        self.exclude.update(failed - non_failed)
+        return scored_rules
+
+    def select_rules(self, scored_rules, intersections):
+        added = 0
+        new_words = set()
+        selected_rules = []
+        for score, rule, i in scored_rules:
+            if is_blocked(rule, i, intersections, added, new_words):
+                continue
+            added = select_rule(rule, i, added, new_words)
+            selected_rules.append(rule)
+        return selected_rules
+
+    def choose_rules(self, rules, src_path, tmpdir, iteration):
+        # the rules to apply this iteration
+        gpath = os.path.join(tmpdir, f'intersection.{iteration}.cg3')
+        opath = os.path.join(tmpdir, f'intersection.{iteration}.bin')
+        with phases.timed('intersection'):
+            intersections, target_windows = self.calc_intersection(
+                rules, src_path, gpath, opath)
+        with phases.timed('scoring'):
+            results = self.score_rules(rules, target_windows, tmpdir)
+            phases.count('candidates', len(rules))
+        return self.select_rules(self.improving(results), intersections)
+
+    def score_report(self):
+        # the contribution of each factor to the score of the source
+        factors = ['cohorts', 'missing', 'extra', 'ambig', 'ins', 'unk',
+                   'missing_feats', 'extra_feats']
+        scores = []
+        # score with one factor at a time on a shallow copy, so the
+        # learner's own weights stay as they are
+        lr = copy.copy(self)
+        for f in factors:
+            lr.weights = {fn: 0 for fn in factors}
+            lr.weights[f] = 1
+            scores.append(sum(lr.score_window(s, i)
+                              for i, s in zip(range(len(self.target)),
+                                              self.source)))
+        total = sum(scores)
+        for f, s in zip(factors, scores):
+            p = (100.0 * s) / total
+            print(f, s, f'{p:0.2f}%')
+
+    def log_scores(self, iteration, src_path, rule_output):
+        self.update_source(src_path)
+        base_per = PER(self.source, self.target, self.target_feats,
+                       self.skip_windows)
+        rule_output.write('####################\n')
+        rule_output.write(f'## {iteration}: {self.base_score} PER_lem {base_per[0]:.2f}% PER_form {base_per[1]:.2f}%\n')
+        rule_output.write('####################\n')
+        diff = time.time() - self.last_iter_start
+        self.last_iter_start = time.time()
+        print(f'{iteration=}, base_score={self.base_score}, len(EXCLUDE)={len(self.exclude)} PER_lem {base_per[0]:.2f}% PER_form {base_per[1]:.2f}% round duration {diff:.2f}')
+
+    def run(self, source_path, out, iterations, count, initial_rule_output,
+            start_iteration=0, original_source=None, checkpoint_every=0,
+            checkpoint_dir=None):
+        # original_source is the corpus source_path was derived from (by
+        # --append or a checkpoint), for saving the final applied corpus
+        original_source = original_source or source_path
+        with (TemporaryDirectory() as tmpdir,
+              open(out, 'w') as rule_output):
+            rule_output.write(initial_rule_output)
+            rule_output.flush()
+            tgt_path = source_path
+            for iteration in range(start_iteration, iterations):
+                phases.begin_iteration(iteration)
+                src_path = os.path.join(tmpdir, f'output.{iteration}.bin')
+                if iteration == start_iteration:
+                    src_path = source_path
+                save = (checkpoint_every > 0 and iteration > start_iteration
+                        and iteration % checkpoint_every == 0)
+                if save:
+                    # the grammar so far, without this iteration's header
+                    with open(out) as fin:
+                        rule_text = fin.read()
+                with phases.timed('rescore'):
+                    self.log_scores(iteration, src_path, rule_output)
+                if save:
+                    checkpoint.save(checkpoint_dir, iteration, src_path, {
+                        'output': rule_text,
+                        'exclude': list(self.exclude),
+                        'base_score': self.base_score,
+                    })
+                tgt_path = os.path.join(tmpdir, f'output.{iteration+1}.bin')
+
+                with phases.timed('generation'):
+                    self.update_candidates()
+                    rules = self.candidate_rules(count)
+
+                selected_rules = self.choose_rules(rules, src_path, tmpdir,
+                                                   iteration)
+
+                gpath = os.path.join(tmpdir, f'grammar.{iteration}.cg3')
+                rule_str = '\n'.join(r[1] for r in selected_rules)
+                with open(gpath, 'w') as fout:
+                    fout.write(self.header + rule_str)
+                rule_output.write(rule_str + '\n\n')
+                rule_output.flush()
+                with phases.timed('apply'):
+                    cg_apply.apply_file(gpath, src_path, tgt_path)
+            phases.begin_iteration(None)
+            # log final values after all iterations
+            with phases.timed('rescore'):
+                self.log_scores(iterations, tgt_path, rule_output)
+            rule_output.flush()
+            applied_corpus.save(out, original_source, tgt_path)
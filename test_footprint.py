@@ -0,0 +1,71 @@
+import shutil
+import subprocess
+
+import pytest
+
+cg3 = pytest.importorskip('cg3')
+
+import cg3_score
+import cg_apply
+import footprint
+import rule_graph
+from round13 import format_relation
+
+# The footprint taken from a rule's scoring run has to match what the
+# standalone intersection pass (relation rules only) finds.
+
+pytestmark = pytest.mark.skipif(
+    not (shutil.which('vislcg3') and shutil.which('cg-conv')),
+    reason='needs vislcg3 and cg-conv')
+
+HEADER = 'DELIMITERS = "<$$$>" ;\n'
+
+CORPUS = '''
+^a/"the"<SOURCE><DET><#1→2>/"ho"<DET><#1→2>$ ^b/"dog"<SOURCE><NOUN><#2→3>/"kyon"<NOUN><#2→3>$ ^c/"runs"<SOURCE><VERB><#3→0>/"trechei"<VERB><#3→0>$
+^d/"a"<SOURCE><DET><#1→2>/"tis"<DET><#1→2>$ ^e/"cat"<SOURCE><NOUN><#2→0>/"ailouros"<NOUN><#2→0>$
+^f/"dog"<SOURCE><NOUN><#1→0>/"kyon"<NOUN><#1→0>$
+'''
+
+RULES = [
+    (('remcohort', 'DET', 'p (NOUN)'),
+     'REMCOHORT (*) IF (0 (DET)) (p (NOUN)) ;'),
+    (('remove', 'NOUN', 'c (DET)'),
+     'REMOVE (NOUN) IF (0 (NOUN)) (c (DET)) ;'),
+]
+
+def corpus_blocks():
+    conv = subprocess.run(['cg-conv', '-a'], input=CORPUS.encode('utf-8'),
+                          capture_output=True, check=True)
+    data = subprocess.run(['cg-conv', '-Z', '--dep-delimit'],
+                          input=conv.stdout, capture_output=True,
+                          check=True).stdout
+    return list(cg3_score.iter_blocks(data))
+
+def standalone(blocks, relations):
+    # what calc_intersection reads off its relation-only pass
+    targets, contexts = set(), set()
+    for block in cg_apply.apply_blocks(relations.replace('{NUM}', '0'),
+                                       blocks):
+        window = cg3.parse_binary_window(bytes(block[5:]))
+        for cohort in window.cohorts:
+            for tag, heads in cohort.relations.items():
+                if tag == 'tr0':
+                    targets.add(cohort.dep_self)
+                elif tag == 'r0':
+                    contexts.update(heads)
+    return targets, contexts
+
+def test_remcohort_footprint():
+    blocks = corpus_blocks()
+    windows = list(range(len(blocks)))
+    targets, contexts = {}, {}
+    for i, (key, rule) in enumerate(RULES):
+        relations = format_relation(key[1], key[2])
+        grammar = footprint.relation_grammar(HEADER, rule, relations)
+        out = cg_apply.apply_blocks(grammar, blocks)
+        t, c, touched = footprint.collect(windows, blocks, out)
+        assert (t, c) == standalone(blocks, relations)
+        assert c
+        targets[i], contexts[i] = t, c
+    # the deleted determiner is the context the second rule looks at
+    assert rule_graph.interaction_masks(2, targets, contexts) == [2, 1]
@@ -0,0 +1,86 @@
+from collections import defaultdict
+import copy
+import random
+from types import SimpleNamespace
+
+import linearize
+from linearize import Rule, WindowLinearizer
+
+# WindowLinearizer.add_rule only re-extracts the parts of the sequence a
+# rule changes; check it against extracting the whole tree again.
+
+def make_window(heads, tags):
+    # heads[i] and tags[i] are those of word i+1
+    cohorts = []
+    for i, (h, t) in enumerate(zip(heads, tags), 1):
+        reading = SimpleNamespace(lemma=f'"w{i}"', tags=t)
+        cohorts.append(SimpleNamespace(dep_self=i, dep_parent=h,
+                                       readings=[reading]))
+    return SimpleNamespace(cohorts=cohorts)
+
+def reset(wl, fronting=None, backing=None):
+    # give wl fronting and backing as if earlier rules had set them
+    for gp, ws in (fronting or {}).items():
+        wl.fronting[gp].update(ws)
+    for gp, ws in (backing or {}).items():
+        wl.backing[gp].update(ws)
+    wl.unshifted = list(wl.extract(0))
+    wl.unshifted_pos = {w: i for i, w in enumerate(wl.unshifted)}
+    wl.sequence = wl.unshifted[:]
+    wl.apply_shifts(wl.sequence)
+
+def check_rule(wl, rule):
+    # a trial, then adding the rule, against re-extracting everything
+    full = copy.deepcopy(wl)
+    full.add_rule(rule, len(linearize.ALL_RULES))
+    expected = list(full.extract(0))
+    full.apply_shifts(expected)
+    assert wl.add_rule(rule) == expected
+    assert wl.add_rule(rule, len(linearize.ALL_RULES)) == expected
+    assert wl.sequence == expected
+    assert wl.unshifted == list(wl.extract(0))
+
+def test_cancelled_backing():
+    linearize.ALL_RULES = []
+    tags = [['X'], ['X'], ['"c"', 'A'], ['X'], ['X'], ['X']]
+    wl = WindowLinearizer(make_window([0, 1, 2, 2, 1, 4], tags))
+    reset(wl, backing={1: {3: 1, 4: 1}, 0: {2: 1, 5: 1}})
+    rule = Rule(rtags={'"c"', 'A'}, weight=1, mode='F')
+    check_rule(wl, rule)
+    assert sorted(wl.sequence) == [1, 2, 3, 4, 5, 6]
+
+def test_random_front_back():
+    r = random.Random(0)
+    weights = [-2, -1, 1, 2]
+    for _ in range(300):
+        linearize.ALL_RULES = []
+        n = r.randrange(2, 10)
+        heads = [0] + [r.randrange(1, i) for i in range(2, n + 1)]
+        tags = [[r.choice('ABC')] for _ in heads]
+        wl = WindowLinearizer(make_window(heads, tags))
+        # fronting and backing of words to their grandparents
+        moves = [defaultdict(dict), defaultdict(dict)]
+        for i, h in enumerate(heads, 1):
+            if h and r.random() < 0.5:
+                moves[r.randrange(2)][heads[h-1]][i] = r.choice(weights)
+        reset(wl, *moves)
+        for _ in range(4):
+            rule = Rule(mode=r.choice('FBLRS'), weight=r.choice(weights))
+            if r.random() < 0.7:
+                rule.ltags = {r.choice('ABC')}
+            if r.random() < 0.7:
+                rule.rtags = {r.choice('ABC')}
+            check_rule(wl, rule)
+            linearize.ALL_RULES.append(rule)
+
+def test_rule_index_follows_all_rules():
+    window = make_window([0, 1], [['A'], ['B']])
+    old = Rule(ltags={'A'}, rtags={'B'}, weight=1, mode='L')
+    new = Rule(ltags={'A'}, rtags={'B'}, weight=1, mode='R')
+    linearize.ALL_RULES = [old]
+    assert WindowLinearizer(window).sequence == [2, 1]
+    linearize.ALL_RULES[:] = [new]
+    assert WindowLinearizer(window).sequence == [1, 2]
+    linearize.ALL_RULES.clear()
+    linearize.ALL_RULES.append(old)
+    assert WindowLinearizer(window).sequence == [2, 1]
@@ -0,0 +1,27 @@
+import importlib
+import sys
+
+import tbl
+
+# The learners share tbl.Learner and only parse arguments in main(), so
+# they can all be imported into one process.
+
+def test_learners_import(monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['learner', '--not-an-option'])
+    classes = {'round12': 'ContextLearner', 'round13': 'Learner',
+               'round14': 'PoolLearner', 'fix_tree2': 'TreeLearner'}
+    for name, cls in classes.items():
+        module = importlib.import_module(name)
+        assert issubclass(getattr(module, cls), tbl.Learner)
+
+def test_select_rules():
+    lr = tbl.Learner.__new__(tbl.Learner)
+    rules = [(None, 'ADDCOHORT ("<ins>" "a" DET @det) BEFORE (*) ;'),
+             (None, 'ADDCOHORT ("<ins>" "a" DET @det) AFTER (*) ;'),
+             (None, 'REMOVE (x) ;'),
+             (None, 'REMOVE (y) ;')]
+    # rule 3 touches what rule 2 does
+    intersections = [0, 0, 1 << 3, 1 << 2]
+    scored = [(1, rules[0], 0), (2, rules[1], 1), (3, rules[2], 2),
+              (4, rules[3], 3)]
+    assert lr.select_rules(scored, intersections) == [rules[0], rules[2]]
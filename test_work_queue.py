@@ -0,0 +1,49 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import work_queue
+
+# DirQueue with real worker processes: a job put back because its worker
+# stopped responding for a while must only produce one result, and
+# closing one learner's queue must not stop workers started by hand.
+
+def start_worker(directory, stop):
+    return subprocess.Popen(
+        [sys.executable, work_queue.__file__, str(directory),
+         '--stop', str(stop)],
+        stdout=subprocess.PIPE, text=True)
+
+def test_paused_worker_result_dropped(tmp_path):
+    stop = tmp_path / 'stop.test'
+    with work_queue.DirQueue(tmp_path, timeout=2) as q:
+        job = q.submit([sys.executable, '-c',
+                        'import time; time.sleep(1); print("score 3")'])
+        slow = start_worker(tmp_path, stop)
+        while os.listdir(tmp_path / 'jobs'):
+            time.sleep(0.05)
+        # it stops heartbeating long enough for the job to be put back
+        os.kill(slow.pid, signal.SIGSTOP)
+        other = start_worker(tmp_path, stop)
+        assert job.result() == 'score 3\n'
+        os.kill(slow.pid, signal.SIGCONT)
+        time.sleep(1)
+    stop.touch()
+    out, _ = slow.communicate(timeout=10)
+    other.communicate(timeout=10)
+    assert f'dropping result of {job.id}' in out
+    assert os.listdir(tmp_path / 'results') == []
+    assert os.listdir(tmp_path / 'claimed') == []
+
+def test_close_leaves_other_workers(tmp_path):
+    by_hand = start_worker(tmp_path, tmp_path / 'stop')
+    with work_queue.DirQueue(tmp_path, local_workers=2) as q:
+        jobs = [q.submit(['echo', f'score {i}']) for i in range(4)]
+        assert [j.result() for j in jobs] == [f'score {i}\n' for i in range(4)]
+    assert not os.path.exists(q.stop)
+    time.sleep(1)
+    assert by_hand.poll() is None
+    (tmp_path / 'stop').touch()
+    by_hand.communicate(timeout=10)
@@ -61,6 +61,9 @@ class Sentence(BaseSentence):
     def before(self, a, b):
         return self.idmap[a] < self.idmap[b]
 
+    def target_span(self, a):
+        return self.idmap[a], self.idmap[a]
+
 @dataclass
 class Trainer(BaseTrainer):
     sentence_class = Sentence
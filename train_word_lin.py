@@ -31,6 +31,11 @@ class Sentence(BaseSentence):
             return False
         return self.alignments[a][-1] < self.alignments[b][0]
 
+    def target_span(self, a):
+        if not self.alignments.get(a):
+            return None
+        return self.alignments[a][0], self.alignments[a][-1]
+
 @dataclass
 class Trainer(BaseTrainer):
     sentence_class = Sentence
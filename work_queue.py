@@ -0,0 +1,277 @@
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+# Runs scoring commands for the lex_* scripts. Each command is one
+# candidate grammar scored against the current source and target files.
+# Workers take the next command as soon as they are free, instead of the
+# whole batch waiting for its slowest member.
+#
+# LocalPool runs them on this machine with a thread per slot.
+#
+# DirQueue hands them to workers through a directory on a filesystem
+# shared by every node:
+#
+#   jobs/ID.json      waiting; a worker claims a job by renaming it
+#   claimed/ID@WORKER being run; the worker touches it every HEARTBEAT
+#                     seconds, and one that goes quiet for longer than
+#                     the queue's timeout is put back in jobs/
+#   claimed/ID@WORKER.done
+#                     finished; the worker renames its claim to this
+#                     before writing the result, so a worker whose job
+#                     was put back (because it was slow rather than
+#                     dead) finds its claim gone and drops its result
+#   results/ID.json   finished, with the command's output
+#   stop              tells workers started by hand to exit once idle
+#   stop.PREFIX       the same for the workers one DirQueue started
+#
+# Start workers on each node with
+#
+#   python3 work_queue.py DIR --processes N
+#
+# Every file a job refers to has to be on the shared filesystem too, at
+# the same path on every node. DirQueue can also start local worker
+# processes itself, which is enough for testing.
+
+HEARTBEAT = 5
+
+class LocalPool:
+    def __init__(self, threads):
+        self.executor = ThreadPoolExecutor(threads)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    def submit(self, cmd):
+        # returns a future whose result() is the command's stdout
+        return self.executor.submit(run_command, cmd, os.getcwd())
+
+def run_command(cmd, cwd):
+    return subprocess.run(cmd, cwd=cwd, capture_output=True, text=True,
+                          check=True).stdout
+
+def write_json(path, data):
+    tmp = os.path.join(os.path.dirname(path),
+                       f'.{os.path.basename(path)}.{uuid.uuid4().hex}')
+    with open(tmp, 'w') as fout:
+        json.dump(data, fout)
+    os.replace(tmp, path)
+
+class Job:
+    def __init__(self, queue, job_id, cmd):
+        self.queue = queue
+        self.id = job_id
+        self.cmd = cmd
+
+    def result(self):
+        path = self.queue.path('results', self.id)
+        delay = 0.01
+        while not os.path.exists(path):
+            self.queue.requeue_stale()
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        with open(path) as fin:
+            res = json.load(fin)
+        os.unlink(path)
+        self.queue.pending.discard(self.id)
+        if res['returncode'] != 0:
+            raise subprocess.CalledProcessError(
+                res['returncode'], self.cmd, res['stdout'], res['stderr'])
+        return res['stdout']
+
+class DirQueue:
+    def __init__(self, directory, timeout=60, local_workers=0):
+        self.directory = os.path.abspath(directory)
+        self.timeout = timeout
+        self.prefix = f'{time.time_ns()}-{os.getpid()}'
+        self.counter = itertools.count()
+        # a claim can't go stale faster than this, so there is no point
+        # listing claimed/ more often, however many jobs are waited on
+        self.sweep_every = min(HEARTBEAT, timeout / 2)
+        self.next_sweep = 0
+        # submitted jobs whose result hasn't been read yet
+        self.pending = set()
+        for d in ['jobs', 'claimed', 'results']:
+            os.makedirs(os.path.join(self.directory, d), exist_ok=True)
+        # our own workers stop when we are done, the others keep serving
+        # whoever else uses the directory
+        self.stop = os.path.join(self.directory, f'stop.{self.prefix}')
+        self.workers = [
+            subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                              self.directory, '--processes', '1',
+                              '--stop', self.stop])
+            for _ in range(local_workers)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.workers:
+            with open(self.stop, 'w'):
+                pass
+            for w in self.workers:
+                w.wait()
+            self.workers = []
+            os.unlink(self.stop)
+        # results nobody is waiting for: late duplicates of jobs that were
+        # put back, and jobs left when the learner stopped early
+        results = os.path.join(self.directory, 'results')
+        for name in os.listdir(results):
+            if name.startswith(self.prefix + '-'):
+                try:
+                    os.unlink(os.path.join(results, name))
+                except FileNotFoundError:
+                    pass
+
+    def path(self, d, job_id):
+        return os.path.join(self.directory, d, job_id + '.json')
+
+    def submit(self, cmd):
+        # IDs sort in submission order, so workers take the oldest first
+        job_id = f'{self.prefix}-{next(self.counter):08}'
+        write_json(self.path('jobs', job_id), {'cmd': cmd, 'cwd': os.getcwd()})
+        self.pending.add(job_id)
+        return Job(self, job_id, cmd)
+
+    def requeue_stale(self):
+        # puts back any pending job whose worker stopped responding; a .done
+        # claim whose worker died before writing the result is put back
+        # too, unless the result has turned up since
+        now = time.time()
+        if now < self.next_sweep:
+            return
+        self.next_sweep = now + self.sweep_every
+        claimed_dir = os.path.join(self.directory, 'claimed')
+        for name in os.listdir(claimed_dir):
+            job_id = name.split('@')[0]
+            if job_id not in self.pending:
+                continue
+            if os.path.exists(self.path('results', job_id)):
+                continue
+            claimed = os.path.join(claimed_dir, name)
+            try:
+                if time.time() - os.stat(claimed).st_mtime > self.timeout:
+                    os.rename(claimed, self.path('jobs', job_id))
+                    worker = name.split('@')[1].removesuffix('.done')
+                    print(f'requeued {job_id}, worker {worker} stopped responding')
+            except FileNotFoundError:
+                pass
+
+def open_pool(threads, queue_dir=None, local_workers=0):
+    if queue_dir:
+        return DirQueue(queue_dir, local_workers=local_workers)
+    return LocalPool(threads)
+
+def claim(directory, worker_id):
+    # the oldest job no other worker has renamed first, or None
+    jobs = os.path.join(directory, 'jobs')
+    for name in sorted(os.listdir(jobs)):
+        if not name.endswith('.json'):
+            continue
+        job_id = name[:-5]
+        claimed = os.path.join(directory, 'claimed', f'{job_id}@{worker_id}')
+        try:
+            os.rename(os.path.join(jobs, name), claimed)
+        except FileNotFoundError:
+            continue
+        os.utime(claimed)
+        return job_id, claimed
+    return None
+
+def run_job(directory, job_id, claimed):
+    with open(claimed) as fin:
+        job = json.load(fin)
+    proc = subprocess.Popen(job['cmd'], cwd=job['cwd'], text=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    done = threading.Event()
+    def heartbeat():
+        while not done.wait(HEARTBEAT):
+            try:
+                os.utime(claimed)
+            except FileNotFoundError:
+                return
+    beat = threading.Thread(target=heartbeat, daemon=True)
+    beat.start()
+    out, err = proc.communicate()
+    done.set()
+    beat.join()
+    finished = claimed + '.done'
+    try:
+        os.rename(claimed, finished)
+    except FileNotFoundError:
+        # put back while we were running, so someone else has it
+        print(f'dropping result of {job_id}, it was requeued')
+        return
+    os.utime(finished)
+    write_json(os.path.join(directory, 'results', job_id + '.json'), {
+        'returncode': proc.returncode,
+        'stdout': out,
+        'stderr': err,
+        'host': socket.gethostname(),
+    })
+    try:
+        os.unlink(finished)
+    except FileNotFoundError:
+        pass
+
+def worker(directory, idle_exit=0, stop=None):
+    stop = stop or os.path.join(directory, 'stop')
+    worker_id = f'{socket.gethostname()}-{os.getpid()}'
+    delay = 0.01
+    idle_since = time.time()
+    while True:
+        job = claim(directory, worker_id)
+        if job is not None:
+            run_job(directory, *job)
+            delay = 0.01
+            idle_since = time.time()
+            continue
+        if os.path.exists(stop):
+            return
+        if idle_exit and time.time() - idle_since > idle_exit:
+            return
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('queue', help='queue directory shared with the learner')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='number of workers to run on this node')
+    parser.add_argument('--idle_exit', type=float, default=0,
+                        help='exit after this many seconds without a job')
+    parser.add_argument('--stop', action='store',
+                        help='file whose appearance tells the workers to '
+                        'exit once idle (default DIR/stop)')
+    args = parser.parse_args()
+    directory = os.path.abspath(args.queue)
+    for d in ['jobs', 'claimed', 'results']:
+        os.makedirs(os.path.join(directory, d), exist_ok=True)
+    stop = os.path.abspath(args.stop or os.path.join(directory, 'stop'))
+    if args.processes == 1:
+        worker(directory, args.idle_exit, stop)
+    else:
+        procs = [subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                   directory, '--processes', '1',
+                                   '--idle_exit', str(args.idle_exit),
+                                   '--stop', stop])
+                 for _ in range(args.processes)]
+        for p in procs:
+            p.wait()